@@ -0,0 +1,165 @@
+"""
+# This file contains the analytics used by the /api/expense and /api/pattern routes.
+
+The transactions of a user are loaded once into columnar NumPy arrays (amount, month as
+datetime64 and an integer code per category) and the spending per category is computed
+with bincount group-bys instead of a Python loop per transaction.
+
+these Function have no dependencies on the Flask application object and return values that can be passed to jsonify.
+
+analytics.py
+
+"""
+
+import numpy as np
+
+
+class TransactionColumns:
+    """
+    #Columnar view of a list of transactions.
+
+    #Args:
+        transactions (list): List of transactions with an amount, a category and, if with_dates, a date.
+        with_dates (bool): Parse the date of the transactions into months.
+    """
+
+    def __init__(self, transactions, with_dates=True):
+        codes = {}
+        category_codes = []
+        amounts = []
+        dates = []
+        for transaction in transactions or []:
+            category = tuple(transaction.get('category') or [])
+            category_codes.append(codes.setdefault(category, len(codes)))
+            amounts.append(transaction['amount'])
+            if with_dates:
+                dates.append(transaction['date'])
+        self.categories = list(codes)
+        self.codes = np.array(category_codes, dtype=np.int64)
+        self.amounts = np.array(amounts, dtype=np.float64)
+        self.months = np.array(dates, dtype='datetime64[D]').astype('datetime64[M]') if with_dates else None
+
+    def spending(self, mask=None):
+        """
+        #Compute the spending per category of the transactions with a positive amount.
+
+        #Args:
+            mask (numpy.ndarray): Optional boolean array selecting the transactions to include.
+
+        #Returns:
+            dict: Dictionary mapping category tuples to the amount spent, only categories with spending are included.
+        """
+        selected = self.amounts > 0
+        if mask is not None:
+            selected &= mask
+        counts = np.bincount(self.codes[selected], minlength=len(self.categories))
+        sums = np.bincount(self.codes[selected], weights=self.amounts[selected], minlength=len(self.categories))
+        return {self.categories[code]: float(sums[code]) for code in np.flatnonzero(counts)}
+
+    def latestSpendingMonth(self):
+        """
+        #Find the latest month with spending.
+
+        #Returns:
+            numpy.datetime64: The month, None if there are no transactions with a positive amount.
+        """
+        months = self.months[self.amounts > 0]
+        if len(months) == 0:
+            return None
+        return months.max()
+
+
+def topCategories(category_spending, total_spending, size):
+    """
+    #Format the categories with the highest spending.
+
+    #Args:
+        category_spending (dict): Dictionary mapping category tuples to the amount spent.
+        total_spending (float): Total amount spent.
+        size (int): Number of categories to return.
+
+    #Returns:
+        list: The top categories with their amount and percentage of the total spending.
+    """
+    top_categories = sorted(category_spending.items(), key=lambda x: x[1], reverse=True)[:size]
+    top_categories_data = []
+
+    for category, amount in top_categories:
+        percentage = round((amount / total_spending) * 100, 2)
+        top_categories_data.append({
+            'category': category,
+            'amount': amount,
+            'percentage': percentage
+        })
+    return top_categories_data
+
+
+def categoryChanges(current_month_transactions, previous_month_transactions, size):
+    """
+    #Format the categories with the highest spending in a month and their change from the month before.
+
+    #Args:
+        current_month_transactions (dict): Dictionary mapping category tuples to the amount spent in the month.
+        previous_month_transactions (dict): Dictionary mapping category tuples to the amount spent in the month before.
+        size (int): Number of categories to return.
+
+    #Returns:
+        list: The top categories with their amount, percentage change and change type.
+    """
+    top_categories = sorted(current_month_transactions.items(), key=lambda x: x[1], reverse=True)[:size]
+    top_categories_data = []
+
+    for category, amount in top_categories:
+        current_month_spending = current_month_transactions.get(category, 0)
+        previous_month_spending = previous_month_transactions.get(category, 0)
+        percentage_change = round(((current_month_spending - previous_month_spending) / previous_month_spending) * 100, 2) if previous_month_spending != 0 else 0
+
+        if percentage_change > 0:
+            change_type = 'increase'
+        elif percentage_change < 0:
+            change_type = 'decrease'
+        else:
+            change_type = 'no change'
+
+        top_categories_data.append({
+            'category': category,
+            'amount': current_month_spending,
+            'percentage_change': percentage_change,
+            'change_type': change_type
+        })
+    return top_categories_data
+
+
+def expenseReport(transactions, size):
+    """
+    #Compute the categories with the highest spending over all the transactions.
+
+    #Args:
+        transactions (list): List of transactions with an amount and a category.
+        size (int): Number of categories to return.
+
+    #Returns:
+        list: The top categories with their amount and percentage of the total spending.
+    """
+    columns = TransactionColumns(transactions, with_dates=False)
+    category_spending = columns.spending()
+    return topCategories(category_spending, sum(category_spending.values()), size)
+
+
+def patternReport(transactions, size):
+    """
+    #Compute the categories with the highest spending in the latest month with spending and their change from the month before.
+
+    #Args:
+        transactions (list): List of transactions with an amount, a category and a date.
+        size (int): Number of categories to return.
+
+    #Returns:
+        list: The top categories with their amount, percentage change and change type.
+    """
+    columns = TransactionColumns(transactions)
+    current_month = columns.latestSpendingMonth()
+    if current_month is None:
+        return []
+    return categoryChanges(columns.spending(columns.months == current_month),
+                           columns.spending(columns.months == current_month - 1), size)
@@ -0,0 +1,64 @@
+"""
+    #This module serves the Flask server with gevent, so I/O-bound requests do not hold an OS thread each.
+
+    The standard library is monkey patched before server.py is imported, which makes the sockets of
+    pymongo and of the Plaid client cooperative: a request waiting on Plaid or MongoDB yields to the
+    other requests, and every request runs in a greenlet instead of a thread. The per-item Plaid calls of
+    fanout.py run in greenlets as well and are waited on together.
+
+    #dependencies:
+        - same as server.py
+        - gevent
+    #environment variables:
+        - same as server.py
+        - ASYNC_MAX_CONNECTIONS from .env (optional, maximum number of requests served concurrently)
+        - WEB_GRACEFUL_TIMEOUT from .env (optional, seconds the requests in flight are given to finish on SIGTERM)
+
+    #To run the server, run the following command in the terminal:
+        python asyncserver.py
+
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+import signal
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from dotenv import load_dotenv
+
+# .env is loaded before the settings below and the PLAID_MAX_WORKERS default are read
+load_dotenv()
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', 1000))
+WEB_GRACEFUL_TIMEOUT = float(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+# greenlets are cheap, allow many more concurrent Plaid calls than with threads
+os.environ.setdefault('PLAID_MAX_WORKERS', '200')
+
+import server
+
+
+def serve(port):
+    """
+    #Serve the Flask app with gevent until the process is stopped.
+
+    On SIGTERM the server stops accepting connections and waits up to WEB_GRACEFUL_TIMEOUT seconds
+    for the requests in flight.
+
+    #Args:
+        port (int): Port to listen on.
+
+    #Returns:
+        None
+    """
+    http_server = WSGIServer(('0.0.0.0', port), server.create_app(), spawn=Pool(ASYNC_MAX_CONNECTIONS))
+    gevent.signal_handler(signal.SIGTERM, http_server.stop, WEB_GRACEFUL_TIMEOUT)
+    http_server.serve_forever()
+    server.closeClients()
+
+
+if __name__ == '__main__':
+    serve(int(os.getenv('PORT', 8000)))
@@ -0,0 +1,410 @@
+"""
+# This file contains the micro-benchmarks of the data access functions of components.py.
+
+For every size tier, the users collection of a separate database is filled with synthetic users
+holding --accounts accounts and the tier's number of embedded transactions, with the indexes of
+bootstrap.ensureIndexes, and every benchmarked function is timed on one of the users:
+
+    - checkIfAccessTokenExits, getCursor, getAllTransactions
+    - addTransactions and addTransactionsv1, appending a page of --page new transactions
+
+Besides the time, one more call of every function records the bytes sent to and received from
+MongoDB, with a pymongo command listener, and the documents examined by its commands, by running
+them again with explain. The results are printed and written as JSON with --json, with the growth
+exponent of every measure across the tiers (1 means linear in the number of transactions).
+--baseline compares the results to an earlier JSON file and exits with 1 on a regression.
+
+The bytes and documents examined require a real MongoDB, with --mongo mongomock only the
+functions mongomock supports are timed.
+
+#To run the benchmarks, run the following command in the terminal:
+    python bench/componentsbench.py --mongo mongodb://localhost:27017 --tiers 100,1000,10000,100000 --json results.json
+
+componentsbench.py
+
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson
+from pymongo import monitoring
+from pymongo.errors import DocumentTooLarge
+
+from bootstrap import ensureIndexes
+from components import addTransactions, addTransactionsv1, checkIfAccessTokenExits, getAllTransactions, getCursor
+
+# commands explain can run, with the field holding their statements
+EXPLAINABLE = {'find': None, 'aggregate': None, 'count': None, 'distinct': None, 'findAndModify': None,
+               'update': 'updates', 'delete': 'deletes'}
+# fields added by the driver that explain does not accept
+DRIVER_FIELDS = ('lsid', 'txnNumber', '$db', '$clusterTime', '$readPreference', 'readConcern', 'writeConcern')
+MERCHANTS = ['Starbucks', 'Uber', 'Whole Foods', 'United Airlines', 'McDonalds', 'Planet Fitness', 'Con Edison', 'Target']
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """
+    #Command listener recording the commands sent by the current thread while recording is on.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def start(self):
+        self.local.commands = []
+
+    def stop(self):
+        commands = getattr(self.local, 'commands', None)
+        self.local.commands = None
+        return commands or []
+
+    def started(self, event):
+        commands = getattr(self.local, 'commands', None)
+        if commands is not None:
+            commands.append({'name': event.command_name, 'command': event.command, 'request_id': event.request_id,
+                             'sent': len(bson.encode(event.command)), 'received': 0})
+
+    def succeeded(self, event):
+        commands = getattr(self.local, 'commands', None)
+        if commands is not None:
+            for command in commands:
+                if command['request_id'] == event.request_id:
+                    command['received'] = len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+def executionStats(explained):
+    """
+    #Function to collect the executionStats of an explain output, one for every shard or pipeline cursor.
+
+    #Args:
+        explained (dict): Output of the explain command.
+
+    #Returns:
+        list: The executionStats documents.
+    """
+    if isinstance(explained, dict):
+        if 'executionStats' in explained:
+            return [explained['executionStats']]
+        return [stats for value in explained.values() for stats in executionStats(value)]
+    if isinstance(explained, list):
+        return [stats for value in explained for stats in executionStats(value)]
+    return []
+
+
+def docsExamined(db, commands):
+    """
+    #Function to count the documents examined by recorded commands, by running them again with explain.
+
+    Explain does not apply the writes of update and delete commands.
+
+    #Args:
+        db (database): MongoDB database the commands ran on.
+        commands (list): Commands recorded by CommandRecorder.
+
+    #Returns:
+        int: Total number of documents examined.
+    """
+    total = 0
+    for recorded in commands:
+        if recorded['name'] not in EXPLAINABLE:
+            continue
+        command = {key: value for key, value in recorded['command'].items() if key not in DRIVER_FIELDS}
+        statements_field = EXPLAINABLE[recorded['name']]
+        statements = [command]
+        if statements_field is not None:
+            statements = [dict(command, **{statements_field: [statement]}) for statement in command[statements_field]]
+        for statement in statements:
+            explained = db.command('explain', statement, verbosity='executionStats')
+            total += sum(stats.get('totalDocsExamined', 0) for stats in executionStats(explained))
+    return total
+
+
+def createTransactions(account_id, count, start=0, categories=20):
+    """
+    #Function to create synthetic transactions shaped like the ones stored by the server.
+
+    #Args:
+        account_id (str): ID of the account of the transactions.
+        count (int): Number of transactions.
+        start (int): Number of the first transaction, transaction ids are unique per account and number.
+        categories (int): Number of distinct categories.
+
+    #Returns:
+        list: The transactions.
+    """
+    today = datetime.date.today()
+    transactions = []
+    for number in range(start, start + count):
+        draw = random.random()
+        transactions.append({
+            'transaction_id': f'{account_id}-{number}',
+            'account_id': account_id,
+            'amount': round(1 + draw * 200, 2),
+            'date': str(today - datetime.timedelta(days=int(draw * 730))),
+            'authorized_date': str(today - datetime.timedelta(days=int(draw * 730))),
+            'category': ['Category', f'Category {number % categories}'],
+            'merchant_name': MERCHANTS[number % len(MERCHANTS)],
+            'name': MERCHANTS[number % len(MERCHANTS)],
+            'pending': False,
+            'payment_channel': 'in store',
+            'iso_currency_code': 'USD',
+        })
+    return transactions
+
+
+def createUser(email, accounts, transactions, categories):
+    """
+    #Function to create a synthetic user document with its accounts and embedded transactions.
+
+    #Args:
+        email (str): Email of the user.
+        accounts (int): Number of accounts.
+        transactions (int): Number of transactions, split evenly across the accounts.
+        categories (int): Number of distinct categories.
+
+    #Returns:
+        dict: The user document.
+    """
+    per_account = transactions // accounts
+    return {
+        'email': email,
+        'account': [{'access_token': f'access-{email}-{i}', 'item_id': f'item-{email}-{i}'} for i in range(accounts)],
+        'transactions': [{
+            'account_id': f'account_{i + 1}',
+            'transactions': createTransactions(f'account_{i + 1}', per_account, categories=categories),
+            'cursor': f'cursor-{per_account}',
+        } for i in range(accounts)],
+    }
+
+
+def measure(db, recorder, function, repeat):
+    """
+    #Function to time a function and record the MongoDB traffic and documents examined of one more call.
+
+    #Args:
+        db (database): MongoDB database the function runs on.
+        recorder (CommandRecorder): Listener registered on the client of db, None if there is none.
+        function (callable): Called without arguments.
+        repeat (int): Number of timed calls.
+
+    #Returns:
+        dict: Median and minimum milliseconds, bytes sent and received, documents examined and commands.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    result = {'median_ms': statistics.median(times) * 1000, 'min_ms': min(times) * 1000,
+              'bytes_sent': None, 'bytes_received': None, 'docs_examined': None, 'commands': None}
+    if recorder is not None:
+        recorder.start()
+        try:
+            function()
+        finally:
+            commands = recorder.stop()
+        result['bytes_sent'] = sum(command['sent'] for command in commands)
+        result['bytes_received'] = sum(command['received'] for command in commands)
+        result['docs_examined'] = docsExamined(db, commands)
+        result['commands'] = [command['name'] for command in commands]
+    return result
+
+
+def runTier(db, recorder, transactions, args):
+    """
+    #Function to seed the users of a tier and run every benchmark on one of them.
+
+    #Args:
+        db (database): MongoDB database of the benchmarks, its users collection is replaced.
+        recorder (CommandRecorder): Listener registered on the client of db, None if there is none.
+        transactions (int): Number of transactions of every user.
+        args (argparse.Namespace): Parsed arguments.
+
+    #Returns:
+        dict: Size of the benchmarked user document and the result of every function.
+    """
+    collection = db['users']
+    collection.drop()
+    ensureIndexes(db)
+    users = [createUser(f'user{u}@example.com', args.accounts, transactions, args.categories) for u in range(args.users)]
+    try:
+        for user in users:
+            collection.insert_one(user)
+    except DocumentTooLarge as e:
+        # the embedded schema cannot hold this many transactions in one user document
+        return {'transactions': transactions, 'document_bytes': len(bson.encode(users[0])), 'error': str(e), 'results': {}}
+
+    email = users[-1]['email']
+    account_id = f'account_{args.accounts}'
+    access_token = users[-1]['account'][-1]['access_token']
+    state = {'cursor': users[-1]['transactions'][-1]['cursor'], 'next': transactions}
+
+    def appendPage(add):
+        def run():
+            page = createTransactions(account_id, args.page, start=state['next'], categories=args.categories)
+            cursor = f"cursor-{state['next'] + args.page}"
+            if add is addTransactions:
+                add(collection, email, page, cursor, account_id, previous_cursor=state['cursor'])
+            else:
+                add(collection, email, page, cursor, account_id)
+            state['cursor'] = cursor
+            state['next'] += args.page
+        return run
+
+    functions = {
+        'checkIfAccessTokenExits': lambda: checkIfAccessTokenExits(collection, email, access_token),
+        'getCursor': lambda: getCursor(collection, email, account_id),
+        'getAllTransactions': lambda: getAllTransactions(collection, email),
+        'addTransactions': appendPage(addTransactions),
+        'addTransactionsv1': appendPage(addTransactionsv1),
+    }
+    results = {}
+    for name, function in functions.items():
+        if args.functions and name not in args.functions:
+            continue
+        try:
+            results[name] = measure(db, recorder, function, args.repeat)
+        except Exception as e:
+            results[name] = {'error': f'{type(e).__name__}: {e}'}
+    return {'transactions': transactions, 'document_bytes': len(bson.encode(users[-1])), 'results': results}
+
+
+def growthExponents(tiers):
+    """
+    #Function to fit the growth of every measure with the number of transactions, on a log-log scale.
+
+    #Args:
+        tiers (list): Results of runTier.
+
+    #Returns:
+        dict: {function: {measure: exponent}}, 0 for constant, 1 for linear.
+    """
+    exponents = {}
+    names = {name for tier in tiers for name in tier['results']}
+    for name in sorted(names):
+        exponents[name] = {}
+        for measure_name in ('median_ms', 'bytes_received', 'docs_examined'):
+            points = [(math.log(tier['transactions']), math.log(tier['results'][name][measure_name]))
+                      for tier in tiers
+                      if (tier['results'].get(name) or {}).get(measure_name)]
+            if len(points) < 2:
+                continue
+            mean_x = statistics.mean(x for x, _ in points)
+            mean_y = statistics.mean(y for _, y in points)
+            variance = sum((x - mean_x) ** 2 for x, _ in points)
+            exponents[name][measure_name] = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+    return exponents
+
+
+def compareToBaseline(report, baseline, tolerance):
+    """
+    #Function to find the measures that got worse than in a baseline report.
+
+    Bytes and documents examined are deterministic and may grow by 10%, times may grow by tolerance times.
+
+    #Args:
+        report (dict): Report of this run.
+        baseline (dict): Report of an earlier run.
+        tolerance (float): Allowed ratio between the times of this run and of the baseline.
+
+    #Returns:
+        list: Descriptions of the regressions.
+    """
+    regressions = []
+    baseline_tiers = {tier['transactions']: tier for tier in baseline['tiers']}
+    for tier in report['tiers']:
+        before_tier = baseline_tiers.get(tier['transactions'])
+        if before_tier is None:
+            continue
+        for name, result in tier['results'].items():
+            before = before_tier['results'].get(name)
+            if not before or 'error' in before or 'error' in result:
+                continue
+            for measure_name, allowed in (('median_ms', tolerance), ('bytes_received', 1.1), ('docs_examined', 1.1)):
+                if result.get(measure_name) and before.get(measure_name) and result[measure_name] > before[measure_name] * allowed:
+                    regressions.append(f"{name} at {tier['transactions']} transactions: {measure_name} "
+                                       f"{before[measure_name]:.1f} -> {result[measure_name]:.1f}")
+    for name, measures in report['exponents'].items():
+        for measure_name, exponent in measures.items():
+            before = baseline.get('exponents', {}).get(name, {}).get(measure_name)
+            if before is not None and exponent > before + 0.3:
+                regressions.append(f'{name}: {measure_name} grows as n^{exponent:.2f}, was n^{before:.2f}')
+    return regressions
+
+
+def printReport(report):
+    print(f"{'function':<26}{'transactions':>13}{'median ms':>11}{'sent':>10}{'received':>12}{'examined':>10}")
+    for tier in report['tiers']:
+        if 'error' in tier:
+            print(f"{'(seed)':<26}{tier['transactions']:>13}  {tier['error'][:80]}")
+        for name, result in tier['results'].items():
+            if 'error' in result:
+                print(f"{name:<26}{tier['transactions']:>13}  {result['error'][:80]}")
+                continue
+            cells = ''.join(f'{value:>{width}}' if value is not None else f"{'-':>{width}}"
+                            for value, width in ((result['bytes_sent'], 10), (result['bytes_received'], 12), (result['docs_examined'], 10)))
+            print(f"{name:<26}{tier['transactions']:>13}{result['median_ms']:>11.2f}{cells}")
+    for name, measures in report['exponents'].items():
+        if measures:
+            print(f'{name}: ' + ', '.join(f'{measure_name} ~ n^{exponent:.2f}' for measure_name, exponent in measures.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data access functions of components.py across size tiers.')
+    parser.add_argument('--mongo', default='mongodb://localhost:27017', help="URI of a MongoDB, or 'mongomock'")
+    parser.add_argument('--database', default='PlaidBench', help='database the users are created in, it is dropped at the end')
+    parser.add_argument('--tiers', default='100,1000,10000,100000', help='comma separated numbers of transactions per user')
+    parser.add_argument('--users', type=int, default=3, help='users in the collection')
+    parser.add_argument('--accounts', type=int, default=2, help='accounts of every user')
+    parser.add_argument('--categories', type=int, default=20, help='distinct categories')
+    parser.add_argument('--page', type=int, default=100, help='transactions appended by every addTransactions call')
+    parser.add_argument('--repeat', type=int, default=5, help='timed calls of every function')
+    parser.add_argument('--functions', default='', help='comma separated functions to run, all by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='file to write the results to as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare to')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='allowed ratio of the times to the baseline')
+    args = parser.parse_args()
+    args.functions = [name for name in args.functions.split(',') if name]
+    random.seed(args.seed)
+
+    recorder = None
+    if args.mongo == 'mongomock':
+        import mongomock
+        mongo_client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        recorder = CommandRecorder()
+        mongo_client = MongoClient(args.mongo, event_listeners=[recorder])
+    db = mongo_client[args.database]
+
+    tiers = []
+    try:
+        for transactions in [int(tier) for tier in args.tiers.split(',')]:
+            tiers.append(runTier(db, recorder, transactions, args))
+    finally:
+        mongo_client.drop_database(args.database)
+    report = {'options': vars(args), 'tiers': tiers, 'exponents': growthExponents(tiers)}
+    printReport(report)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compareToBaseline(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,360 @@
+"""
+# This file contains a local fake of the Plaid API used by the load tests.
+
+Implements the endpoints the server calls: link/token/create, item/public_token/exchange, item/get,
+accounts/get, accounts/balance/get and paginated transactions/sync. The responses carry every field
+plaid-python requires, so the server's Plaid client is used unchanged with PLAID_HOST pointing here.
+Every item gets the same deterministic transactions, split into pages, derived from its access token.
+
+Every response is delayed by the configured latency, a share of the calls fail with a transient
+error (INTERNAL_SERVER_ERROR or RATE_LIMIT_EXCEEDED) and a share of the items fail every call with
+ITEM_LOGIN_REQUIRED.
+
+#To run the fake on port 8100, run the following command in the terminal:
+    python bench/fakeplaid.py --port 8100 --latency 0.05 --pages 3
+
+fakeplaid.py
+
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CATEGORIES = [
+    ['Food and Drink', 'Restaurants'],
+    ['Food and Drink', 'Coffee Shop'],
+    ['Shops', 'Supermarkets and Groceries'],
+    ['Travel', 'Taxi'],
+    ['Travel', 'Airlines and Aviation Services'],
+    ['Recreation', 'Gyms and Fitness Centers'],
+    ['Service', 'Utilities'],
+    ['Transfer', 'Credit'],
+]
+MERCHANTS = ['Starbucks', 'Uber', 'Whole Foods', 'United Airlines', 'McDonalds', 'Planet Fitness', 'Con Edison', 'Target']
+
+
+class FakePlaid:
+    """
+    #State and responses of the fake Plaid API.
+
+    #Args:
+        latency (float): Seconds every response is delayed.
+        pages (int): Number of transactions/sync pages of every item.
+        page_size (int): Number of transactions on every page.
+        accounts (int): Number of accounts of every item.
+        error_rate (float): Share of the calls failing with a transient error.
+        login_required_rate (float): Share of the items failing every call with ITEM_LOGIN_REQUIRED.
+        seed (int): Seed of the generated data and of the injected errors.
+    """
+
+    def __init__(self, latency=0.0, pages=2, page_size=100, accounts=2, error_rate=0.0, login_required_rate=0.0, seed=0):
+        self.latency = latency
+        self.pages = pages
+        self.page_size = page_size
+        self.accounts = accounts
+        self.error_rate = error_rate
+        self.login_required_rate = login_required_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def fraction(self, value):
+        """
+        #Function to map a value to a deterministic number in [0, 1).
+
+        #Args:
+            value (str): Any string.
+
+        #Returns:
+            float: The number.
+        """
+        digest = hashlib.sha256(f'{self.seed}:{value}'.encode()).digest()
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+    def itemId(self, access_token):
+        return 'item-' + access_token[len('access-'):]
+
+    def accountIds(self, access_token):
+        return [f'{self.itemId(access_token)}-acc-{i}' for i in range(self.accounts)]
+
+    def error(self, status, error_type, error_code, message):
+        return status, {
+            'error_type': error_type,
+            'error_code': error_code,
+            'error_message': message,
+            'display_message': None,
+            'request_id': uuid.uuid4().hex,
+        }
+
+    def injectedError(self, body):
+        """
+        #Function to pick the error a call fails with, if any.
+
+        #Args:
+            body (dict): Request body.
+
+        #Returns:
+            tuple: (status, body) of the error response, None if the call succeeds.
+        """
+        access_token = body.get('access_token')
+        if access_token and self.fraction(access_token) < self.login_required_rate:
+            return self.error(400, 'ITEM_ERROR', 'ITEM_LOGIN_REQUIRED',
+                              'the login details of this item have changed (credentials, MFA, or required user action)')
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.error_rate / 2:
+            return self.error(500, 'API_ERROR', 'INTERNAL_SERVER_ERROR', 'an unexpected error occurred')
+        if draw < self.error_rate:
+            return self.error(429, 'RATE_LIMIT_EXCEEDED', 'RATE_LIMIT', 'rate limit exceeded')
+        return None
+
+    def account(self, account_id):
+        current = round(1000 + self.fraction(account_id) * 9000, 2)
+        return {
+            'account_id': account_id,
+            'balances': {
+                'available': current,
+                'current': current,
+                'limit': None,
+                'iso_currency_code': 'USD',
+                'unofficial_currency_code': None,
+            },
+            'mask': account_id[-4:],
+            'name': 'Plaid Checking',
+            'official_name': 'Plaid Gold Standard 0% Interest Checking',
+            'type': 'depository',
+            'subtype': 'checking',
+        }
+
+    def item(self, access_token):
+        return {
+            'item_id': self.itemId(access_token),
+            'webhook': None,
+            'error': None,
+            'available_products': ['balance'],
+            'billed_products': ['auth', 'transactions'],
+            'consent_expiration_time': None,
+            'update_type': 'background',
+            'institution_id': 'ins_109508',
+        }
+
+    def transaction(self, access_token, page, index):
+        transaction_id = f'{self.itemId(access_token)}-{page}-{index}'
+        draw = self.fraction(transaction_id)
+        category = CATEGORIES[int(draw * len(CATEGORIES))]
+        date = (datetime.date.today() - datetime.timedelta(days=int(draw * 365))).isoformat()
+        return {
+            'transaction_id': transaction_id,
+            'account_id': self.accountIds(access_token)[index % self.accounts],
+            'amount': round(1 + draw * 200, 2),
+            'iso_currency_code': 'USD',
+            'unofficial_currency_code': None,
+            'category': category,
+            'category_id': '13005000',
+            'date': date,
+            'authorized_date': date,
+            'authorized_datetime': None,
+            'datetime': None,
+            'location': {
+                'address': None, 'city': None, 'region': None, 'postal_code': None,
+                'country': None, 'lat': None, 'lon': None, 'store_number': None,
+            },
+            'name': MERCHANTS[index % len(MERCHANTS)],
+            'merchant_name': MERCHANTS[index % len(MERCHANTS)],
+            'payment_meta': {
+                'reference_number': None, 'ppd_id': None, 'payee': None, 'by_order_of': None,
+                'payer': None, 'payment_method': None, 'payment_processor': None, 'reason': None,
+            },
+            'payment_channel': 'in store',
+            'pending': False,
+            'pending_transaction_id': None,
+            'account_owner': None,
+            'transaction_code': None,
+            'transaction_type': 'place',
+        }
+
+    def linkTokenCreate(self, body):
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=4)
+        return 200, {
+            'link_token': f'link-sandbox-{uuid.uuid4()}',
+            'expiration': expiration.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'request_id': uuid.uuid4().hex,
+        }
+
+    def publicTokenExchange(self, body):
+        # the access token is derived from the public token, so exchanging it again returns the same item
+        suffix = body['public_token'][len('public-'):]
+        return 200, {'access_token': f'access-{suffix}', 'item_id': f'item-{suffix}', 'request_id': uuid.uuid4().hex}
+
+    def itemGet(self, body):
+        return 200, {'item': self.item(body['access_token']), 'status': None, 'request_id': uuid.uuid4().hex}
+
+    def accountsGet(self, body):
+        return 200, {
+            'accounts': [self.account(account_id) for account_id in self.accountIds(body['access_token'])],
+            'item': self.item(body['access_token']),
+            'request_id': uuid.uuid4().hex,
+        }
+
+    def transactionsSync(self, body):
+        # the cursor is the number of the next page, every page after the first also modifies and
+        # removes a transaction of the page before it
+        cursor = body.get('cursor') or ''
+        page = int(cursor) if cursor.isdigit() else 0
+        access_token = body['access_token']
+        added, modified, removed = [], [], []
+        if page < self.pages:
+            added = [self.transaction(access_token, page, index) for index in range(self.page_size)]
+            if page > 0 and self.page_size > 1:
+                changed = self.transaction(access_token, page - 1, 0)
+                changed['amount'] = round(changed['amount'] + 1, 2)
+                modified = [changed]
+                gone = self.transaction(access_token, page - 1, 1)
+                removed = [{'transaction_id': gone['transaction_id'], 'account_id': gone['account_id']}]
+        next_page = min(page + 1, self.pages)
+        return 200, {
+            'transactions_update_status': 'HISTORICAL_UPDATE_COMPLETE',
+            'accounts': [],
+            'added': added,
+            'modified': modified,
+            'removed': removed,
+            'next_cursor': str(next_page),
+            'has_more': next_page < self.pages,
+            'request_id': uuid.uuid4().hex,
+        }
+
+    def handle(self, path, body):
+        """
+        #Function to answer a call.
+
+        #Args:
+            path (str): Path of the endpoint, e.g. '/accounts/get'.
+            body (dict): Request body.
+
+        #Returns:
+            tuple: (status, body) of the response.
+        """
+        routes = {
+            '/link/token/create': self.linkTokenCreate,
+            '/item/public_token/exchange': self.publicTokenExchange,
+            '/item/get': self.itemGet,
+            '/accounts/get': self.accountsGet,
+            '/accounts/balance/get': self.accountsGet,
+            '/transactions/sync': self.transactionsSync,
+        }
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if path not in routes:
+            return self.error(404, 'INVALID_REQUEST', 'NOT_FOUND', f'{path} is not implemented by the fake')
+        if path != '/link/token/create' and path != '/item/public_token/exchange':
+            error = self.injectedError(body)
+            if error is not None:
+                return error
+        return routes[path](body)
+
+
+def createServer(fake, host='127.0.0.1', port=0):
+    """
+    #Function to create the HTTP server of a FakePlaid.
+
+    #Args:
+        fake (FakePlaid): The fake answering the calls.
+        host (str): Host to listen on.
+        port (int): Port to listen on, 0 picks a free port.
+
+    #Returns:
+        ThreadingHTTPServer: The server, not started yet. server.server_address holds the port.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            status, payload = fake.handle(self.path, body)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def startServer(fake, host='127.0.0.1', port=0):
+    """
+    #Function to serve a FakePlaid in a background thread.
+
+    #Args:
+        fake (FakePlaid): The fake answering the calls.
+        host (str): Host to listen on.
+        port (int): Port to listen on, 0 picks a free port.
+
+    #Returns:
+        ThreadingHTTPServer: The running server, stop it with shutdown().
+    """
+    server = createServer(fake, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True, name='fakeplaid').start()
+    return server
+
+
+def addArguments(parser):
+    """
+    #Function to add the options of the fake to an argument parser.
+
+    #Args:
+        parser (argparse.ArgumentParser): The parser.
+
+    #Returns:
+        None
+    """
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every Plaid response is delayed')
+    parser.add_argument('--pages', type=int, default=2, help='transactions/sync pages of every item')
+    parser.add_argument('--page-size', type=int, default=100, help='transactions on every page')
+    parser.add_argument('--accounts', type=int, default=2, help='accounts of every item')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of the Plaid calls failing with a transient error')
+    parser.add_argument('--login-required-rate', type=float, default=0.0, help='share of the items failing with ITEM_LOGIN_REQUIRED')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def fromArguments(args):
+    """
+    #Function to create a FakePlaid from the options added by addArguments.
+
+    #Args:
+        args (argparse.Namespace): Parsed arguments.
+
+    #Returns:
+        FakePlaid: The fake.
+    """
+    return FakePlaid(latency=args.latency, pages=args.pages, page_size=args.page_size, accounts=args.accounts,
+                     error_rate=args.error_rate, login_required_rate=args.login_required_rate, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local fake of the Plaid API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    addArguments(parser)
+    args = parser.parse_args()
+
+    server = createServer(fromArguments(args), args.host, args.port)
+    print(f'fake Plaid listening on http://{args.host}:{server.server_address[1]}')
+    server.serve_forever()
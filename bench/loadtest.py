@@ -0,0 +1,330 @@
+"""
+# This file contains the load test of the server's /api routes.
+
+Starts the fake Plaid API of fakeplaid.py and, unless --url is given, the server itself in this
+process on a threaded WSGI server. It then runs three phases:
+
+    - link: every user links its items through /api/setAccessToken
+    - sync: /api/transactions/update enqueues a sync job for every item and the jobs are run, by
+      worker threads of this process, or by the workers of the server given with --url
+    - load: every route is called --requests times by --concurrency clients, for random users
+
+and reports the p50/p95/p99 latency, the throughput and the status codes of every route.
+
+MongoDB is an in-memory mongomock stand-in by default (requires `mongomock`). mongomock does not
+support the array filters of the embedded storage, so TRANSACTIONS_STORAGE defaults to 'collection'
+with it. --mongo takes the URI of a local MongoDB instead, the users are created with fresh emails
+so existing data is not touched. With --url, the server must use the fake Plaid, started with
+fakeplaid.py and given to the server as PLAID_HOST.
+
+#To run the load test, run the following command in the terminal:
+    python bench/loadtest.py --users 20 --concurrency 16 --requests 200 --latency 0.05
+
+loadtest.py
+
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeplaid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# route name: (method, path, function of (user, items) returning the form or JSON body)
+ROUTES = {
+    'linkToken': ('GET', '/api/linkToken', lambda user, items: None),
+    'setAccessToken': ('POST', '/api/setAccessToken', lambda user, items: {'email': user, 'public_token': random.choice(items)['public_token']}),
+    'accounts': ('POST', '/api/accounts', lambda user, items: {'email': user}),
+    'balance': ('POST', '/api/balance', lambda user, items: {'email': user}),
+    'transactions': ('POST', '/api/transactions', lambda user, items: {'email': user, 'limit': 50}),
+    'transactions_all': ('POST', '/api/transactions', lambda user, items: {'email': user}),
+    'transactions_test': ('GET', '/api/transactions/test', lambda user, items: {'email': user}),
+    'transactions_update': ('POST', '/api/transactions/update', lambda user, items: {'email': user}),
+    'transactions_jobs': ('POST', '/api/transactions/jobs', lambda user, items: {'email': user}),
+    'webhook': ('POST', '/api/webhook', lambda user, items: {'json': {
+        'webhook_type': 'TRANSACTIONS', 'webhook_code': 'SYNC_UPDATES_AVAILABLE', 'item_id': random.choice(items)['item_id']}}),
+    'expense': ('POST', '/api/expense', lambda user, items: {'email': user}),
+    'pattern': ('POST', '/api/pattern', lambda user, items: {'email': user}),
+    'Reauthenticate': ('POST', '/api/Reauthenticate', lambda user, items: {'email': user}),
+}
+
+
+def call(base_url, method, path, body):
+    """
+    #Function to call a route and read the whole response.
+
+    #Args:
+        base_url (str): URL of the server, e.g. 'http://127.0.0.1:8000'.
+        method (str): HTTP method.
+        path (str): Path of the route.
+        body (dict): Form fields, or {'json': body} for a JSON body, None for no body.
+
+    #Returns:
+        tuple: (status, seconds, response body as bytes).
+    """
+    url = urllib.parse.urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=120)
+    headers = {}
+    data = None
+    if body is not None and 'json' in body:
+        data = json.dumps(body['json'])
+        headers['Content-Type'] = 'application/json'
+    elif body is not None:
+        data = urllib.parse.urlencode(body)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    start = time.perf_counter()
+    try:
+        connection.request(method, path, body=data, headers=headers)
+        response = connection.getresponse()
+        content = response.read()
+        return response.status, time.perf_counter() - start, content
+    finally:
+        connection.close()
+
+
+def percentile(values, p):
+    """
+    #Function to compute a percentile with the nearest-rank method.
+
+    #Args:
+        values (list): Sorted values.
+        p (float): Percentile between 0 and 100.
+
+    #Returns:
+        float: The percentile, None if there are no values.
+    """
+    if not values:
+        return None
+    rank = max(1, int(round(p / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(name, latencies, statuses, seconds):
+    """
+    #Function to summarize the calls of a route.
+
+    #Args:
+        name (str): Name of the route.
+        latencies (list): Seconds of every call.
+        statuses (list): Status code of every call, 0 for a failed connection.
+        seconds (float): Wall clock time of all the calls.
+
+    #Returns:
+        dict: Requests, throughput, p50/p95/p99 in milliseconds, status code counts.
+    """
+    latencies = sorted(latencies)
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return {
+        'route': name,
+        'requests': len(statuses),
+        'throughput': len(statuses) / seconds if seconds else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'max_ms': latencies[-1] * 1000 if latencies else None,
+        'statuses': counts,
+    }
+
+
+def runCalls(base_url, name, bodies, concurrency):
+    """
+    #Function to call a route once for every body, with concurrency clients.
+
+    #Args:
+        base_url (str): URL of the server.
+        name (str): Name of the route in ROUTES.
+        bodies (list): Body of every call.
+        concurrency (int): Number of calls in flight.
+
+    #Returns:
+        dict: Summary of the calls, see summarize.
+    """
+    method, path, _ = ROUTES[name]
+
+    def one(body):
+        try:
+            status, seconds, _ = call(base_url, method, path, body)
+        except OSError:
+            return 0, None
+        return status, seconds
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, bodies))
+    seconds = time.perf_counter() - start
+    return summarize(name, [latency for _, latency in results if latency is not None],
+                     [status for status, _ in results], seconds)
+
+
+def startLocalServer(mongo):
+    """
+    #Function to import server.py and serve it in a background thread of this process.
+
+    #Args:
+        mongo (str): 'mongomock', or the URI of a MongoDB.
+
+    #Returns:
+        tuple: (server module, base url).
+    """
+    if mongo == 'mongomock':
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+        os.environ.setdefault('TRANSACTIONS_STORAGE', 'collection')
+    else:
+        os.environ['MONGODB_URI'] = mongo
+    import server
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    http_server = make_server('127.0.0.1', 0, server.create_app(), threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=http_server.serve_forever, daemon=True, name='server').start()
+    return server, f'http://127.0.0.1:{http_server.server_port}'
+
+
+def runSyncJobs(server, concurrency):
+    """
+    #Function to run the queued sync jobs with worker threads of this process, like worker.py does.
+
+    #Args:
+        server (module): The server module.
+        concurrency (int): Number of worker threads.
+
+    #Returns:
+        int: Number of jobs run.
+    """
+    from jobs import claimSyncJob
+    from worker import runJob
+
+    def work(worker_id):
+        count = 0
+        while True:
+            job = claimSyncJob(server.jobsdb, worker_id)
+            if job is None:
+                return count
+            with server.app.app_context():
+                runJob(server, job, worker_id)
+            count += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return sum(pool.map(work, [f'loadtest-{i}' for i in range(concurrency)]))
+
+
+def waitForSyncJobs(base_url, users, timeout):
+    """
+    #Function to wait until the sync jobs of every user are done or failed, using /api/transactions/jobs.
+
+    #Args:
+        base_url (str): URL of the server.
+        users (list): Emails of the users.
+        timeout (float): Seconds to wait at most.
+
+    #Returns:
+        bool: True if all the jobs finished before the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    pending = set(users)
+    while pending and time.monotonic() < deadline:
+        for user in list(pending):
+            status, _, content = call(base_url, 'POST', '/api/transactions/jobs', {'email': user})
+            jobs = json.loads(content) if status == 200 else []
+            if all(job['status'] in ('done', 'failed') for job in jobs):
+                pending.discard(user)
+        if pending:
+            time.sleep(1)
+    return not pending
+
+
+def printReport(results):
+    print(f"{'route':<22}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    for result in results:
+        numbers = [result['throughput'], result['p50_ms'], result['p95_ms'], result['p99_ms']]
+        cells = ''.join(f'{number:>9.1f}' if number is not None else f"{'-':>9}" for number in numbers)
+        print(f"{result['route']:<22}{result['requests']:>9}{cells}  {result['statuses']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the /api routes of the server against a fake Plaid API.')
+    parser.add_argument('--url', help='URL of a running server, by default the server is started in this process')
+    parser.add_argument('--plaid-port', type=int, default=0, help='port of the fake Plaid API, 0 picks a free port')
+    parser.add_argument('--mongo', default='mongomock', help="'mongomock' or the URI of a local MongoDB")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--items', type=int, default=2, help='items linked by every user')
+    parser.add_argument('--concurrency', type=int, default=8, help='calls in flight')
+    parser.add_argument('--requests', type=int, default=100, help='calls of every route')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma separated routes to call, from: ' + ', '.join(ROUTES))
+    parser.add_argument('--sync-timeout', type=float, default=300, help='seconds to wait for the sync jobs with --url')
+    parser.add_argument('--json', help='file to write the results to as JSON')
+    fakeplaid.addArguments(parser)
+    args = parser.parse_args()
+
+    routes = [route for route in args.routes.split(',') if route]
+    unknown = [route for route in routes if route not in ROUTES]
+    if unknown:
+        parser.error(f'unknown routes: {", ".join(unknown)}')
+    random.seed(args.seed)
+
+    fake = fakeplaid.fromArguments(args)
+    plaid_server = fakeplaid.startServer(fake, port=args.plaid_port)
+    os.environ['PLAID_HOST'] = f'http://127.0.0.1:{plaid_server.server_address[1]}'
+    os.environ.setdefault('PLAID_CLIENT_ID', 'loadtest')
+    os.environ.setdefault('PLAID_SECRET_ID', 'loadtest')
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = startLocalServer(args.mongo)
+    print(f'server {base_url}, fake Plaid {os.environ["PLAID_HOST"]}')
+
+    run_id = uuid.uuid4().hex[:8]
+    users = {f'loadtest-{run_id}-{u}@example.com': [{
+        'public_token': f'public-{run_id}-{u}-{i}',
+        'item_id': f'item-{run_id}-{u}-{i}',
+    } for i in range(args.items)] for u in range(args.users)}
+    results = []
+
+    link = [{'email': user, 'public_token': item['public_token']} for user, items in users.items() for item in items]
+    results.append(dict(runCalls(base_url, 'setAccessToken', link, args.concurrency), route='link (setAccessToken)'))
+
+    start = time.perf_counter()
+    runCalls(base_url, 'transactions_update', [{'email': user} for user in users], args.concurrency)
+    if server is not None:
+        jobs = runSyncJobs(server, args.concurrency)
+    else:
+        jobs = len(link) if waitForSyncJobs(base_url, list(users), args.sync_timeout) else None
+    seconds = time.perf_counter() - start
+    transactions = len(link) * args.pages * args.page_size
+    print(f'sync: {jobs} jobs run, {transactions} transactions in {seconds:.2f} s ({transactions / seconds:.0f} transactions/s)')
+
+    for name in routes:
+        bodies = []
+        for _ in range(args.requests):
+            user = random.choice(list(users))
+            bodies.append(ROUTES[name][2](user, users[user]))
+        results.append(runCalls(base_url, name, bodies, args.concurrency))
+
+    printReport(results)
+    print(f'fake Plaid calls: {fake.calls}')
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({
+                'options': vars(args),
+                'sync': {'jobs': jobs, 'transactions': transactions, 'seconds': seconds},
+                'routes': results,
+                'plaid_calls': fake.calls,
+            }, file, indent=2)
+    plaid_server.shutdown()
@@ -0,0 +1,316 @@
+"""
+    #This module creates the MongoDB indexes and applies the schema migrations the server relies on.
+
+    Every step is idempotent, so it runs when server.py starts and can be run on its own.
+    It can also explain the queries of components.py and report the ones that fall back to a collection scan.
+
+    #environment variables:
+        - MONGODB_URI from .env
+        - TRANSACTIONS_STORAGE from .env (optional, 'embedded' or 'collection')
+
+    #To create the indexes, apply the migrations and report collection scans, run the following command in the terminal:
+        python bootstrap.py --explain
+
+"""
+
+import argparse
+import datetime
+import os
+import re
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from components import createTransactionIndexes, createSpendingIndexes
+from jobs import createJobIndexes
+from health import createHealthIndexes
+from syncstate import createSyncStateIndexes
+
+
+def findDuplicateEmails(db):
+    """
+    #Function to find the emails shared by more than one user, which prevent the unique email index.
+
+    #Args:
+        db (database): MongoDB database object.
+
+    #Returns:
+        list: The duplicated emails.
+    """
+    pipeline = [
+        {"$group": {"_id": "$email", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    return [row["_id"] for row in db['users'].aggregate(pipeline)]
+
+
+def hasUniqueEmailIndex(db):
+    """
+    #Function to check if the users collection already has the unique email index.
+
+    #Args:
+        db (database): MongoDB database object.
+
+    #Returns:
+        bool: True if the unique email index exists.
+    """
+    for index in db['users'].index_information().values():
+        if index.get('key') == [('email', 1)] and index.get('unique'):
+            return True
+    return False
+
+
+def ensureIndexes(db):
+    """
+    #Function to create the indexes of every collection.
+
+    The users collection is only scanned for duplicated emails when the unique email index is
+    missing, so starting a process does not read every user document once the index exists.
+
+    #Args:
+        db (database): MongoDB database object.
+
+    #Returns:
+        dict: Dictionary mapping collection names to the names of their indexes, and the
+              duplicated emails under 'errors' if the unique email index could not be created.
+    """
+    report = {'users': [], 'errors': []}
+    duplicates = [] if hasUniqueEmailIndex(db) else findDuplicateEmails(db)
+    if duplicates:
+        report['errors'].append('unique email index not created, duplicated emails: ' + ', '.join(map(str, duplicates)))
+        report['users'].append(db['users'].create_index([("email", 1)]))
+    else:
+        try:
+            report['users'].append(db['users'].create_index([("email", 1)], unique=True))
+        except OperationFailure as e:
+            report['errors'].append('unique email index not created: ' + str(e))
+    report['users'].append(db['users'].create_index([("account.item_id", 1)]))
+    report['transactions'] = createTransactionIndexes(db['transactions'])
+    report['spending'] = [createSpendingIndexes(db['spending'])]
+    report['sync_jobs'] = createJobIndexes(db['sync_jobs'])
+    report['item_health'] = [createHealthIndexes(db['item_health'])]
+    report['sync_state'] = createSyncStateIndexes(db['sync_state'])
+    return report
+
+
+def dropSupersededTransactionIndexes(db):
+    """
+    #Migration dropping the transactions indexes that do not end in transaction_id.
+
+    #Args:
+        db (database): MongoDB database object.
+
+    #Returns:
+        None
+    """
+    for name in ('email_1_account_id_1_date_-1', 'email_1_date_-1'):
+        try:
+            db['transactions'].drop_index(name)
+        except OperationFailure:
+            pass
+
+
+def migratePositionalSyncState(db):
+    """
+    #Migration moving the cursors stored under positional 'account_N' labels to the sync state of the item.
+
+    The label account_N refers to the Nth entry of the user's account array. The transactions stored
+    under the label, in the user document or in the transactions collection, are relabelled with the
+    item_id, and the cursor is copied to the item's sync state without a last sync, so the item is synced
+    again from the cursor. Labels without a matching entry are left as is.
+
+    #Args:
+        db (database): MongoDB database object.
+
+    #Returns:
+        None
+    """
+    users = db['users'].find(
+        {"transactions.account_id": {"$regex": r"^account_\d+$"}},
+        {"email": 1, "account.item_id": 1, "transactions.account_id": 1, "transactions.cursor": 1})
+    for user in users:
+        accounts = user.get('account') or []
+        for entry in user['transactions']:
+            match = re.match(r'account_(\d+)$', entry.get('account_id') or '')
+            if match is None or not 0 < int(match.group(1)) <= len(accounts):
+                continue
+            item_id = accounts[int(match.group(1)) - 1]['item_id']
+            db['users'].update_one(
+                {"email": user['email'], "transactions.account_id": entry['account_id']},
+                {"$set": {"transactions.$.account_id": item_id}})
+            db['transactions'].update_many(
+                {"email": user['email'], "item": entry['account_id']}, {"$set": {"item": item_id}})
+            db['sync_state'].update_one(
+                {"item_id": item_id},
+                {"$setOnInsert": {"email": user['email'], "cursor": entry.get('cursor')}},
+                upsert=True)
+
+
+def moveEmbeddedTransactions(db, batch_size=1000):
+    """
+    #Migration moving the transactions stored in the user documents to the transactions collection.
+
+    Every transaction is upserted with its transaction_id as _id and the item_id of its entry as item,
+    without replacing a document a sync already stored in the collection, then the arrays are removed
+    from the user documents. The entries keep their account_id and cursor. A transaction stored twice
+    in an entry is moved in the version that was stored last.
+
+    #Args:
+        db (database): MongoDB database object.
+        batch_size (int): Number of transactions written per bulk write.
+
+    #Returns:
+        None
+    """
+    users = db['users'].find(
+        {"transactions.transactions.0": {"$exists": True}},
+        {"email": 1, "transactions.account_id": 1, "transactions.transactions": 1})
+    for user in users:
+        operations = []
+        for entry in user['transactions']:
+            for transaction in reversed(entry.get('transactions') or []):
+                document = dict(transaction, email=user['email'], item=entry['account_id'])
+                operations.append(UpdateOne({"_id": transaction['transaction_id']}, {"$setOnInsert": document}, upsert=True))
+        for start in range(0, len(operations), batch_size):
+            db['transactions'].bulk_write(operations[start:start + batch_size])
+        db['users'].update_one(
+            {"_id": user['_id']},
+            {"$unset": {"transactions.$[].transactions": ""}, "$inc": {"data_version": 1}})
+
+
+# schema migrations in the order they are applied as (id, migration, storage), a migration with a storage only applies
+# when TRANSACTIONS_STORAGE has that value, the id of every applied migration is stored in the migrations collection
+MIGRATIONS = [
+    ('0001_drop_superseded_transaction_indexes', dropSupersededTransactionIndexes, None),
+    ('0002_sync_state_by_item_id', migratePositionalSyncState, None),
+    ('0003_embedded_transactions_to_collection', moveEmbeddedTransactions, 'collection'),
+]
+
+
+def applyMigrations(db, storage='embedded'):
+    """
+    #Function to apply the migrations that have not been applied yet.
+
+    Processes started together can apply the same migration at the same time, every migration is
+    idempotent and only the first process records it, the others skip the record. Migrations for another
+    storage are not recorded, so they apply once TRANSACTIONS_STORAGE is switched.
+
+    #Args:
+        db (database): MongoDB database object.
+        storage (str): The TRANSACTIONS_STORAGE in use, 'embedded' or 'collection'.
+
+    #Returns:
+        list: IDs of the migrations applied.
+    """
+    applied = {migration["_id"] for migration in db['migrations'].find({}, {"_id": 1})}
+    applied_now = []
+    for migration_id, migration, migration_storage in MIGRATIONS:
+        if migration_id in applied or migration_storage not in (None, storage):
+            continue
+        migration(db)
+        try:
+            db['migrations'].insert_one({"_id": migration_id, "applied_at": datetime.datetime.utcnow()})
+        except DuplicateKeyError:
+            continue
+        applied_now.append(migration_id)
+    return applied_now
+
+
+def bootstrap(db, storage='embedded'):
+    """
+    #Function to apply the migrations and create the indexes.
+
+    Migrations run first so they can drop or rebuild indexes before ensureIndexes creates the current ones.
+
+    #Args:
+        db (database): MongoDB database object.
+        storage (str): The TRANSACTIONS_STORAGE in use, 'embedded' or 'collection'.
+
+    #Returns:
+        dict: The report of ensureIndexes with the IDs of the migrations applied under 'migrations'.
+    """
+    migrations = applyMigrations(db, storage)
+    report = ensureIndexes(db)
+    report['migrations'] = migrations
+    return report
+
+
+# queries issued by components.py and jobs.py, as (collection, filter, sort)
+QUERIES = [
+    ('users', {"email": ""}, None),
+    ('users', {"email": "", "transactions.account_id": ""}, None),
+    ('users', {"account.item_id": ""}, None),
+    ('transactions', {"email": "", "date": {"$gte": ""}}, [("date", -1), ("transaction_id", -1)]),
+    ('transactions', {"email": "", "account_id": ""}, [("date", -1), ("transaction_id", -1)]),
+    ('transactions', {"_id": {"$in": [""]}, "email": ""}, None),
+    ('spending', {"email": "", "month": ""}, None),
+    ('sync_jobs', {"status": "pending", "not_before": {"$not": {"$gt": datetime.datetime(1970, 1, 1)}}}, [("created_at", 1)]),
+    ('sync_jobs', {"email": "", "item_id": "", "status": "pending"}, None),
+    ('sync_jobs', {"status": "running", "lease_expires": {"$gte": datetime.datetime(1970, 1, 1)}}, None),
+    ('sync_state', {"email": ""}, None),
+    ('sync_state', {"item_id": ""}, None),
+    ('item_health', {"item_id": {"$in": [""]}, "checked_at": {"$gte": datetime.datetime(1970, 1, 1)}}, None),
+]
+
+
+def planStages(plan):
+    """
+    #Function to list the stages of a query plan.
+
+    #Args:
+        plan (dict): Query plan returned by explain.
+
+    #Returns:
+        list: Names of the stages of the plan and of its input stages.
+    """
+    stages = [plan.get("stage")]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages.extend(planStages(child))
+    return stages
+
+
+def findCollectionScans(db):
+    """
+    #Function to explain the queries in QUERIES and find the ones that fall back to a collection scan.
+
+    #Args:
+        db (database): MongoDB database object.
+
+    #Returns:
+        list: A (collection, filter, stages) tuple for every query whose winning plan contains COLLSCAN.
+    """
+    scans = []
+    for collection_name, query, sort in QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        stages = planStages(cursor.explain()["queryPlanner"]["winningPlan"])
+        if "COLLSCAN" in stages:
+            scans.append((collection_name, query, stages))
+    return scans
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Create the MongoDB indexes and apply the schema migrations.')
+    parser.add_argument('--explain', action='store_true', help='report the queries that fall back to a collection scan')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.getenv('MONGODB_URI'))['Plaid']
+    report = bootstrap(db, os.getenv('TRANSACTIONS_STORAGE', 'embedded'))
+    for migration_id in report.pop('migrations'):
+        print(f'applied migration {migration_id}')
+    for error in report.pop('errors'):
+        print(f'error: {error}')
+    for collection_name, indexes in report.items():
+        print(f'{collection_name}: {", ".join(indexes)}')
+    if args.explain:
+        scans = findCollectionScans(db)
+        for collection_name, query, stages in scans:
+            print(f'COLLSCAN {collection_name} {query} {" > ".join(stages)}')
+        if not scans:
+            print('no query falls back to a collection scan')
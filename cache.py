@@ -0,0 +1,138 @@
+"""
+# This file contains an in-process cache with a time to live and stale-while-revalidate behavior.
+
+An entry younger than ttl is served as is. An entry older than ttl but younger than ttl + stale_ttl
+is served as is while a background refresh replaces it. Older entries, missing entries and bypassed
+reads are loaded synchronously. Older entries are dropped by the next set once ttl seconds passed since
+the last sweep, so keys that are not read again do not stay in memory.
+
+cache.py
+
+"""
+
+import threading
+import time
+
+from fanout import executor
+
+
+class TTLCache:
+    """
+    #Cache of values loaded by a loader function, keyed by any hashable key.
+
+    #Args:
+        ttl (float): Seconds an entry is fresh.
+        stale_ttl (float): Seconds after ttl during which a stale entry is served while it is refreshed.
+    """
+
+    def __init__(self, ttl, stale_ttl=0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.swept_at = time.monotonic()
+
+    def get(self, key, loader, bypass=False):
+        """
+        #Return the cached value of key, loading it with loader if needed.
+
+        #Args:
+            key (hashable): Key of the entry.
+            loader (callable): Function without arguments that loads the value.
+            bypass (bool): Load the value even if a fresh entry exists.
+
+        #Returns:
+            object: The cached or loaded value.
+
+        #Raises:
+            Exception: Any exception raised by loader when the value is loaded synchronously.
+        """
+        if not bypass:
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = time.monotonic() - loaded_at
+                if age < self.ttl:
+                    return value
+                if age < self.ttl + self.stale_ttl:
+                    self.refresh(key, loader)
+                    return value
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """
+        #Store a value for key.
+
+        #Args:
+            key (hashable): Key of the entry.
+            value (object): Value to store.
+
+        #Returns:
+            None
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = (value, now)
+            if now - self.swept_at >= self.ttl:
+                self.sweep(now)
+
+    def sweep(self, now):
+        """
+        #Drop the entries older than ttl + stale_ttl, called by set with the lock held.
+
+        #Args:
+            now (float): The current time.monotonic().
+
+        #Returns:
+            None
+        """
+        expired = [key for key, (value, loaded_at) in self.entries.items() if now - loaded_at >= self.ttl + self.stale_ttl]
+        for key in expired:
+            del self.entries[key]
+        self.swept_at = now
+
+    def refresh(self, key, loader):
+        """
+        #Reload key in the background, unless a refresh of key is already running.
+
+        A failed refresh keeps the stale entry.
+
+        #Args:
+            key (hashable): Key of the entry.
+            loader (callable): Function without arguments that loads the value.
+
+        #Returns:
+            None
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run():
+            try:
+                self.set(key, loader())
+            except Exception:
+                pass
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        executor.submit(run)
+
+    def invalidate(self, key):
+        """
+        #Remove the entry of key.
+
+        #Args:
+            key (hashable): Key of the entry.
+
+        #Returns:
+            None
+        """
+        with self.lock:
+            self.entries.pop(key, None)
@@ -0,0 +1,110 @@
+"""
+# This file contains the lazy, per-process clients of the server.
+
+The MongoDB and Plaid clients hold sockets and background threads that must not be shared with
+a forked process. Every client is wrapped in a ProcessLocal, which creates the client on first use
+and creates a new one when it is used from another process, so the server can be imported before
+a pre-forking server starts its workers and every worker still opens its own connections.
+
+clients.py
+
+"""
+
+import os
+import threading
+
+
+class ProcessLocal:
+    """
+    #Proxy to an object created on first use in every process.
+
+    Attribute access and item access are forwarded to the object, so a ProcessLocal wrapping a
+    pymongo collection can be passed to the helpers of components.py like the collection itself.
+
+    #Args:
+        factory (callable): Called without arguments to create the object.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._instance = None
+
+    def get(self):
+        """
+        #Function to get the object of the current process.
+
+        #Args:
+            None
+
+        #Returns:
+            object: The object, created if this process has not used it yet.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._instance = self._factory()
+                    self._pid = pid
+        return self._instance
+
+    def created(self):
+        """
+        #Function to check if the object has been created in the current process.
+
+        #Args:
+            None
+
+        #Returns:
+            bool: True if the object exists in this process.
+        """
+        return self._pid == os.getpid()
+
+    def reset(self):
+        """
+        #Function to drop the object so the next use creates a new one.
+
+        #Args:
+            None
+
+        #Returns:
+            None
+        """
+        with self._lock:
+            self._instance = None
+            self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+
+_locals = []
+
+
+# the lock of every ProcessLocal may be held by another thread when the process forks
+def _resetLocks():
+    for local in _locals:
+        local._lock = threading.Lock()
+
+
+def processLocal(factory):
+    """
+    #Function to create a ProcessLocal that is safe to use in forked processes.
+
+    #Args:
+        factory (callable): Called without arguments to create the object.
+
+    #Returns:
+        ProcessLocal: The proxy.
+    """
+    local = ProcessLocal(factory)
+    _locals.append(local)
+    return local
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetLocks)
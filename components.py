@@ -7,6 +7,11 @@ components.py
 
 """
 
+import datetime
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 
 def checkIfUserExits(collection, email):
@@ -38,11 +43,11 @@ def addUser(collection, email):
     #Returns:
         bool: True if the user is added successfully, False if the user already exists.
     """
-    if checkIfUserExits(collection, email):
+    try:
+        result = collection.update_one({"email": email}, {"$setOnInsert": {"name": ' '}}, upsert=True)
+    except DuplicateKeyError:
         return False
-    else:
-        collection.insert_one({"email": email, 'name': ' '})
-        return True
+    return result.upserted_id is not None
 
 
 def addAccount(collection, email, access_token, item_id):
@@ -61,7 +66,8 @@ def addAccount(collection, email, access_token, item_id):
     if checkIfUserExits(collection, email):
         query = {"email": email}
         newvalues = {"$push": {"account": {
-            "access_token": access_token, "item_id": item_id}}}
+            "access_token": access_token, "item_id": item_id}},
+            "$inc": {"data_version": 1}}
         collection.update_one(query, newvalues, upsert=True)
         return True
     else:
@@ -106,6 +112,42 @@ def getUserAccounts(collection, email):
 
 
 
+def getUserSnapshot(collection, email):
+    """
+    #Function to retrieve a user without the transactions stored in the user document.
+
+    The accounts, the cursor of every account and the user's flags are returned, the
+    transactions arrays are excluded so the document stays small.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+
+    #Returns:
+        dict: User if the user exists, None if the user does not exist.
+    """
+    return collection.find_one({"email": email}, {"transactions.transactions": 0})
+
+
+def bumpDataVersion(collection, email):
+    """
+    #Function to increment the data_version of a user.
+
+    The data_version of a user changes on every write to the user's accounts or transactions, so the
+    responses derived from them can be revalidated with an ETag without reading the transactions.
+    addAccount, addTransactions and addTransactionsv1 increment it in the same update as their write.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+
+    #Returns:
+        bool: True if the user exists, False otherwise.
+    """
+    result = collection.update_one({"email": email}, {"$inc": {"data_version": 1}})
+    return result.matched_count > 0
+
+
 def getUser(collection, email):
     """
     #Function to retrieve a user from a MongoDB collection.
@@ -147,60 +189,75 @@ def checkIfAccessTokenExits(collection, email, access_token):
 
 
 
-def addTransactions(collection, email, transactions, cursor, account_id):
+def addTransactions(collection, email, transactions, cursor, account_id, modified=None, removed=None, previous_cursor=None, replayed=False):
     """
     #Function to add transactions to a user's transactions array in a MongoDB collection.
 
+    Only the new page is sent to MongoDB: the transactions are appended to the account's array with
+    $push/$each and the cursor is set in the same atomic update, so the cost of a sync scales with the
+    size of the page and concurrent syncs cannot overwrite each other.
+    Modified and removed transactions are first pulled from the array by transaction_id, in the same
+    bulk_write as the append.
+    With previous_cursor the update only applies if the stored cursor is still previous_cursor, so a page
+    that was already stored is not stored twice when an interrupted sync is resumed.
+    A replayed page, fetched again after the pagination restarted, may hold added transactions that are
+    already stored, with replayed they are pulled by transaction_id like the modified ones.
+    A page with changes increments the user's data_version, see bumpDataVersion.
+
     #Args:
         collection (collection): MongoDB collection object.
         email (str): User's email address.
         transactions (list): List of transactions to be added.
         cursor (str): Cursor value for the transactions.
         account_id (str): ID of the account for the transactions.
+        modified (list): Optional list of transactions that replace the stored transactions with the same transaction_id.
+        removed (list): Optional list of transaction_ids to be removed.
+        previous_cursor (str): Optional cursor the page was fetched with.
+        replayed (bool): True if the added transactions may already be stored.
 
     #Returns:
-        bool: True if the transactions are added successfully, False if the user does not exist.
+        bool: True if the transactions are added successfully, False if the user does not exist
+              or the page was already stored.
     """
-    if checkIfUserExits(collection, email):
-        query = {"email": email}
-        existing_transactions = collection.find_one(query, {"transactions": 1})
-
-        if existing_transactions and "transactions" in existing_transactions:
-            existing_transactions = existing_transactions["transactions"]
-            for transaction in existing_transactions:
-                if transaction.get("account_id") == account_id:
-                    transaction["transactions"].extend(transactions)
-                    transaction["cursor"] = cursor
-                    break
-            else:
-                existing_transactions.append({
-                    "account_id": account_id,
-                    "transactions": transactions,
-                    "cursor": cursor
-                })
-
-            update_operation = {"$set": {"transactions": existing_transactions}}
-            array_filters = []
-        else:
-            update_operation = {
-                "$push": {
-                    "transactions": {
-                        "account_id": account_id,
-                        "transactions": transactions,
-                        "cursor": cursor
-                    }
-                }
-            }
-            array_filters = []
-
-        result = collection.update_one(query, update_operation, array_filters=array_filters, upsert=True)
-
-        if result.modified_count > 0 or result.upserted_id:
-            return True
-        else:
-            return False
+    modified = modified or []
+    removed = removed or []
+    transactions = transactions + modified
+    stale = transactions if replayed else modified
+    append_query = {"email": email, "transactions.account_id": account_id}
+    if previous_cursor is not None:
+        append_query = {"email": email, "transactions": {"$elemMatch": {"account_id": account_id, "cursor": previous_cursor}}}
+    append_operation = {
+        "$push": {"transactions.$.transactions": {"$each": transactions}},
+        "$set": {"transactions.$.cursor": cursor}
+    }
+    version_operation = {"$inc": {"data_version": 1}} if transactions or removed else {}
+    append_operation.update(version_operation)
+    if stale or removed:
+        stale_ids = [t["transaction_id"] for t in stale] + list(removed)
+        result = collection.bulk_write([
+            UpdateOne(append_query,
+                      {"$pull": {"transactions.$[entry].transactions": {"transaction_id": {"$in": stale_ids}}}},
+                      array_filters=[{"entry.account_id": account_id}]),
+            UpdateOne(append_query, append_operation)
+        ])
     else:
-        return False
+        result = collection.update_one(append_query, append_operation)
+    if result.matched_count > 0:
+        return result.modified_count > 0
+
+    """# First sync of this account, only push the entry if no concurrent sync created it"""
+    result = collection.update_one(
+        {"email": email, "transactions.account_id": {"$ne": account_id}},
+        {"$push": {"transactions": {
+            "account_id": account_id,
+            "transactions": transactions,
+            "cursor": cursor
+        }}, **version_operation})
+    if result.matched_count > 0:
+        return result.modified_count > 0
+
+    result = collection.update_one(append_query, append_operation)
+    return result.modified_count > 0
 
     
 
@@ -226,7 +283,7 @@ def addTransactionsv1(collection, email, transactions, cursor, account_id):
             existing_transactions = existing_transactions["transactions"]
             for transaction in existing_transactions:
                 if transaction.get("account_id") == account_id:
-                    existing_transaction_ids = [t.get("transaction_id") for t in transaction["transactions"]]
+                    existing_transaction_ids = {t.get("transaction_id") for t in transaction["transactions"]}
                     new_transactions = [t for t in transactions if t.get("transaction_id") not in existing_transaction_ids]
                     transaction["transactions"].extend(new_transactions)
                     transaction["cursor"] = cursor
@@ -238,7 +295,7 @@ def addTransactionsv1(collection, email, transactions, cursor, account_id):
                     "cursor": cursor
                 })
 
-            update_operation = {"$set": {"transactions": existing_transactions}}
+            update_operation = {"$set": {"transactions": existing_transactions}, "$inc": {"data_version": 1}}
             array_filters = []
         else:
             update_operation = {
@@ -248,7 +305,8 @@ def addTransactionsv1(collection, email, transactions, cursor, account_id):
                         "transactions": transactions,
                         "cursor": cursor
                     }
-                }
+                },
+                "$inc": {"data_version": 1}
             }
             array_filters = []
 
@@ -263,6 +321,25 @@ def addTransactionsv1(collection, email, transactions, cursor, account_id):
 
 
 
+def resetCursor(collection, email, account_id, cursor):
+    """
+    #Function to set the cursor of a user's account, e.g. back to the cursor a restarted pagination starts with.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+        account_id (str): ID of the account.
+        cursor (str): The cursor.
+
+    #Returns:
+        bool: True if the cursor is set, False if the account has no transactions stored.
+    """
+    result = collection.update_one(
+        {"email": email, "transactions.account_id": account_id},
+        {"$set": {"transactions.$.cursor": cursor}})
+    return result.matched_count > 0
+
+
 def getCursor(collection, email, account_id):
     """
     #Function to retrieve the cursor of a user's account from a MongoDB collection.
@@ -327,4 +404,567 @@ def getUserTransactions(collection, email):
     if result is None:
         return None
     else:
-        return result.get('transactions')
\ No newline at end of file
+        return result.get('transactions')
+
+
+def createTransactionIndexes(transactions_collection):
+    """
+    #Function to create the indexes used to query the transactions collection.
+
+    Each transaction is stored as its own document with its transaction_id as _id,
+    so lookups by id are served by the default _id index.
+
+    #Args:
+        transactions_collection (collection): MongoDB transactions collection object.
+
+    #Returns:
+        list: Names of the indexes.
+    """
+    return [
+        transactions_collection.create_index([("email", 1), ("account_id", 1), ("date", -1), ("transaction_id", -1)]),
+        transactions_collection.create_index([("email", 1), ("date", -1), ("transaction_id", -1)]),
+    ]
+
+
+def addTransactionDocuments(transactions_collection, email, transactions, item, modified=None, removed=None):
+    """
+    #Function to store transactions as one document per transaction in the transactions collection.
+
+    Added and modified transactions are upserted by transaction_id and removed transactions are deleted,
+    all in a single bulk_write, so storing the same page twice does not create duplicates.
+
+    #Args:
+        transactions_collection (collection): MongoDB transactions collection object.
+        email (str): User's email address.
+        transactions (list): List of transactions to be stored.
+        item (str): ID of the linked item the transactions were synced from.
+        modified (list): Optional list of transactions that replace the stored transactions with the same transaction_id.
+        removed (list): Optional list of transaction_ids to be deleted.
+
+    #Returns:
+        int: Number of transactions inserted, updated or deleted.
+    """
+    operations = []
+    for transaction in transactions + (modified or []):
+        document = dict(transaction, _id=transaction["transaction_id"], email=email, item=item)
+        operations.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+    for transaction_id in removed or []:
+        operations.append(DeleteOne({"_id": transaction_id, "email": email}))
+    if not operations:
+        return 0
+    result = transactions_collection.bulk_write(operations)
+    return result.upserted_count + result.modified_count + result.deleted_count
+
+
+def getTransactionDocuments(transactions_collection, email, start_date=None, end_date=None, account_id=None, fields=None):
+    """
+    #Function to retrieve a user's transactions from the transactions collection, newest first.
+
+    #Args:
+        transactions_collection (collection): MongoDB transactions collection object.
+        email (str): User's email address.
+        start_date (str): Optional inclusive lower bound on the date (YYYY-MM-DD).
+        end_date (str): Optional inclusive upper bound on the date (YYYY-MM-DD).
+        account_id (str): Optional Plaid account id to restrict the transactions to.
+        fields (list): Optional list of fields to return, all fields are returned if None.
+
+    #Returns:
+        list: List of transactions, empty if the user has none.
+    """
+    query = {"email": email}
+    if account_id is not None:
+        query["account_id"] = account_id
+    if start_date is not None or end_date is not None:
+        query["date"] = {}
+        if start_date is not None:
+            query["date"]["$gte"] = start_date
+        if end_date is not None:
+            query["date"]["$lte"] = end_date
+    projection = {"_id": 0}
+    if fields is not None:
+        projection.update({field: 1 for field in fields})
+    return list(transactions_collection.find(query, projection).sort("date", -1))
+
+
+def getLatestTransactionDate(transactions_collection, email):
+    """
+    #Function to retrieve the date of a user's most recent spending transaction.
+
+    #Args:
+        transactions_collection (collection): MongoDB transactions collection object.
+        email (str): User's email address.
+
+    #Returns:
+        str: Date of the latest transaction with a positive amount, None if there is none.
+    """
+    result = transactions_collection.find_one(
+        {"email": email, "amount": {"$gt": 0}}, {"_id": 0, "date": 1}, sort=[("date", -1)])
+    if result is None:
+        return None
+    else:
+        return result["date"]
+
+
+def getUserByItemId(collection, item_id):
+    """
+    #Function to retrieve the user an item belongs to from a MongoDB collection.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        item_id (str): ID of the account item.
+
+    #Returns:
+        dict: User's email and accounts if the item exists, None if the item does not exist.
+    """
+    return collection.find_one({"account.item_id": item_id}, {"_id": 0, "email": 1, "account": 1})
+
+
+def getTransactionsByIds(collection, email, transaction_ids, account_id):
+    """
+    #Function to retrieve stored transactions of a user by transaction_id from one account of the user's transactions array.
+
+    The transactions are filtered in MongoDB with $filter on the account's entry, so only the
+    matching transactions are returned instead of the user's whole history.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+        transaction_ids (list): IDs of the transactions.
+        account_id (str): ID of the account the transactions are stored under.
+
+    #Returns:
+        list: List of the stored transactions, transactions that are not stored are skipped.
+    """
+    if not transaction_ids:
+        return []
+    pipeline = [
+        {"$match": {"email": email, "transactions.account_id": account_id}},
+        {"$project": {"_id": 0, "entry": {"$arrayElemAt": [
+            {"$filter": {"input": "$transactions", "as": "entry", "cond": {"$eq": ["$$entry.account_id", account_id]}}}, 0]}}},
+        {"$project": {"transactions": {"$filter": {
+            "input": "$entry.transactions", "as": "transaction",
+            "cond": {"$in": ["$$transaction.transaction_id", list(transaction_ids)]}}}}},
+    ]
+    result = next(collection.aggregate(pipeline), None)
+    if result is None:
+        return []
+    return result.get("transactions") or []
+
+
+def getTransactionDocumentsByIds(transactions_collection, email, transaction_ids):
+    """
+    #Function to retrieve stored transactions of a user by transaction_id from the transactions collection.
+
+    #Args:
+        transactions_collection (collection): MongoDB transactions collection object.
+        email (str): User's email address.
+        transaction_ids (list): IDs of the transactions.
+
+    #Returns:
+        list: List of the stored transactions, transactions that are not stored are skipped.
+    """
+    if not transaction_ids:
+        return []
+    return list(transactions_collection.find({"_id": {"$in": list(transaction_ids)}, "email": email}, {"_id": 0}))
+
+
+def spendingDeltas(added, removed):
+    """
+    #Function to compute the change of spending per (month, category) caused by added and removed transactions.
+
+    Only transactions with a positive amount are spending. Every transaction is counted in its
+    month (YYYY-MM) and in the 'all' month that holds the totals of the whole history.
+
+    #Args:
+        added (list): Transactions that are added, or the new versions of modified transactions.
+        removed (list): Transactions that are removed, or the stored versions of modified transactions.
+
+    #Returns:
+        dict: Dictionary mapping (month, category tuple) to an [amount, count] list.
+    """
+    deltas = {}
+    for sign, transactions in ((1, added), (-1, removed)):
+        for transaction in transactions:
+            if transaction['amount'] > 0:
+                category = tuple(transaction.get('category') or [])
+                for month in (str(transaction['date'])[:7], 'all'):
+                    delta = deltas.setdefault((month, category), [0, 0])
+                    delta[0] += sign * transaction['amount']
+                    delta[1] += sign
+    return deltas
+
+
+def createSpendingIndexes(spending_collection):
+    """
+    #Function to create the index used to update and query the spending aggregates.
+
+    #Args:
+        spending_collection (collection): MongoDB spending collection object.
+
+    #Returns:
+        str: Name of the index.
+    """
+    return spending_collection.create_index([("email", 1), ("month", 1), ("category", 1)], unique=True)
+
+
+def updateSpending(spending_collection, email, added, removed):
+    """
+    #Function to incrementally update a user's spending aggregates.
+
+    #Args:
+        spending_collection (collection): MongoDB spending collection object.
+        email (str): User's email address.
+        added (list): Transactions that are added, or the new versions of modified transactions.
+        removed (list): Transactions that are removed, or the stored versions of modified transactions.
+
+    #Returns:
+        int: Number of aggregates updated.
+    """
+    operations = []
+    for (month, category), (amount, count) in spendingDeltas(added, removed).items():
+        if count == 0 and amount == 0:
+            continue
+        operations.append(UpdateOne(
+            {"email": email, "month": month, "category": list(category)},
+            {"$inc": {"amount": amount, "count": count}},
+            upsert=True))
+    if not operations:
+        return 0
+    result = spending_collection.bulk_write(operations, ordered=False)
+    return result.upserted_count + result.modified_count
+
+
+def rebuildSpending(collection, spending_collection, email, transactions, data_version=None):
+    """
+    #Function to rebuild a user's spending aggregates from all of the user's transactions.
+
+    The user is marked with spending_built so later syncs update the aggregates incrementally.
+    With data_version the user is only marked if its data_version did not change since the
+    transactions were read, a page stored meanwhile may be missing from the aggregates, which are
+    then rebuilt again on the next read.
+    Every aggregate is upserted with the id of the build and the aggregates of earlier builds are
+    deleted afterwards, so the aggregates are never missing while they are rebuilt and two rebuilds
+    never insert the same aggregate. Callers serialize rebuilds with claimSpendingRebuild.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        spending_collection (collection): MongoDB spending collection object.
+        email (str): User's email address.
+        transactions (list): All the transactions of the user.
+        data_version (int): Optional data_version of the user read before the transactions.
+
+    #Returns:
+        int: Number of aggregates stored.
+    """
+    build = ObjectId()
+    operations = []
+    for (month, category), (amount, count) in spendingDeltas(transactions or [], []).items():
+        operations.append(UpdateOne(
+            {"email": email, "month": month, "category": list(category)},
+            {"$set": {"amount": amount, "count": count, "build": build}},
+            upsert=True))
+    if operations:
+        spending_collection.bulk_write(operations, ordered=False)
+    spending_collection.delete_many({"email": email, "build": {"$ne": build}})
+    query = {"email": email}
+    if data_version is not None:
+        query["data_version"] = data_version if data_version else {"$in": [0, None]}
+    collection.update_one(query, {"$set": {"spending_built": True}})
+    return len(operations)
+
+
+def claimSpendingRebuild(collection, email, lease_seconds=60):
+    """
+    #Function to claim the rebuild of a user's spending aggregates, so concurrent reads do not rebuild them together.
+
+    The claim expires after lease_seconds, in case the process holding it died.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+        lease_seconds (int): Seconds after which another rebuild can claim the user.
+
+    #Returns:
+        bool: True if the rebuild is claimed, False if another rebuild holds the claim.
+    """
+    now = datetime.datetime.utcnow()
+    result = collection.update_one(
+        {"email": email, "spending_rebuild_until": {"$not": {"$gt": now}}},
+        {"$set": {"spending_rebuild_until": now + datetime.timedelta(seconds=lease_seconds)}})
+    return result.modified_count > 0
+
+
+def releaseSpendingRebuild(collection, email):
+    """
+    #Function to release the claim of claimSpendingRebuild once the rebuild finished.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+
+    #Returns:
+        None
+    """
+    collection.update_one({"email": email}, {"$unset": {"spending_rebuild_until": ""}})
+
+
+def isSpendingRebuilding(collection, email):
+    """
+    #Function to check if a rebuild of a user's spending aggregates holds a claim.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+
+    #Returns:
+        bool: True if a rebuild is running, False otherwise.
+    """
+    query = {"email": email, "spending_rebuild_until": {"$gt": datetime.datetime.utcnow()}}
+    return collection.find_one(query, {"_id": 1}) is not None
+
+
+def invalidateSpending(collection, email):
+    """
+    #Function to mark a user's spending aggregates as not built, so they are rebuilt on the next read.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+
+    #Returns:
+        None
+    """
+    collection.update_one({"email": email}, {"$unset": {"spending_built": ""}})
+
+
+def isSpendingBuilt(collection, email):
+    """
+    #Function to check if a user's spending aggregates are built.
+
+    #Args:
+        collection (collection): MongoDB collection object.
+        email (str): User's email address.
+
+    #Returns:
+        bool: True if the aggregates are built, False otherwise.
+    """
+    return collection.find_one({"email": email, "spending_built": True}, {"_id": 1}) is not None
+
+
+def getSpending(spending_collection, email, month='all'):
+    """
+    #Function to retrieve a user's spending per category in a month.
+
+    #Args:
+        spending_collection (collection): MongoDB spending collection object.
+        email (str): User's email address.
+        month (str): Month in YYYY-MM format, or 'all' for the whole history.
+
+    #Returns:
+        dict: Dictionary mapping category tuples to the amount spent.
+    """
+    result = spending_collection.find(
+        {"email": email, "month": month, "count": {"$gt": 0}}, {"_id": 0, "category": 1, "amount": 1})
+    return {tuple(aggregate["category"]): aggregate["amount"] for aggregate in result}
+
+
+def getLatestSpendingMonth(spending_collection, email):
+    """
+    #Function to retrieve the latest month in which a user has spending.
+
+    #Args:
+        spending_collection (collection): MongoDB spending collection object.
+        email (str): User's email address.
+
+    #Returns:
+        str: Month in YYYY-MM format, None if the user has no spending.
+    """
+    result = spending_collection.find_one(
+        {"email": email, "month": {"$ne": "all"}, "count": {"$gt": 0}},
+        {"_id": 0, "month": 1}, sort=[("month", -1)])
+    if result is None:
+        return None
+    else:
+        return result["month"]
+
+
+def spendingPipeline(email, embedded=True, start_date=None, end_date=None):
+    """
+    #Function to build the first stages of an aggregation pipeline over a user's spending transactions.
+
+    #Args:
+        email (str): User's email address.
+        embedded (bool): True to read the transactions array of the users collection,
+                         False to read the transactions collection.
+        start_date (str): Optional inclusive lower bound on the date (YYYY-MM-DD).
+        end_date (str): Optional inclusive upper bound on the date (YYYY-MM-DD).
+
+    #Returns:
+        list: Pipeline stages producing the user's transactions with a positive amount.
+    """
+    match = {"amount": {"$gt": 0}}
+    if start_date is not None or end_date is not None:
+        match["date"] = {}
+        if start_date is not None:
+            match["date"]["$gte"] = start_date
+        if end_date is not None:
+            match["date"]["$lte"] = end_date
+    if embedded:
+        return [
+            {"$match": {"email": email}},
+            {"$project": {"_id": 0, "transactions.transactions": 1}},
+            {"$unwind": "$transactions"},
+            {"$unwind": "$transactions.transactions"},
+            {"$replaceRoot": {"newRoot": "$transactions.transactions"}},
+            {"$match": match},
+        ]
+    return [{"$match": dict(match, email=email)}]
+
+
+def aggregateTopCategories(collection, email, size, embedded=True):
+    """
+    #Function to compute a user's top spending categories and total spending with an aggregation pipeline.
+
+    #Args:
+        collection (collection): MongoDB users collection if embedded, transactions collection otherwise.
+        email (str): User's email address.
+        size (int): Number of categories to return.
+        embedded (bool): True if the transactions are stored in the users collection.
+
+    #Returns:
+        tuple: Dictionary mapping the top category tuples to the amount spent, and the total spending.
+    """
+    pipeline = spendingPipeline(email, embedded) + [
+        {"$project": {"_id": 0, "category": 1, "amount": 1}},
+        {"$facet": {
+            "top": [
+                {"$group": {"_id": "$category", "amount": {"$sum": "$amount"}}},
+                {"$sort": {"amount": -1}},
+                {"$limit": size},
+            ],
+            "total": [{"$group": {"_id": None, "amount": {"$sum": "$amount"}}}],
+        }},
+    ]
+    result = next(collection.aggregate(pipeline), {"top": [], "total": []})
+    category_spending = {tuple(row["_id"] or []): row["amount"] for row in result["top"]}
+    total_spending = result["total"][0]["amount"] if result["total"] else 0
+    return category_spending, total_spending
+
+
+def aggregateLatestSpendingDate(collection, email, embedded=True):
+    """
+    #Function to find the date of a user's most recent spending transaction with an aggregation pipeline.
+
+    #Args:
+        collection (collection): MongoDB users collection if embedded, transactions collection otherwise.
+        email (str): User's email address.
+        embedded (bool): True if the transactions are stored in the users collection.
+
+    #Returns:
+        str: Date of the latest transaction with a positive amount, None if there is none.
+    """
+    pipeline = spendingPipeline(email, embedded) + [
+        {"$group": {"_id": None, "date": {"$max": "$date"}}},
+    ]
+    result = next(collection.aggregate(pipeline), None)
+    if result is None:
+        return None
+    else:
+        return result["date"]
+
+
+def aggregateCategoryChanges(collection, email, current_month, previous_month, size, embedded=True):
+    """
+    #Function to compute a user's top categories in a month and their spending in the month before with an aggregation pipeline.
+
+    #Args:
+        collection (collection): MongoDB users collection if embedded, transactions collection otherwise.
+        email (str): User's email address.
+        current_month (str): Month in YYYY-MM format.
+        previous_month (str): The month before current_month in YYYY-MM format.
+        size (int): Number of categories to return.
+        embedded (bool): True if the transactions are stored in the users collection.
+
+    #Returns:
+        tuple: Dictionaries mapping the top category tuples to the amount spent in current_month and in previous_month.
+    """
+    in_current_month = {"$gte": ["$date", current_month + "-01"]}
+    pipeline = spendingPipeline(email, embedded, start_date=previous_month + "-01", end_date=current_month + "-31") + [
+        {"$group": {
+            "_id": "$category",
+            "current": {"$sum": {"$cond": [in_current_month, "$amount", 0]}},
+            "previous": {"$sum": {"$cond": [in_current_month, 0, "$amount"]}},
+        }},
+        {"$match": {"current": {"$gt": 0}}},
+        {"$sort": {"current": -1}},
+        {"$limit": size},
+    ]
+    current_month_transactions = {}
+    previous_month_transactions = {}
+    for row in collection.aggregate(pipeline):
+        category = tuple(row["_id"] or [])
+        current_month_transactions[category] = row["current"]
+        previous_month_transactions[category] = row["previous"]
+    return current_month_transactions, previous_month_transactions
+
+
+def getTransactionsPage(collection, email, limit=None, after=None, start_date=None, end_date=None, account_id=None, fields=None, embedded=True):
+    """
+    #Function to retrieve a page of a user's transactions ordered by date and transaction_id, newest first.
+
+    Pages are keyset paginated: the next page starts after the (date, transaction_id) of the last
+    transaction of the previous page, so every page is an index range scan in the transactions collection.
+
+    #Args:
+        collection (collection): MongoDB users collection if embedded, transactions collection otherwise.
+        email (str): User's email address.
+        limit (int): Maximum number of transactions to return, all transactions are returned if None.
+        after (tuple): Optional (date, transaction_id) of the last transaction of the previous page.
+        start_date (str): Optional inclusive lower bound on the date (YYYY-MM-DD).
+        end_date (str): Optional inclusive upper bound on the date (YYYY-MM-DD).
+        account_id (str): Optional Plaid account id to restrict the transactions to.
+        fields (list): Optional list of fields to return, date and transaction_id are always returned.
+        embedded (bool): True if the transactions are stored in the users collection.
+
+    #Returns:
+        iterable: Cursor over the transactions, fetched from MongoDB in batches.
+    """
+    match = {}
+    if account_id is not None:
+        match["account_id"] = account_id
+    if start_date is not None or end_date is not None:
+        match["date"] = {}
+        if start_date is not None:
+            match["date"]["$gte"] = start_date
+        if end_date is not None:
+            match["date"]["$lte"] = end_date
+    if after is not None:
+        match["$or"] = [
+            {"date": {"$lt": after[0]}},
+            {"date": after[0], "transaction_id": {"$lt": after[1]}},
+        ]
+    projection = {"_id": 0}
+    if fields is not None:
+        projection.update({field: 1 for field in fields})
+        projection.update({"date": 1, "transaction_id": 1})
+    sort = [("date", -1), ("transaction_id", -1)]
+
+    if embedded:
+        pipeline = [
+            {"$match": {"email": email}},
+            {"$project": {"_id": 0, "transactions.transactions": 1}},
+            {"$unwind": "$transactions"},
+            {"$unwind": "$transactions.transactions"},
+            {"$replaceRoot": {"newRoot": "$transactions.transactions"}},
+            {"$match": match},
+            {"$sort": dict(sort)},
+        ]
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": projection})
+        return collection.aggregate(pipeline, batchSize=500)
+
+    result = collection.find(dict(match, email=email), projection).sort(sort).batch_size(500)
+    if limit is not None:
+        result = result.limit(limit)
+    return result
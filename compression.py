@@ -0,0 +1,134 @@
+"""
+# This file contains the compression of the responses of the server.
+
+Responses of at least COMPRESS_MIN_SIZE bytes are compressed with Brotli when the client accepts it
+and the brotli package is installed, and with gzip otherwise. Streamed responses, whose size is not
+known in advance, are compressed chunk by chunk as they are sent. The settings are read into the
+config of the app by enableCompression, which server.py calls after loading .env.
+
+#environment variables:
+    - COMPRESS_MIN_SIZE from .env (optional, bytes, 0 disables compression)
+    - COMPRESS_LEVEL from .env (optional, gzip level from 1 to 9)
+
+compression.py
+
+"""
+
+import os
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def chooseEncoding():
+    """
+    #Function to choose the encoding of the current response from the Accept-Encoding header.
+
+    #Args:
+        None
+
+    #Returns:
+        str: 'br', 'gzip' or None if the client accepts neither.
+    """
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compressor(encoding, level=6):
+    """
+    #Function to create a streaming compressor for an encoding.
+
+    #Args:
+        encoding (str): 'br' or 'gzip'.
+        level (int): gzip level from 1 to 9.
+
+    #Returns:
+        tuple: (compress, flush) functions, compress takes bytes and flush takes no arguments, both return bytes.
+    """
+    if encoding == 'br':
+        # quality 5 is close to gzip in speed and still smaller
+        compressor = brotli.Compressor(quality=5)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def compressStream(chunks, encoding, level=6):
+    """
+    #Function to compress a streamed response chunk by chunk.
+
+    #Args:
+        chunks (iterable): Chunks of the response, as str or bytes.
+        encoding (str): 'br' or 'gzip'.
+        level (int): gzip level from 1 to 9.
+
+    #Returns:
+        generator: Compressed chunks.
+    """
+    compress, flush = compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            data = compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compressResponse(response):
+    """
+    #after_request hook compressing the response if it is large enough and the client accepts it.
+
+    #Args:
+        response (Response): The response.
+
+    #Returns:
+        Response: The response, compressed or not.
+    """
+    min_size = current_app.config['COMPRESS_MIN_SIZE']
+    level = current_app.config['COMPRESS_LEVEL']
+    if (min_size <= 0 or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+    encoding = chooseEncoding()
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compressStream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        compress, flush = compressor(encoding, level)
+        response.set_data(compress(data) + flush())
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def enableCompression(app):
+    """
+    #Function to compress the large responses of a Flask app.
+
+    COMPRESS_MIN_SIZE and COMPRESS_LEVEL are read from the environment unless the app config already sets them.
+
+    #Args:
+        app (Flask): The Flask application.
+
+    #Returns:
+        Flask: The application.
+    """
+    app.config.setdefault('COMPRESS_MIN_SIZE', int(os.getenv('COMPRESS_MIN_SIZE', 1024)))
+    app.config.setdefault('COMPRESS_LEVEL', int(os.getenv('COMPRESS_LEVEL', 6)))
+    app.after_request(compressResponse)
+    return app
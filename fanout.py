@@ -0,0 +1,60 @@
+"""
+# This file contains the helper used to run per-item Plaid calls concurrently.
+
+Routes that call Plaid once for every access token of a user submit the calls to a bounded
+thread pool shared by the process and wait for all of them with a single per-request deadline.
+The pool is created on first use in every process, like the clients of clients.py, so a pool is
+never inherited by a forked worker, and under gevent it is created after the worker is monkey patched.
+PLAID_MAX_WORKERS and PLAID_REQUEST_TIMEOUT are read when they are used, after the entry point loaded .env.
+
+fanout.py
+
+"""
+
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from clients import processLocal
+
+# thread pool of the process, with PLAID_MAX_WORKERS threads
+executor = processLocal(lambda: ThreadPoolExecutor(max_workers=int(os.getenv('PLAID_MAX_WORKERS', 8)), thread_name_prefix='plaid'))
+
+
+class FanOutTimeout(Exception):
+    """
+    #Raised when the per-item calls do not all finish before the deadline.
+    """
+
+
+def runConcurrently(function, items, timeout=None):
+    """
+    #Function to call a function for every item concurrently.
+
+    #Args:
+        function (callable): Function called with a single item.
+        items (list): Items to call the function with.
+        timeout (float): Deadline in seconds for all the calls together, PLAID_REQUEST_TIMEOUT if None.
+
+    #Returns:
+        list: A (result, exception) tuple for every item, in the same order as items.
+              exception is None if the call succeeded and result is None if it failed.
+
+    #Raises:
+        FanOutTimeout: If the calls do not all finish before the deadline.
+    """
+    if timeout is None:
+        timeout = float(os.getenv('PLAID_REQUEST_TIMEOUT', 15))
+    # every call runs in a copy of the caller's context, so context variables such as the request timing of metrics.py follow it
+    futures = [executor.submit(contextvars.copy_context().run, function, item) for item in items]
+    done, not_done = wait(futures, timeout=timeout)
+    if not_done:
+        for future in not_done:
+            future.cancel()
+        raise FanOutTimeout(f'{len(not_done)} of {len(futures)} calls did not finish within {timeout} seconds')
+
+    outcomes = []
+    for future in futures:
+        error = future.exception()
+        outcomes.append((future.result() if error is None else None, error))
+    return outcomes
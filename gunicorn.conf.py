@@ -0,0 +1,66 @@
+"""
+# This file contains the gunicorn settings of the production server.
+
+Every worker is a separate process with its own MongoDB and Plaid connections, and serves
+WEB_THREADS requests at a time. With gthread workers the app is preloaded by the master, so the
+indexes are created once, and the master closes its MongoDB connection before the workers are
+forked. gevent workers monkey patch the standard library after they are forked, so with gevent
+the app is not preloaded and every worker imports it once patched, otherwise the locks and queues
+created while importing it would block the worker's event loop. On SIGTERM the workers stop
+accepting requests and finish the requests and Plaid calls in flight for up to WEB_GRACEFUL_TIMEOUT seconds.
+
+#environment variables:
+    - PORT from .env (optional)
+    - WEB_WORKERS from .env (optional, defaults to the number of cores)
+    - WEB_THREADS from .env (optional, threads of every worker)
+    - WEB_WORKER_CLASS from .env (optional, 'gthread' or 'gevent')
+    - WEB_TIMEOUT and WEB_GRACEFUL_TIMEOUT from .env (optional, seconds)
+
+#To run the server, run the following command in the terminal:
+    gunicorn wsgi:app
+
+gunicorn.conf.py
+
+"""
+
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# the settings below are read from .env like the ones of server.py, which is imported after this file
+load_dotenv()
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.getenv('WEB_THREADS', 4))
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+preload_app = worker_class != 'gevent'
+
+if worker_class == 'gevent':
+    # greenlets are cheap, allow many more concurrent Plaid calls than with threads, like asyncserver.py
+    os.environ.setdefault('PLAID_MAX_WORKERS', '200')
+
+
+def when_ready(arbiter):
+    """
+    #Close the MongoDB connection the master opened while preloading the app, before the workers are forked.
+    """
+    if not preload_app:
+        return
+    from server import closeClients
+    closeClients()
+
+
+def worker_exit(arbiter, worker):
+    """
+    #Wait for the Plaid calls still running in the background of a stopping worker, then close its connections and write its queued logs.
+    """
+    from fanout import executor
+    from logs import stopLogging
+    from server import closeClients
+    if executor.created():
+        executor.shutdown(wait=True)
+    closeClients()
+    stopLogging()
@@ -0,0 +1,104 @@
+"""
+# This file contains functions to store the health of every linked item in MongoDB.
+
+The health of an item is 'ok', 'login_required' when the user must go through Link in update
+mode, or 'error' for any other item error. It is recorded by the health checks of
+/api/Reauthenticate, by verified ITEM webhooks and by syncs failing with an ITEM_ERROR, with the
+source of the record. Other errors, e.g. rate limits or Plaid outages, say nothing about the item
+and are not recorded.
+
+these Function have no dependencies on the Flask application object, like components.py.
+
+health.py
+
+"""
+
+import datetime
+
+# error codes that are fixed by sending the user through Link in update mode
+LOGIN_REQUIRED_ERROR_CODES = {'ITEM_LOGIN_REQUIRED', 'PENDING_EXPIRATION'}
+
+
+def itemStatus(error_response):
+    """
+    #Function to derive the status of an item from a formatted Plaid error.
+
+    #Args:
+        error_response (dict): Error in the format of server.format_error, None if there is no error.
+
+    #Returns:
+        str: 'ok', 'login_required' or 'error'.
+    """
+    if error_response is None:
+        return 'ok'
+    if error_response['error']['error_code'] in LOGIN_REQUIRED_ERROR_CODES:
+        return 'login_required'
+    return 'error'
+
+
+def isItemError(error_response):
+    """
+    #Function to check if a formatted Plaid error is an error of the item itself.
+
+    #Args:
+        error_response (dict): Error in the format of server.format_error.
+
+    #Returns:
+        bool: True if the error type is ITEM_ERROR.
+    """
+    return (error_response.get('error') or {}).get('error_type') == 'ITEM_ERROR'
+
+
+def createHealthIndexes(health_collection):
+    """
+    #Function to create the index used to look up the health of items.
+
+    #Args:
+        health_collection (collection): MongoDB item health collection object.
+
+    #Returns:
+        str: Name of the index.
+    """
+    return health_collection.create_index([("item_id", 1)], unique=True)
+
+
+def recordItemHealth(health_collection, item_id, error_response=None, source='check'):
+    """
+    #Function to record the health of an item.
+
+    #Args:
+        health_collection (collection): MongoDB item health collection object.
+        item_id (str): ID of the item.
+        error_response (dict): Error in the format of server.format_error, None if the item is healthy.
+        source (str): What reported the health, 'check', 'webhook' or 'sync'.
+
+    #Returns:
+        str: The status recorded.
+    """
+    status = itemStatus(error_response)
+    health_collection.update_one(
+        {"item_id": item_id},
+        {"$set": {"status": status, "error": error_response, "source": source, "checked_at": datetime.datetime.utcnow()}},
+        upsert=True)
+    return status
+
+
+def getItemHealth(health_collection, item_ids, ttl, status=None):
+    """
+    #Function to retrieve the recorded health of items that was recorded less than ttl seconds ago.
+
+    #Args:
+        health_collection (collection): MongoDB item health collection object.
+        item_ids (list): IDs of the items.
+        ttl (float): Seconds a recorded health is trusted.
+        status (str): Optional, only the records with this status are returned, e.g. 'ok'.
+
+    #Returns:
+        dict: Dictionary mapping item ids to their status, error and source, items without a recent record are skipped.
+    """
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+    query = {"item_id": {"$in": list(item_ids)}, "checked_at": {"$gte": since}}
+    if status is not None:
+        query["status"] = status
+    result = health_collection.find(query, {"_id": 0, "item_id": 1, "status": 1, "error": 1, "source": 1})
+    return {health["item_id"]: health for health in result}
@@ -0,0 +1,183 @@
+"""
+# This file contains functions to manage the transactions sync job queue stored in MongoDB.
+
+A job asks a worker to run a transactions sync for one item of a user. Jobs move from
+'pending' to 'running' when a worker claims them and to 'done' or 'failed' when it finishes.
+An item has at most one pending job, and a job is only claimed while no other job of its item
+holds a live lease, so a change reported while the item is synced waits for the running job.
+The worker renews the lease after every page it stores, a running job whose lease expired (the
+worker died) can be claimed again. A failed attempt is retried after a delay that doubles with
+every attempt.
+
+these Function have no dependencies on the Flask application object, like components.py.
+
+jobs.py
+
+"""
+
+import datetime
+
+from pymongo import ReturnDocument
+
+class LeaseLost(Exception):
+    """
+    #Raised when the lease of a running job was taken over by another worker.
+    """
+
+
+def createJobIndexes(jobs_collection):
+    """
+    #Function to create the indexes used to claim and dedupe sync jobs.
+
+    #Args:
+        jobs_collection (collection): MongoDB sync jobs collection object.
+
+    #Returns:
+        list: Names of the indexes.
+    """
+    return [
+        jobs_collection.create_index([("status", 1), ("created_at", 1)]),
+        jobs_collection.create_index([("email", 1), ("item_id", 1), ("status", 1)]),
+    ]
+
+
+def enqueueSyncJob(jobs_collection, email, item_id, reason='manual'):
+    """
+    #Function to add a sync job for an item unless a pending job for the item already exists.
+
+    A job enqueued while the item's job is running is claimed once the running job finishes, so a
+    change reported after the running job fetched its last page is synced by the next job.
+
+    #Args:
+        jobs_collection (collection): MongoDB sync jobs collection object.
+        email (str): User's email address.
+        item_id (str): Plaid item id of the item to sync.
+        reason (str): Why the job was enqueued, e.g. 'manual' or 'webhook'.
+
+    #Returns:
+        ObjectId: ID of the pending job.
+    """
+    now = datetime.datetime.utcnow()
+    result = jobs_collection.find_one_and_update(
+        {"email": email, "item_id": item_id, "status": "pending"},
+        {"$setOnInsert": {"status": "pending", "created_at": now, "attempts": 0, "reason": reason},
+         "$set": {"updated_at": now}},
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER)
+    return result["_id"]
+
+
+def claimSyncJob(jobs_collection, worker_id, lease_seconds=300):
+    """
+    #Function to claim the oldest pending job that is due, or a running job whose lease expired.
+
+    Jobs of items that have a running job with a live lease are skipped, so an item is never
+    synced by two workers at the same time. A retried job is due once its not_before is reached.
+
+    #Args:
+        jobs_collection (collection): MongoDB sync jobs collection object.
+        worker_id (str): ID of the worker claiming the job.
+        lease_seconds (int): Seconds after which the job can be claimed by another worker.
+
+    #Returns:
+        dict: The claimed job, None if there is no job to run.
+    """
+    now = datetime.datetime.utcnow()
+    busy = jobs_collection.distinct("item_id", {"status": "running", "lease_expires": {"$gte": now}})
+    return jobs_collection.find_one_and_update(
+        {"$or": [{"status": "pending", "not_before": {"$not": {"$gt": now}}},
+                 {"status": "running", "lease_expires": {"$lt": now}}],
+         "item_id": {"$nin": busy}},
+        {"$set": {"status": "running", "worker": worker_id, "updated_at": now,
+                  "lease_expires": now + datetime.timedelta(seconds=lease_seconds)},
+         "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER)
+
+
+def renewSyncJobLease(jobs_collection, job_id, worker_id, lease_seconds=300):
+    """
+    #Function to extend the lease of a running job, called after every page the job stores.
+
+    #Args:
+        jobs_collection (collection): MongoDB sync jobs collection object.
+        job_id (ObjectId): ID of the job.
+        worker_id (str): ID of the worker running the job.
+        lease_seconds (int): Seconds from now after which the job can be claimed by another worker.
+
+    #Returns:
+        bool: True if the lease is extended, False if the job was claimed by another worker.
+    """
+    now = datetime.datetime.utcnow()
+    result = jobs_collection.update_one(
+        {"_id": job_id, "status": "running", "worker": worker_id},
+        {"$set": {"updated_at": now, "lease_expires": now + datetime.timedelta(seconds=lease_seconds)}})
+    return result.matched_count > 0
+
+
+def completeSyncJob(jobs_collection, job_id, result=None):
+    """
+    #Function to mark a claimed job as done.
+
+    #Args:
+        jobs_collection (collection): MongoDB sync jobs collection object.
+        job_id (ObjectId): ID of the job.
+        result (dict): Optional summary of the sync.
+
+    #Returns:
+        bool: True if the job is updated, False if the job does not exist.
+    """
+    result = jobs_collection.update_one(
+        {"_id": job_id},
+        {"$set": {"status": "done", "result": result, "updated_at": datetime.datetime.utcnow()},
+         "$unset": {"lease_expires": ""}})
+    return result.matched_count > 0
+
+
+def failSyncJob(jobs_collection, job_id, error, max_attempts=3, attempts=1, retry_delay=0):
+    """
+    #Function to record a failed attempt, the job is retried until it reaches max_attempts.
+
+    The retry is not claimed before retry_delay seconds, doubled for every attempt before, so an item
+    that keeps failing does not keep a worker busy.
+
+    #Args:
+        jobs_collection (collection): MongoDB sync jobs collection object.
+        job_id (ObjectId): ID of the job.
+        error (dict): Error returned by the sync.
+        max_attempts (int): Number of attempts after which the job is marked as failed.
+        attempts (int): Number of attempts of the job so far, including the failed one.
+        retry_delay (float): Seconds before the first retry.
+
+    #Returns:
+        bool: True if the job will be retried, False if it is marked as failed.
+    """
+    now = datetime.datetime.utcnow()
+    result = jobs_collection.update_one(
+        {"_id": job_id, "attempts": {"$lt": max_attempts}},
+        {"$set": {"status": "pending", "error": error, "updated_at": now,
+                  "not_before": now + datetime.timedelta(seconds=retry_delay * 2 ** max(attempts - 1, 0))},
+         "$unset": {"lease_expires": ""}})
+    if result.matched_count > 0:
+        return True
+    jobs_collection.update_one(
+        {"_id": job_id},
+        {"$set": {"status": "failed", "error": error, "updated_at": now},
+         "$unset": {"lease_expires": ""}})
+    return False
+
+
+def getSyncJobs(jobs_collection, email, limit=20):
+    """
+    #Function to retrieve the latest sync jobs of a user.
+
+    #Args:
+        jobs_collection (collection): MongoDB sync jobs collection object.
+        email (str): User's email address.
+        limit (int): Maximum number of jobs to return.
+
+    #Returns:
+        list: List of jobs, newest first.
+    """
+    return list(jobs_collection.find({"email": email}).sort("created_at", -1).limit(limit))
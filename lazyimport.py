@@ -0,0 +1,63 @@
+"""
+# This file contains the helper used to defer importing heavy modules until they are used.
+
+The Plaid SDK and numpy take most of the import time of server.py but are not needed to start
+serving requests. A LazyImport stands in for a module, or for a class or function of a module,
+and imports it on its first call or attribute access, so the call sites keep using the names
+they were imported under.
+
+lazyimport.py
+
+"""
+
+import importlib
+import threading
+
+
+class LazyImport:
+    """
+    #Stand-in for a module or an attribute of a module, imported on first use.
+
+    The import goes through importlib.import_module, so it is safe when the first use happens in
+    several threads at once.
+
+    #Args:
+        module (str): Name of the module, e.g. 'plaid.model.products'.
+        name (str): Name of the attribute, e.g. 'Products', None for the module itself.
+    """
+
+    def __init__(self, module, name=None):
+        self._module = module
+        self._name = name
+        self._lock = threading.Lock()
+        self._target = None
+
+    def resolve(self):
+        """
+        #Function to import the module or the attribute.
+
+        #Args:
+            None
+
+        #Returns:
+            object: The module, or the attribute of the module.
+        """
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    target = importlib.import_module(self._module)
+                    if self._name is not None:
+                        target = getattr(target, self._name)
+                    self._target = target
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        if self._name is None:
+            return f'<LazyImport {self._module}>'
+        return f'<LazyImport {self._module}.{self._name}>'
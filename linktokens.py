@@ -0,0 +1,117 @@
+"""
+# This file contains a pool of link tokens created ahead of time.
+
+A background thread keeps the pool filled with link tokens for the default products and
+country codes, so /api/linkToken can return one from memory. Tokens close to their
+expiration are discarded.
+
+linktokens.py
+
+"""
+
+import collections
+import datetime
+import threading
+
+
+class LinkTokenPool:
+    """
+    #Pool of link tokens refilled by a background thread.
+
+    #Args:
+        create (callable): Function without arguments returning a link_token_create response as a dictionary.
+        size (int): Number of link tokens kept in the pool, 0 disables the pool.
+        min_ttl (float): Seconds a link token must still be valid for to be returned.
+        refill_interval (float): Seconds between two checks of the pool when no token was taken.
+    """
+
+    def __init__(self, create, size=5, min_ttl=600, refill_interval=60):
+        self.create = create
+        self.size = size
+        self.min_ttl = min_ttl
+        self.refill_interval = refill_interval
+        self.tokens = collections.deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        #Start the refill thread, unless it is already running or the pool is disabled.
+
+        #Returns:
+            None
+        """
+        with self.lock:
+            if self.size <= 0 or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.thread = threading.Thread(target=self.run, name='link-token-pool', daemon=True)
+            self.thread.start()
+
+    def get(self):
+        """
+        #Take a link token that is valid for at least min_ttl seconds from the pool.
+
+        #Returns:
+            dict: The link_token_create response, None if the pool is empty.
+        """
+        token = None
+        with self.lock:
+            while self.tokens:
+                candidate = self.tokens.popleft()
+                if self.isFresh(candidate):
+                    token = candidate
+                    break
+        self.wakeup.set()
+        return token
+
+    def isFresh(self, token):
+        """
+        #Check if a link token is valid for at least min_ttl seconds.
+
+        #Args:
+            token (dict): The link_token_create response.
+
+        #Returns:
+            bool: True if the token can be returned.
+        """
+        expiration = token['expiration']
+        if isinstance(expiration, str):
+            expiration = datetime.datetime.fromisoformat(expiration.replace('Z', '+00:00'))
+        return expiration - datetime.datetime.now(datetime.timezone.utc) > datetime.timedelta(seconds=self.min_ttl)
+
+    def refill(self):
+        """
+        #Drop the expiring link tokens and create new ones until the pool is full.
+
+        #Returns:
+            int: Number of link tokens created.
+
+        #Raises:
+            plaid.ApiException: If an error occurs while creating a link token.
+        """
+        with self.lock:
+            self.tokens = collections.deque(token for token in self.tokens if self.isFresh(token))
+            missing = self.size - len(self.tokens)
+        for _ in range(missing):
+            token = self.create()
+            with self.lock:
+                self.tokens.append(token)
+        return max(missing, 0)
+
+    def run(self):
+        """
+        #Refill the pool when a token is taken or every refill_interval seconds, backing off after errors.
+
+        #Returns:
+            None
+        """
+        delay = self.refill_interval
+        while True:
+            try:
+                self.refill()
+                delay = self.refill_interval
+            except Exception:
+                delay = min(delay * 2, 600)
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
@@ -0,0 +1,236 @@
+"""
+# This file contains the structured logging of the server.
+
+Log records are put on a queue by the thread that logs them and formatted as one JSON object per
+line by a QueueListener thread, so serializing and writing a log line never happens in a request.
+Payloads such as Plaid responses are sampled in the logging thread, lists are cut to
+LOG_PAYLOAD_MAX_ITEMS items and only a LOG_PAYLOAD_SAMPLE_RATE share of the payloads is logged, and
+access tokens and other secrets are redacted by the formatter.
+
+Every helper returns before doing any work when its level is disabled, LOG_LEVEL=OFF disables
+logging altogether. The settings are read again by configureLogging, after the entry point loaded .env.
+
+#environment variables:
+    - LOG_LEVEL from .env (optional, DEBUG, INFO, WARNING, ERROR or OFF, defaults to INFO)
+    - LOG_PAYLOAD_MAX_ITEMS from .env (optional, items kept of every list of a logged payload)
+    - LOG_PAYLOAD_SAMPLE_RATE from .env (optional, share of the payloads that are logged)
+
+logs.py
+
+"""
+
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+# set from the environment by readSettings
+LOG_LEVEL = 'INFO'
+LOG_PAYLOAD_MAX_ITEMS = 10
+LOG_PAYLOAD_SAMPLE_RATE = 1.0
+# fields whose values are never written to the logs
+REDACTED_FIELDS = {'access_token', 'public_token', 'secret', 'client_id', 'link_token'}
+
+logger = logging.getLogger('plaid_backend')
+logger.propagate = False
+logger.addHandler(logging.NullHandler())
+
+_listener = None
+_lock = threading.Lock()
+
+
+def readSettings():
+    """
+    #Function to read the logging settings from the environment and apply LOG_LEVEL to the logger.
+
+    #Args:
+        None
+
+    #Returns:
+        None
+    """
+    global LOG_LEVEL, LOG_PAYLOAD_MAX_ITEMS, LOG_PAYLOAD_SAMPLE_RATE
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_PAYLOAD_MAX_ITEMS = int(os.getenv('LOG_PAYLOAD_MAX_ITEMS', 10))
+    LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 1))
+    logger.disabled = LOG_LEVEL == 'OFF'
+    if not logger.disabled:
+        logger.setLevel(LOG_LEVEL)
+
+
+def sample(payload, max_items=None):
+    """
+    #Function to copy a payload with every list cut to max_items items.
+
+    A cut list ends with a note of the number of items left out.
+
+    #Args:
+        payload (object): Dictionary, list or value, e.g. a Plaid response as a dictionary.
+        max_items (int): Items kept of every list, LOG_PAYLOAD_MAX_ITEMS if None.
+
+    #Returns:
+        object: The sampled copy.
+    """
+    if max_items is None:
+        max_items = LOG_PAYLOAD_MAX_ITEMS
+    if isinstance(payload, dict):
+        return {key: sample(value, max_items) for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        items = [sample(value, max_items) for value in payload[:max_items]]
+        if len(payload) > max_items:
+            items.append(f'... {len(payload) - max_items} more')
+        return items
+    return payload
+
+
+def redact(payload):
+    """
+    #Function to copy a payload with the values of REDACTED_FIELDS replaced.
+
+    #Args:
+        payload (object): Dictionary, list or value.
+
+    #Returns:
+        object: The redacted copy.
+    """
+    if isinstance(payload, dict):
+        return {key: '[REDACTED]' if key in REDACTED_FIELDS else redact(value) for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [redact(value) for value in payload]
+    return payload
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    #Formatter writing a record as one JSON object, with the fields passed to logEvent and a redacted payload.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'event': record.getMessage(),
+        }
+        entry.update(redact(getattr(record, 'fields', {})))
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            entry['payload'] = redact(sample(payload))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    #QueueHandler that leaves the formatting of a record to the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configureLogging(stream=None):
+    """
+    #Function to start writing the log records of this process, called by server.create_app.
+
+    Safe to call more than once, and called again in a forked process, where the listener
+    thread of the parent does not exist.
+
+    #Args:
+        stream (file): Stream the records are written to, stdout by default.
+
+    #Returns:
+        logging.Logger: The logger of the server.
+    """
+    global _listener
+    readSettings()
+    if logger.disabled:
+        return logger
+    with _lock:
+        if _listener is not None:
+            return logger
+        records = queue.SimpleQueue()
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=False)
+        _listener.start()
+        for existing in [h for h in logger.handlers if isinstance(h, (DeferredQueueHandler, logging.NullHandler))]:
+            logger.removeHandler(existing)
+        logger.addHandler(DeferredQueueHandler(records))
+    return logger
+
+
+def stopLogging():
+    """
+    #Function to write the queued records and stop the listener thread.
+
+    #Args:
+        None
+
+    #Returns:
+        None
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _restartInChild():
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        configureLogging()
+
+
+def logEvent(level, event, exc_info=None, **fields):
+    """
+    #Function to log an event with structured fields.
+
+    #Args:
+        level (int): Logging level, e.g. logging.INFO.
+        event (str): Name of the event, e.g. 'sync_completed'.
+        exc_info (Exception): Optional exception whose traceback is logged.
+        **fields: Values logged with the event, access tokens are redacted.
+
+    #Returns:
+        None
+    """
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+
+def logPayload(event, payload, level=logging.DEBUG, **fields):
+    """
+    #Function to log a large payload, e.g. a Plaid response, sampled and redacted.
+
+    Only LOG_PAYLOAD_SAMPLE_RATE of the calls log their payload, and the lists of the payload are cut
+    to LOG_PAYLOAD_MAX_ITEMS items when the record is written, so the payload must not be modified after it is logged.
+
+    #Args:
+        event (str): Name of the event.
+        payload (object): Dictionary, list or value to log.
+        level (int): Logging level, DEBUG by default.
+        **fields: Values logged with the event.
+
+    #Returns:
+        None
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if LOG_PAYLOAD_SAMPLE_RATE < 1 and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    logger.log(level, event, extra={'fields': fields, 'payload': payload})
+
+
+readSettings()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restartInChild)
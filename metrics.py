@@ -0,0 +1,282 @@
+"""
+# This file contains the metrics of the server, exposed in the Prometheus text format on /metrics.
+
+Every Flask route, every attempt of a Plaid API call and every MongoDB command is timed into a
+histogram. The time of every request is also split between Plaid, MongoDB and the server itself,
+so a slow route can be attributed to one of them. The Plaid time of a request is the time during
+which at least one of its Plaid calls was running, including the calls run concurrently by
+fanout.runConcurrently.
+
+Metrics are kept in memory per process, a server running several worker processes exposes the
+metrics of the worker answering the scrape.
+
+metrics.py
+
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+
+from flask import g, request
+from pymongo import monitoring
+
+from plaidclient import errorType
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatLabels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """
+    #Counter with labels.
+
+    #Args:
+        name (str): Name of the metric.
+        description (str): Help text of the metric.
+        labels (tuple): Names of the labels.
+    """
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{formatLabels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    #Histogram with labels and cumulative buckets.
+
+    #Args:
+        name (str): Name of the metric.
+        description (str): Help text of the metric.
+        labels (tuple): Names of the labels.
+        buckets (tuple): Upper bounds of the buckets, in increasing order.
+    """
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['count'] += 1
+            series['sum'] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, series in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{formatLabels(self.labels, label_values, ("le", bound))} {cumulative}')
+                lines.append(f'{self.name}_bucket{formatLabels(self.labels, label_values, ("le", "+Inf"))} {series["count"]}')
+                lines.append(f'{self.name}_sum{formatLabels(self.labels, label_values)} {series["sum"]}')
+                lines.append(f'{self.name}_count{formatLabels(self.labels, label_values)} {series["count"]}')
+        return lines
+
+
+REGISTRY = []
+
+request_duration = Histogram('http_request_duration_seconds', 'Duration of the requests of every route.',
+                             ('route', 'method', 'status'))
+request_breakdown = Histogram('http_request_breakdown_seconds', 'Time of the requests of every route spent in Plaid calls, '
+                              'MongoDB commands and the server itself.', ('route', 'component'))
+plaid_duration = Histogram('plaid_request_duration_seconds', 'Duration of every attempt of a Plaid API call.',
+                           ('endpoint', 'outcome'))
+plaid_errors = Counter('plaid_errors_total', 'Failed attempts of Plaid API calls.', ('endpoint', 'error_type'))
+mongo_duration = Histogram('mongodb_command_duration_seconds', 'Duration of the MongoDB commands.',
+                           ('command', 'collection', 'outcome'))
+
+# Plaid and MongoDB time of the request being served, copied to the threads of fanout.runConcurrently
+current_timing = contextvars.ContextVar('current_timing', default=None)
+
+
+class RequestTiming:
+    """
+    #Plaid and MongoDB calls of a request, added to by the threads serving it.
+
+    Every call is kept as a time interval, and the time of a component is the length of the union of
+    its intervals, so calls running concurrently are not counted twice.
+    """
+
+    def __init__(self):
+        self.intervals = {'plaid': [], 'mongo': []}
+        self.lock = threading.Lock()
+
+    def add(self, component, seconds):
+        end = time.perf_counter()
+        with self.lock:
+            self.intervals[component].append((end - seconds, end))
+
+    def total(self, component):
+        with self.lock:
+            intervals = sorted(self.intervals[component])
+        total = 0.0
+        covered_until = None
+        for start, end in intervals:
+            if covered_until is not None and start < covered_until:
+                start = covered_until
+            if end > start:
+                total += end - start
+                covered_until = end
+        return total
+
+
+def observePlaidCall(name, seconds, error):
+    """
+    #Listener of ResilientPlaidClient recording every attempt of a Plaid API call.
+
+    #Args:
+        name (str): Name of the endpoint.
+        seconds (float): Duration of the attempt.
+        error (Exception): The exception raised by the attempt, None if it succeeded.
+
+    #Returns:
+        None
+    """
+    if error is None:
+        plaid_duration.observe(seconds, name, 'ok')
+    else:
+        error_type = errorType(error) if hasattr(error, 'body') else type(error).__name__
+        plaid_duration.observe(seconds, name, 'error')
+        plaid_errors.inc(name, error_type or 'UNKNOWN')
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add('plaid', seconds)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    #pymongo command listener recording the duration of every command, by command and collection.
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self.lock:
+            self.collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ''
+
+    def finished(self, event, outcome):
+        with self.lock:
+            collection = self.collections.pop((event.connection_id, event.request_id), '')
+        seconds = event.duration_micros / 1e6
+        mongo_duration.observe(seconds, event.command_name, collection, outcome)
+        timing = current_timing.get()
+        if timing is not None:
+            timing.add('mongo', seconds)
+
+    def succeeded(self, event):
+        self.finished(event, 'ok')
+
+    def failed(self, event):
+        self.finished(event, 'error')
+
+
+def startRequest():
+    """
+    #before_request hook starting the timing of a request.
+    """
+    g.metrics_start = time.perf_counter()
+    g.metrics_timing = RequestTiming()
+    g.metrics_token = current_timing.set(g.metrics_timing)
+
+
+def finishRequest(response):
+    """
+    #after_request hook recording the duration of a request and its split between Plaid, MongoDB and the server.
+    """
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    seconds = time.perf_counter() - start
+    timing = g.pop('metrics_timing')
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_duration.observe(seconds, route, request.method, str(response.status_code))
+    plaid_seconds = timing.total('plaid')
+    mongo_seconds = timing.total('mongo')
+    request_breakdown.observe(plaid_seconds, route, 'plaid')
+    request_breakdown.observe(mongo_seconds, route, 'mongo')
+    request_breakdown.observe(max(0.0, seconds - plaid_seconds - mongo_seconds), route, 'server')
+    return response
+
+
+def resetRequest(error):
+    """
+    #teardown_request hook detaching the timing of a request from the context.
+    """
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        current_timing.reset(token)
+
+
+def instrument(app):
+    """
+    #Function to time every request of a Flask app.
+
+    #Args:
+        app (Flask): The Flask application.
+
+    #Returns:
+        Flask: The application.
+    """
+    app.before_request(startRequest)
+    app.after_request(finishRequest)
+    app.teardown_request(resetRequest)
+    return app
+
+
+def render():
+    """
+    #Function to render every metric in the Prometheus text format.
+
+    #Args:
+        None
+
+    #Returns:
+        str: The metrics.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,185 @@
+"""
+# This file contains the wrapper every Plaid API call of the server goes through.
+
+The wrapper retries transient failures with jittered exponential backoff, honors Plaid's
+rate limit errors and records the latency of every Plaid endpoint.
+
+plaidclient.py
+
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+
+from lazyimport import LazyImport
+
+# loaded with the first Plaid client, see lazyimport.py
+plaid = LazyImport('plaid')
+HTTPConnection = LazyImport('urllib3.connection', 'HTTPConnection')
+urllib3_exceptions = LazyImport('urllib3.exceptions')
+
+# calls that can be repeated without side effects, only these are retried after a server or connection error
+IDEMPOTENT_METHODS = {
+    'accounts_get',
+    'accounts_balance_get',
+    'item_get',
+    'transactions_sync',
+    'link_token_create',
+    'webhook_verification_key_get',
+}
+# error codes that mean the request was not processed, calls failing with them are always retried
+RETRYABLE_ERROR_TYPES = {'RATE_LIMIT_EXCEEDED'}
+
+
+def configurePool(configuration, pool_size):
+    """
+    #Function to set the size of the HTTP connection pool and enable TCP keep-alive on its connections.
+
+    Must be called before the plaid.ApiClient is created from the configuration.
+
+    #Args:
+        configuration (plaid.Configuration): Plaid configuration object.
+        pool_size (int): Maximum number of connections kept open to Plaid.
+
+    #Returns:
+        plaid.Configuration: The configuration.
+    """
+    configuration.connection_pool_maxsize = pool_size
+    configuration.socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    return configuration
+
+
+def errorType(e):
+    """
+    #Function to read the Plaid error type of an API exception.
+
+    #Args:
+        e (plaid.ApiException): Plaid API exception.
+
+    #Returns:
+        str: The error_type of the response body, None if the body is not a Plaid error.
+    """
+    try:
+        return json.loads(e.body).get('error_type')
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def retryAfter(e):
+    """
+    #Function to read the Retry-After header of an API exception.
+
+    #Args:
+        e (plaid.ApiException): Plaid API exception.
+
+    #Returns:
+        float: Seconds to wait, None if the header is missing.
+    """
+    try:
+        return float((e.headers or {}).get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ResilientPlaidClient:
+    """
+    #Wrapper around plaid_api.PlaidApi with retries and latency recording.
+
+    Any PlaidApi method can be called on the wrapper, e.g. client.accounts_get(request).
+
+    #Args:
+        api (plaid_api.PlaidApi): The wrapped Plaid API.
+        retries (int): Number of retries after the first attempt.
+        backoff (float): Base delay in seconds, doubled on every retry.
+        max_backoff (float): Maximum delay in seconds between two attempts, a rate limit error asking to wait
+                             longer is raised instead of retried.
+        timeout (float): HTTP timeout in seconds of every attempt, None for no timeout.
+    """
+
+    def __init__(self, api, retries=3, backoff=0.25, max_backoff=8, timeout=None):
+        self.api = api
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.latency = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.api, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            return self.call(name, method, *args, **kwargs)
+        return call
+
+    def call(self, name, method, *args, **kwargs):
+        """
+        #Call a Plaid API method, retrying transient failures.
+
+        #Args:
+            name (str): Name of the method, used as the endpoint name.
+            method (callable): The PlaidApi method.
+
+        #Returns:
+            object: The response of the method.
+
+        #Raises:
+            plaid.ApiException: If the call fails and is not retried, or still fails after the last retry.
+        """
+        if self.timeout is not None:
+            kwargs.setdefault('_request_timeout', self.timeout)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = method(*args, **kwargs)
+                self.record(name, time.perf_counter() - start, None)
+                return response
+            except plaid.ApiException as e:
+                self.record(name, time.perf_counter() - start, e)
+                rate_limited = e.status == 429 or errorType(e) in RETRYABLE_ERROR_TYPES
+                retryable = rate_limited or (name in IDEMPOTENT_METHODS and (e.status or 0) >= 500)
+                if not retryable or attempt >= self.retries:
+                    raise
+                delay = retryAfter(e) if rate_limited else None
+                # a longer Retry-After would hold the request, and the thread serving it, past its deadline
+                if delay is not None and delay > self.max_backoff:
+                    raise
+            except urllib3_exceptions.HTTPError as e:
+                self.record(name, time.perf_counter() - start, e)
+                if name not in IDEMPOTENT_METHODS or attempt >= self.retries:
+                    raise
+                delay = None
+            if delay is None:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            time.sleep(max(delay, 0))
+            attempt += 1
+
+    def record(self, name, seconds, error):
+        """
+        #Record the latency of an attempt and pass it to the listeners.
+
+        #Args:
+            name (str): Name of the endpoint.
+            seconds (float): Duration of the attempt.
+            error (Exception): The exception raised by the attempt, None if it succeeded.
+
+        #Returns:
+            None
+        """
+        with self.lock:
+            stats = self.latency.setdefault(name, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['errors'] += error is not None
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+        for listener in self.listeners:
+            listener(name, seconds, error)
@@ -7,11 +7,28 @@
         - pymongo
         - python-dotenv
         - flask-cors
+        - numpy
     #environment variables:
         - PLAID_CLIENT_ID from .env
         - PLAID_SECRET_ID from .env
         - PLAID_ENV from .env
         - MONGODB_URI from .env
+        - TRANSACTIONS_STORAGE from .env (optional, 'embedded' or 'collection')
+        - PLAID_HOST from .env (optional, overrides the Plaid environment url)
+        - PLAID_WEBHOOK_URL from .env (optional, url of /api/webhook)
+        - SYNC_MAX_AGE from .env (optional, seconds after which /api/transactions/update syncs an item without a webhook)
+        - ANALYTICS_BACKEND from .env (optional, 'python', 'aggregates' or 'pipeline')
+        - SPENDING_REBUILD_TIMEOUT from .env (optional, seconds a rebuild of the spending aggregates is waited for)
+        - PLAID_POOL_SIZE, PLAID_RETRIES and PLAID_HTTP_TIMEOUT from .env (optional)
+        - LINK_TOKEN_POOL_SIZE from .env (optional)
+        - ITEM_HEALTH_TTL from .env (optional)
+        - PENDING_EXPIRATION_DAYS from .env (optional, days before the consent of an item expires that it needs update mode)
+        - PLAID_WEBHOOK_VERIFY from .env (optional, '0' to trust ITEM webhooks without a valid Plaid-Verification header)
+        - TRANSACTIONS_MAX_LIMIT from .env (optional, largest page of /api/transactions)
+        - BOOTSTRAP_INDEXES from .env (optional, '0' to skip creating the indexes at startup)
+        - METRICS from .env (optional, '0' to disable /metrics)
+        - LOG_LEVEL, LOG_PAYLOAD_MAX_ITEMS and LOG_PAYLOAD_SAMPLE_RATE from .env (optional, see logs.py)
+        - COMPRESS_MIN_SIZE and COMPRESS_LEVEL from .env (optional, see compression.py)
     
     
     #To run the server, run the following command in the terminal:
@@ -20,62 +37,318 @@
 """
 
 import json
-import plaid
+import base64
+import hashlib
+import functools
 import datetime
-from plaid.api import plaid_api
-from plaid.model.link_token_create_request import LinkTokenCreateRequest
-from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
-from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
-from plaid.model.identity_get_request import IdentityGetRequest
-from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
-from plaid.model.transactions_sync_request import TransactionsSyncRequest
-from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.products import Products
 import os
-from flask import Flask, jsonify
+from flask import Flask, jsonify, g, make_response
 from dotenv import load_dotenv
 import time
-from plaid.model.country_code import CountryCode
 from flask_cors import CORS
-from flask import request
+from flask import request, stream_with_context
 from flask import Response as Response
 from pymongo import MongoClient
-from components import addUser, addAccount, getUserAccounts, checkIfUserExits, checkIfAccessTokenExits, getAllTransactions, getCursor, addTransactions, addTransactionsv1
+from fanout import runConcurrently, FanOutTimeout
+from clients import processLocal
+from lazyimport import LazyImport
+from cache import TTLCache
+from plaidclient import ResilientPlaidClient, configurePool
+from linktokens import LinkTokenPool
+from health import recordItemHealth, getItemHealth, isItemError, itemStatus
+from webhookverify import WebhookVerifier
+from syncstate import getSyncState, getSyncStates, hasPendingChanges, markSyncPending, startSync, restartSync, checkpointSync, recordSync, recordSyncError
+from components import addUser, addAccount, getAllTransactions, addTransactions, addTransactionDocuments, getTransactionDocuments, getLatestTransactionDate, getUserByItemId, getTransactionsByIds, getTransactionDocumentsByIds, updateSpending, rebuildSpending, claimSpendingRebuild, releaseSpendingRebuild, isSpendingRebuilding, invalidateSpending, isSpendingBuilt, getSpending, getLatestSpendingMonth, aggregateTopCategories, aggregateLatestSpendingDate, aggregateCategoryChanges, getTransactionsPage, getUserSnapshot, bumpDataVersion, resetCursor
+from jobs import enqueueSyncJob, getSyncJobs
+from bootstrap import bootstrap
+import metrics
+import logging
+from logs import configureLogging, logEvent, logPayload
+from compression import enableCompression
+
+# the Plaid SDK and numpy are imported on first use, so a worker starts serving requests without loading them
+plaid = LazyImport('plaid')
+plaid_api = LazyImport('plaid.api.plaid_api')
+LinkTokenCreateRequest = LazyImport('plaid.model.link_token_create_request', 'LinkTokenCreateRequest')
+LinkTokenCreateRequestUser = LazyImport('plaid.model.link_token_create_request_user', 'LinkTokenCreateRequestUser')
+ItemPublicTokenExchangeRequest = LazyImport('plaid.model.item_public_token_exchange_request', 'ItemPublicTokenExchangeRequest')
+IdentityGetRequest = LazyImport('plaid.model.identity_get_request', 'IdentityGetRequest')
+AccountsBalanceGetRequest = LazyImport('plaid.model.accounts_balance_get_request', 'AccountsBalanceGetRequest')
+TransactionsSyncRequest = LazyImport('plaid.model.transactions_sync_request', 'TransactionsSyncRequest')
+AccountsGetRequest = LazyImport('plaid.model.accounts_get_request', 'AccountsGetRequest')
+ItemGetRequest = LazyImport('plaid.model.item_get_request', 'ItemGetRequest')
+WebhookVerificationKeyGetRequest = LazyImport('plaid.model.webhook_verification_key_get_request', 'WebhookVerificationKeyGetRequest')
+Products = LazyImport('plaid.model.products', 'Products')
+CountryCode = LazyImport('plaid.model.country_code', 'CountryCode')
+topCategories = LazyImport('analytics', 'topCategories')
+categoryChanges = LazyImport('analytics', 'categoryChanges')
+expenseReport = LazyImport('analytics', 'expenseReport')
+patternReport = LazyImport('analytics', 'patternReport')
 
 
 load_dotenv()
 app = Flask(__name__)
-CORS(app)
+# ETag is exposed so browser clients can send it back in If-None-Match
+CORS(app, expose_headers=['ETag'])
+# request, Plaid and MongoDB metrics served on /metrics, set METRICS=0 to disable them
+METRICS = os.getenv('METRICS', '1') == '1'
+if METRICS:
+    metrics.instrument(app)
+# responses of at least COMPRESS_MIN_SIZE bytes are compressed with br or gzip
+enableCompression(app)
 
 PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
 PLAID_SECRET = os.getenv('PLAID_SECRET_ID')
 MONGODB_URI = os.getenv('MONGODB_URI')
+# 'embedded' stores transactions inside the user document, 'collection' stores one document per transaction in the transactions collection
+TRANSACTIONS_STORAGE = os.getenv('TRANSACTIONS_STORAGE', 'embedded')
 
 # plaid.Environment.Sandbox change to plaid.Environment.Production for production and plaid.Environment.development for development
-host = plaid.Environment.Sandbox
+# PLAID_HOST can point the client to another server, e.g. a local fake Plaid server for tests
+host = os.getenv('PLAID_HOST')
 PLAID_REDIRECT_URI = 'http://localhost:3000/'
+# url Plaid sends webhooks to, /api/webhook of this server
+PLAID_WEBHOOK_URL = os.getenv('PLAID_WEBHOOK_URL')
+# with webhooks, seconds after which /api/transactions/update syncs an item again without a SYNC_UPDATES_AVAILABLE webhook,
+# e.g. an item linked before the webhook was configured, without webhooks every item is synced
+SYNC_MAX_AGE = float(os.getenv('SYNC_MAX_AGE', 3600)) if PLAID_WEBHOOK_URL else 0
+# seconds a cached item balance is fresh, and seconds after that it is served while being refreshed
+BALANCE_CACHE_TTL = float(os.getenv('BALANCE_CACHE_TTL', 60))
+BALANCE_CACHE_STALE_TTL = float(os.getenv('BALANCE_CACHE_STALE_TTL', 300))
+# number of link tokens created ahead of time for /api/linkToken, 0 creates them on demand
+LINK_TOKEN_POOL_SIZE = int(os.getenv('LINK_TOKEN_POOL_SIZE', 5))
+# seconds a healthy item is not checked again by /api/Reauthenticate, items with an error are always checked
+ITEM_HEALTH_TTL = float(os.getenv('ITEM_HEALTH_TTL', 300))
+# days before its consent expires that an item is reported with PENDING_EXPIRATION, Plaid sends the webhook 7 days before
+PENDING_EXPIRATION_DAYS = float(os.getenv('PENDING_EXPIRATION_DAYS', 7))
+# ITEM webhooks only change the recorded health of an item if their Plaid-Verification header is valid
+PLAID_WEBHOOK_VERIFY = os.getenv('PLAID_WEBHOOK_VERIFY', '1') == '1'
+# largest page of /api/transactions, larger limits are reduced to it
+TRANSACTIONS_MAX_LIMIT = int(os.getenv('TRANSACTIONS_MAX_LIMIT', 1000))
+# 'python' computes /api/expense and /api/pattern from the transactions with analytics.py, 'aggregates' reads the spending collection,
+# 'pipeline' computes them in MongoDB aggregation pipelines
+ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', 'python')
+# seconds a rebuild of a user's spending aggregates holds its claim, requests reading them meanwhile wait for it
+SPENDING_REBUILD_TIMEOUT = int(os.getenv('SPENDING_REBUILD_TIMEOUT', 60))
+
+
+# Plaid HTTP connection pool size, retries of transient errors and timeout in seconds of every attempt
+PLAID_POOL_SIZE = int(os.getenv('PLAID_POOL_SIZE', 20))
+PLAID_RETRIES = int(os.getenv('PLAID_RETRIES', 3))
+PLAID_HTTP_TIMEOUT = float(os.getenv('PLAID_HTTP_TIMEOUT', 30))
+
+
+def createPlaidClient():
+    """
+    #Function to create the Plaid client of the current process.
 
+    #Args:
+        None
 
-# Your api keys are stored in the .env file
-configuration = plaid.Configuration(
-    host=host,
-    api_key={
-        'clientId': PLAID_CLIENT_ID,
-        'secret': PLAID_SECRET,
-        'plaidVersion': '2020-09-14'
-    }
-)
+    #Returns:
+        ResilientPlaidClient: Plaid client that retries transient errors and records the latency of every endpoint.
+    """
+    # Your api keys are stored in the .env file
+    configuration = plaid.Configuration(
+        host=host or plaid.Environment.Sandbox,
+        api_key={
+            'clientId': PLAID_CLIENT_ID,
+            'secret': PLAID_SECRET,
+            'plaidVersion': '2020-09-14'
+        }
+    )
+    configurePool(configuration, PLAID_POOL_SIZE)
+    api_client = plaid.ApiClient(configuration)
+    plaid_client = ResilientPlaidClient(plaid_api.PlaidApi(api_client), retries=PLAID_RETRIES, timeout=PLAID_HTTP_TIMEOUT)
+    if METRICS:
+        plaid_client.listeners.append(metrics.observePlaidCall)
+    return plaid_client
 
 
-api_client = plaid.ApiClient(configuration)
-client = plaid_api.PlaidApi(api_client)
+# the clients are created on first use in every process, so forked workers never share a connection
+client = processLocal(createPlaidClient)
 # mongo db connection
-mongo_client = MongoClient(MONGODB_URI)
+mongo_client = processLocal(lambda: MongoClient(MONGODB_URI, event_listeners=[metrics.MongoCommandListener()] if METRICS else []))
 # database name is Plaid with a collection name users schema is {email:' ',name:' ',accounts:[ {access_token:' ',item_id:' '} ]}
-db = mongo_client['Plaid']
-collection = db['users']
-transactionsdb = db['transactions']
+db = processLocal(lambda: mongo_client['Plaid'])
+collection = processLocal(lambda: db['users'])
+# transactions collection schema is {_id:transaction_id, email:' ', item:item_id, ...plaid transaction fields}
+transactionsdb = processLocal(lambda: db['transactions'])
+# account balances of every item keyed by item_id
+balance_cache = TTLCache(BALANCE_CACHE_TTL, BALANCE_CACHE_STALE_TTL)
+# link tokens for /api/linkToken, the pool starts filling on the first request
+link_token_pool = LinkTokenPool(lambda: createLinkToken(), size=LINK_TOKEN_POOL_SIZE)
+# verification keys of the webhooks, fetched from Plaid on first use
+webhook_verifier = WebhookVerifier(lambda key_id: fetchWebhookKey(key_id))
+# spending collection schema is {email:' ', month:'YYYY-MM'|'all', category:[' '], amount:0, count:0}
+spendingdb = processLocal(lambda: db['spending'])
+# item health collection schema is {item_id:' ', status:'ok'|'login_required'|'error', error:{}, checked_at:date}
+healthdb = processLocal(lambda: db['item_health'])
+# sync state collection schema is {item_id:' ', email:' ', cursor:' ', last_synced:date, status:'ok'|'error', pending_at:date, added:0, modified:0, removed:0}
+statedb = processLocal(lambda: db['sync_state'])
+# sync jobs collection schema is {email:' ', item_id:' ', status:'pending'|'running'|'done'|'failed', attempts:0, ...}
+jobsdb = processLocal(lambda: db['sync_jobs'])
+
+
+def create_app():
+    """
+    #The app factory used by wsgi.py, asyncserver.py, worker.py and the development server.
+
+    Starts the log writer of logs.py, and creates the indexes and applies the schema migrations unless BOOTSTRAP_INDEXES=0, which is set when
+    bootstrap.py is run separately, e.g. once before the workers of a deployment start.
+    The MongoDB and Plaid clients are not created here, they are created on first use in every process.
+
+    #Args:
+        None
+
+    #Returns:
+        Flask: The Flask application.
+    """
+    configureLogging()
+    if os.getenv('BOOTSTRAP_INDEXES', '1') == '1':
+        bootstrap(db, TRANSACTIONS_STORAGE)
+    return app
+
+
+def closeClients():
+    """
+    #Close the MongoDB connection of the current process, the next use opens a new one.
+
+    Called when a worker process stops, and by the gunicorn master after the app is preloaded so
+    the connection it opened to create the indexes is not inherited by the workers.
+
+    #Args:
+        None
+
+    #Returns:
+        None
+    """
+    if mongo_client.created():
+        mongo_client.close()
+    for local in (mongo_client, db, collection, transactionsdb, spendingdb, healthdb, statedb, jobsdb):
+        local.reset()
+
+
+def currentUser(email):
+    """
+    #Load a user once per request.
+
+    The user is fetched with getUserSnapshot the first time it is needed and kept in flask.g, so the
+    existence check, the accounts and the cursors of a request are served by a single MongoDB read.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        dict: User without the stored transactions, None if the user does not exist.
+    """
+    users = g.setdefault('users', {})
+    if email not in users:
+        users[email] = getUserSnapshot(collection, email)
+    return users[email]
+
+def forgetUser(email):
+    """
+    #Drop the loaded user so the next access reads it again, called after the request changes the user.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        None
+    """
+    g.setdefault('users', {}).pop(email, None)
+
+def userExists(email):
+    """
+    #Check if a user exists, like checkIfUserExits but from the user loaded for the request.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        bool: True if the user exists, False if the user does not exist.
+    """
+    return currentUser(email) is not None
+
+def userAccounts(email):
+    """
+    #Retrieve the accounts of a user, like getUserAccounts but from the user loaded for the request.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        list: List of accounts if the user exists, None if the user does not exist.
+    """
+    user = currentUser(email)
+    if user is None:
+        return None
+    return user.get('account')
+
+def userSpendingBuilt(email):
+    """
+    #Check if a user's spending aggregates are built, like isSpendingBuilt but from the user loaded for the request.
 
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        bool: True if the aggregates are built, False otherwise.
+    """
+    return bool((currentUser(email) or {}).get('spending_built'))
+
+def dataETag(email):
+    """
+    #Compute the ETag of a read route's response for a user.
+
+    The ETag is derived from the user's data_version, which every write to the user's accounts or
+    transactions increments, and from the route, its parameters and the storage and analytics settings.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        str: The ETag value, None if the user does not exist.
+    """
+    user = currentUser(email)
+    if user is None:
+        return None
+    key = json.dumps([request.path, sorted(request.values.items(multi=True)), TRANSACTIONS_STORAGE, ANALYTICS_BACKEND])
+    return f"{user.get('data_version', 0)}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+
+def conditional(view):
+    """
+    #Decorator answering a read route with 304 Not Modified when the client's ETag is still current.
+
+    The ETag is checked before the view runs, so an unchanged response costs a single read of the user
+    without its transactions. Successful responses get the ETag, responses reporting an error do not.
+
+    #Args:
+        view (callable): The Flask view, reading the email from the request form.
+
+    #Returns:
+        callable: The decorated view.
+    """
+    @functools.wraps(view)
+    def conditionalView(*args, **kwargs):
+        etag = dataETag(request.form['email']) if 'email' in request.form else None
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            return response
+        response = make_response(view(*args, **kwargs))
+        if etag is None or response.status_code != 200:
+            return response
+        # error responses of these routes are small JSON objects with an error key
+        if not response.is_streamed and response.content_length is not None and response.content_length < 1024:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict) and 'error' in body:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return conditionalView
 
 @app.route('/', methods=['GET'])
 def index():
@@ -87,32 +360,64 @@ def index():
     """
     return f"Flask server running on port {os.getenv('PORT', 8000)}"
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    #Expose the request, Plaid and MongoDB metrics of this process in the Prometheus text format.
+
+    #Returns:
+        Response: The metrics, 404 if METRICS is disabled.
+    """
+    if not METRICS:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/linkToken', methods=['GET'])
 def linkToken():
     """
     #Generate a link token to link a user account with Plaid.
 
+    The link token is taken from link_token_pool, a new one is created only when the pool is empty.
+
     #Returns:
         dict: The link token as a dictionary, containing the link token value and other metadata.
 
     #Raises:
         plaid.ApiException: If an error occurs while generating the link token.
     """
+    link_token_pool.start()
     try:
-        request = LinkTokenCreateRequest(
-            products=[Products('auth'), Products('transactions')],
-            client_name="Plaid Quickstart",
-            country_codes=[CountryCode('US')],
-            language='en',
-            user=LinkTokenCreateRequestUser(
-                client_user_id=str(time.time())
-            )
-        )
-        response = client.link_token_create(request)
-        return jsonify(response.to_dict())
+        response = link_token_pool.get()
+        if response is None:
+            response = createLinkToken()
+        return jsonify(response)
     except plaid.ApiException as e:
         return json.loads(e.body)
 
+def createLinkToken():
+    """
+    #Create a link token for the default products and country codes.
+
+    #Returns:
+        dict: The link token as a dictionary, containing the link token value and other metadata.
+
+    #Raises:
+        plaid.ApiException: If an error occurs while generating the link token.
+    """
+    request = LinkTokenCreateRequest(
+        products=[Products('auth'), Products('transactions')],
+        client_name="Plaid Quickstart",
+        country_codes=[CountryCode('US')],
+        language='en',
+        user=LinkTokenCreateRequestUser(
+            client_user_id=str(time.time())
+        )
+    )
+    if PLAID_WEBHOOK_URL:
+        request.webhook = PLAID_WEBHOOK_URL
+    response = client.link_token_create(request)
+    return response.to_dict()
+
 @app.route('/api/setAccessToken', methods=['POST'])
 def setAccessToken():
     """
@@ -135,8 +440,9 @@ def setAccessToken():
     
     try:
         """# Check if the email exists, and if not, add a new user"""
-        if checkIfUserExits(collection, email) is False:
+        if userExists(email) is False:
             addUser(collection, email)
+            forgetUser(email)
 
         """# Exchange the public token for an access token"""
         exchange_request = ItemPublicTokenExchangeRequest(public_token=public_token)
@@ -145,15 +451,18 @@ def setAccessToken():
         item_id = exchange_response['item_id']
 
         """# Check if the access token exists for the user, and if not, add the account"""
-        if checkIfAccessTokenExits(collection, email, access_token) is False:
+        if all(account['access_token'] != access_token for account in userAccounts(email) or []):
             addAccount(collection, email, access_token, item_id)
+            forgetUser(email)
+        balance_cache.invalidate(item_id)
 
         return jsonify({'error': None})
     except plaid.ApiException as e:
-        pretty_print_response(e)
+        logEvent(logging.WARNING, 'plaid_error', route='setAccessToken', **format_error(e))
         return json.loads(e.body)
 
 @app.route('/api/accounts', methods=['POST', 'GET'])
+@conditional
 def get_accounts():
     """
     #Get user accounts associated with the access token.
@@ -168,16 +477,19 @@ def get_accounts():
         plaid.ApiException: If an error occurs during the API call.
     """
     email = request.form['email']
-    accounts = getUserAccounts(collection, email)
+    accounts = userAccounts(email)
 
     if accounts is None:
         return jsonify({'error': 'User does not exist'}), 404
 
     institution_ids = []
     try:
-        for access_token in accounts:
-            requests = AccountsGetRequest(access_token=access_token['access_token'])
-            response = client.accounts_get(requests)
+        outcomes = runConcurrently(
+            lambda access_token: client.accounts_get(AccountsGetRequest(access_token=access_token['access_token'])),
+            accounts)
+        for response, error in outcomes:
+            if error is not None:
+                raise error
             institution_id = response.item.institution_id
             institution_ids.append(institution_id)
 
@@ -185,14 +497,20 @@ def get_accounts():
     except plaid.ApiException as e:
         error_response = format_error(e)
         return jsonify(error_response), 500
+    except FanOutTimeout as e:
+        return jsonify(format_timeout(e)), 504
     
 @app.route('/api/balance', methods=['GET','POST'])
 def get_balance():
     """
     #Get the account balances for the user.
 
+    The balances of every item are cached for BALANCE_CACHE_TTL seconds and served stale while they are
+    refreshed for BALANCE_CACHE_STALE_TTL more seconds.
+
     #Args:
         email (str): The email of the user.
+        refresh (str): Optional, 'true' to bypass the cache and fetch the balances from Plaid.
 
     #Returns:
         dict: A dictionary containing the total balance, total current balance, and
@@ -202,39 +520,34 @@ def get_balance():
          plaid.ApiException: If an error occurs during the API call.
     """
     email = request.form['email']
-    if checkIfUserExits(collection, email) is False:
+    if userExists(email) is False:
         return jsonify({'error': 'User does not exist'})
 
-    account = getUserAccounts(collection, email)
+    account = userAccounts(email)
     balance_obj = {}
     total_balance = 0
     total_current_balance = 0
 
+    bypass = request.values.get('refresh', '').lower() in ('1', 'true')
+
     try:
-        for access_token in account:
-            requests = AccountsBalanceGetRequest(
-                access_token=access_token['access_token']
-            )
-            response = client.accounts_balance_get(requests)
-
-            # Extract account details and add them to balance_obj
-            for account_details in response.accounts:
-                account_id = account_details.account_id
-                account_name = account_details.name
-                balances = {
-                    'available': account_details.balances.available,
-                    'current': account_details.balances.current,
-                    'iso_currency_code': account_details.balances.iso_currency_code,
-                    'limit': account_details.balances.limit,
-                    'unofficial_currency_code': account_details.balances.unofficial_currency_code
-                }
-                balance_obj.setdefault(account_id, []).append({
-                    'name': account_name,
-                    'balances': balances
+        outcomes = runConcurrently(
+            lambda access_token: balance_cache.get(
+                access_token['item_id'], lambda: getItemBalances(access_token['access_token']), bypass=bypass),
+            account)
+        for item_accounts, error in outcomes:
+            if error is not None:
+                raise error
+
+            # Add the cached account details to balance_obj
+            for account_details in item_accounts:
+                balance_obj.setdefault(account_details['account_id'], []).append({
+                    'name': account_details['name'],
+                    'balances': dict(account_details['balances'])
                 })
 
-                total_balance += account_details.balances.available
-                total_current_balance += account_details.balances.current
+                total_balance += account_details['balances']['available']
+                total_current_balance += account_details['balances']['current']
 
         response_data = {
             'total_balance': total_balance,
@@ -258,6 +571,38 @@ def get_balance():
     except plaid.ApiException as e:
         error_response = format_error(e)
         return jsonify(error_response), 500
+    except FanOutTimeout as e:
+        return jsonify(format_timeout(e)), 504
+
+def getItemBalances(access_token):
+    """
+    #Fetch the account balances of one item from Plaid.
+
+    #Args:
+        access_token (str): Access token of the item.
+
+    #Returns:
+        list: A dictionary with the account id, name and balances of every account of the item.
+
+    #Raises:
+        plaid.ApiException: If an error occurs during the API call.
+    """
+    requests = AccountsBalanceGetRequest(access_token=access_token)
+    response = client.accounts_balance_get(requests)
+    item_accounts = []
+    for account_details in response.accounts:
+        item_accounts.append({
+            'account_id': account_details.account_id,
+            'name': account_details.name,
+            'balances': {
+                'available': account_details.balances.available,
+                'current': account_details.balances.current,
+                'iso_currency_code': account_details.balances.iso_currency_code,
+                'limit': account_details.balances.limit,
+                'unofficial_currency_code': account_details.balances.unofficial_currency_code
+            }
+        })
+    return item_accounts
 
 @app.route('/api/transactions/test', methods=['GET'])
 def get_transactions():
@@ -277,9 +622,9 @@ def get_transactions():
         None
     """
     email = request.form['email']
-    if checkIfUserExits(collection, email) is False:
+    if userExists(email) is False:
         return jsonify({'error': 'User does not exist'})
-    account = getUserAccounts(collection, email)
+    account = userAccounts(email)
     obj = dict()
     i = 1
     try:
@@ -322,7 +667,7 @@ def get_transactions_from_access_token(access_token):
                 cursor=cursor,
             )
             response = client.transactions_sync(request).to_dict()
-            pretty_print_response(response)
+            logPayload('transactions_sync_page', response, cursor=cursor)
             has_more = response['has_more']
             added.extend(response['added'])
             cursor = response['next_cursor']
@@ -337,139 +682,477 @@ def get_transactions_from_access_token(access_token):
 @app.route('/api/transactions/update', methods=['POST'])
 def get_transactionsUpdate():
     """
-    #Retrieve updated transactions for the user.
+    #Queue a transactions sync for every item of the user.
 
-    This function fetches updated transactions for the user. It first retrieves the user's email from the request.
-    If the user does not exist, it returns an error response.
-    If the user exists, it retrieves all access tokens associated with the user and checks if there are any stored cursors in the database.
-    If cursors are not found, it retrieves all transactions for each access token and stores them in the database with their respective cursors.
-    If cursors are found, it retrieves transactions starting from the stored cursors for each access token and updates the stored cursors in the database.
-    The function returns a dictionary containing the updated transactions.
+    This function retrieves the user's email from the request. If the user does not exist, it returns an error response.
+    If the user exists, it enqueues one sync job for every item with pending changes and returns immediately.
+    An item has pending changes if it was never synced, its last sync failed, a SYNC_UPDATES_AVAILABLE
+    webhook arrived after its last sync started or its last sync is older than SYNC_MAX_AGE. Without
+    PLAID_WEBHOOK_URL no webhook ever arrives, and every item is synced.
+    The jobs are run by worker.py, which fetches the transactions starting from the stored cursor of each item
+    and stores them in the database with the updated cursor.
 
     #Args:
         None (retrieves email from request)
+        force (str): Optional, 'true' to sync every item.
 
     #Returns:
-        dict: Dictionary containing the updated transactions.
+        dict: Dictionary containing the ID of the queued job for every item synced and the ids of the items skipped, with status 202.
 
     #Raises:
-         plaid.ApiException: If an error occurs during the API call.
+        None
     """
     email = request.form['email']
-    if checkIfUserExits(collection, email) is False:
+    if userExists(email) is False:
         return jsonify({'error': 'User does not exist'}), 404
 
-    account = getUserAccounts(collection, email)
+    force = request.values.get('force', '').lower() in ('1', 'true')
+    states = getSyncStates(statedb, email)
     obj = dict()
-    i = 1
+    skipped = []
+    for access_token in userAccounts(email) or []:
+        if force or hasPendingChanges(states.get(access_token['item_id']), max_age=SYNC_MAX_AGE):
+            obj[access_token['item_id']] = str(enqueueSyncJob(jobsdb, email, access_token['item_id']))
+        else:
+            skipped.append(access_token['item_id'])
+
+    return jsonify({'jobs': obj, 'skipped': skipped}), 202
+
+@app.route('/api/transactions/jobs', methods=['GET', 'POST'])
+def get_transactionsJobs():
+    """
+    #Retrieve the latest sync jobs of the user.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        list: List of jobs with their item id, status, number of attempts and last error, newest first.
+    """
+    email = request.form['email']
+    jobs = []
+    for job in getSyncJobs(jobsdb, email):
+        jobs.append({
+            'id': str(job['_id']),
+            'item_id': job['item_id'],
+            'status': job['status'],
+            'attempts': job.get('attempts', 0),
+            'error': job.get('error'),
+            'updated_at': job.get('updated_at'),
+        })
+    return jsonify(jobs)
+
+@app.route('/api/webhook', methods=['POST'])
+def webhook():
+    """
+    #Receive Plaid webhooks.
+
+    A TRANSACTIONS SYNC_UPDATES_AVAILABLE webhook enqueues a sync job for the item it refers to, the sync
+    only fetches what Plaid reports, so it is accepted without verification.
+    ITEM ERROR, PENDING_EXPIRATION and LOGIN_REPAIRED webhooks record the health of the item once their
+    Plaid-Verification header is verified, unless PLAID_WEBHOOK_VERIFY=0.
+    Other webhooks are acknowledged and ignored.
+
+    #Args:
+        webhook_type (str): Type of the webhook, from the JSON body.
+        webhook_code (str): Code of the webhook, from the JSON body.
+        item_id (str): ID of the item the webhook refers to, from the JSON body.
+
+    #Returns:
+        dict: A dictionary with an 'error' key, and the queued job id if a sync was enqueued.
+    """
+    body = request.get_json(force=True, silent=True) or {}
+    if body.get('webhook_type') == 'ITEM' and body.get('item_id'):
+        if PLAID_WEBHOOK_VERIFY and not webhook_verifier.verify(request.get_data(), request.headers.get('Plaid-Verification')):
+            logEvent(logging.WARNING, 'webhook_rejected', item_id=body['item_id'], webhook_code=body.get('webhook_code'))
+            return jsonify({'error': 'Invalid Plaid-Verification header'}), 401
+        if body.get('webhook_code') == 'ERROR' and body.get('error'):
+            recordItemHealth(healthdb, body['item_id'], {'error': {
+                'status_code': body['error'].get('status'),
+                'display_message': body['error'].get('error_message'),
+                'error_code': body['error'].get('error_code'),
+                'error_type': body['error'].get('error_type')
+            }}, source='webhook')
+        elif body.get('webhook_code') == 'PENDING_EXPIRATION':
+            recordItemHealth(healthdb, body['item_id'], {'error': {
+                'status_code': None,
+                'display_message': 'The access consent of the item is expiring',
+                'error_code': 'PENDING_EXPIRATION',
+                'error_type': 'ITEM_ERROR'
+            }}, source='webhook')
+        elif body.get('webhook_code') == 'LOGIN_REPAIRED':
+            recordItemHealth(healthdb, body['item_id'], source='webhook')
+        return jsonify({'error': None})
+    if body.get('webhook_type') != 'TRANSACTIONS' or body.get('webhook_code') != 'SYNC_UPDATES_AVAILABLE':
+        return jsonify({'error': None})
+
+    user = getUserByItemId(collection, body.get('item_id'))
+    if user is None:
+        return jsonify({'error': 'Item does not exist'}), 404
+
+    markSyncPending(statedb, user['email'], body['item_id'])
+    job_id = enqueueSyncJob(jobsdb, user['email'], body['item_id'], reason='webhook')
+    return jsonify({'error': None, 'job': str(job_id)})
+
+def fetchWebhookKey(key_id):
+    """
+    #Fetch a webhook verification key from Plaid, used by webhook_verifier.
+
+    #Args:
+        key_id (str): ID of the key, from the header of the Plaid-Verification JWT.
+
+    #Returns:
+        dict: The key as a JWK dictionary, None if Plaid does not know the key.
+
+    #Raises:
+        plaid.ApiException: If the key could not be fetched, e.g. a rate limit.
+    """
     try:
-        for access_token in account:
-            a = 'account_'+str(i)
-            if getCursor(collection, email, a) is None:
-                result = getTransactionsSync(
-                    access_token['access_token'], cursorparam='')
-                obj[a] = addTransactions(
-                    collection, email, result['transactions'], result['cursor'], a)
-            else:
-                result = getTransactionsSync(
-                    access_token['access_token'], cursorparam=getCursor(collection, email, a))
-                obj[a] = addTransactions(
-                    collection, email, result['transactions'], result['cursor'], a)
-            i = i+1
+        response = client.webhook_verification_key_get(WebhookVerificationKeyGetRequest(key_id=key_id))
+    except plaid.ApiException as e:
+        """# Plaid answers an unknown key id with a 400 error, other errors are raised so the key is not remembered as unknown"""
+        if e.status == 400:
+            return None
+        raise
+    return response.to_dict()['key']
 
-        return jsonify({'transactions': obj})
+def syncItem(email, access_token, item_id, on_page=None):
+    """
+    #Run a transactions sync for one item, starting from the cursor in its sync state, and store the result.
+
+    Every page is stored before the next one is fetched, and its cursor is checkpointed in the sync state
+    once the page is stored, so memory is bounded by one page and an interrupted sync resumes from the
+    last checkpoint. Storing a page again after an interruption has no effect: the transactions collection
+    upserts by transaction_id and the user document only accepts a page fetched with its stored cursor.
+    The cursor the pagination started with is kept until the sync completes. When Plaid reports
+    TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION, the stored cursors are moved back to it and the
+    next attempt fetches every page again, replacing the transactions already stored.
+
+    #Args:
+        email (str): The email of the user.
+        access_token (str): Access token of the item.
+        item_id (str): ID of the item, the item's transactions and sync state are stored under it.
+        on_page (callable): Optional, called without arguments after every checkpoint, e.g. to renew the lease of the job.
 
+    #Returns:
+        bool or dict: True if the sync completed, or the formatted Plaid error if the sync failed.
+    """
+    started = datetime.datetime.utcnow()
+    state = getSyncState(statedb, item_id) or {}
+    cursor = state.get('cursor') or ''
+    """# A sync that did not complete resumes from its checkpoint, its pagination still started at start_cursor"""
+    start_cursor = state.get('start_cursor')
+    if start_cursor is None:
+        start_cursor = cursor
+        startSync(statedb, email, item_id, cursor)
+    pages = 0
+    try:
+        for page in getTransactionsSync(access_token, cursorparam=cursor):
+            pages += 1
+            if storeTransactions(email, page, item_id, replayed=bool(state.get('replayed'))):
+                checkpointSync(statedb, email, item_id, page['cursor'], added=len(page['transactions']),
+                               modified=len(page['modified']), removed=len(page['removed']))
+            else:
+                checkpointSync(statedb, email, item_id, page['cursor'])
+            cursor = page['cursor']
+            if on_page is not None:
+                on_page()
     except plaid.ApiException as e:
         error_response = format_error(e)
-        return jsonify(error_response), 500
+        if error_response['error']['error_code'] == 'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION':
+            restartSync(statedb, item_id, start_cursor)
+            if TRANSACTIONS_STORAGE != 'collection':
+                resetCursor(collection, email, item_id, start_cursor)
+        recordSyncError(statedb, email, item_id, error_response)
+        logEvent(logging.WARNING, 'sync_failed', item_id=item_id, pages=pages, **error_response)
+        return error_response
+    recordSync(statedb, email, item_id, cursor, started)
+    logEvent(logging.INFO, 'sync_completed', item_id=item_id, pages=pages,
+             seconds=(datetime.datetime.utcnow() - started).total_seconds())
+    return True
+
+def syncUserItem(email, item_id, on_page=None):
+    """
+    #Run a transactions sync for an item of a user, called by worker.py for every job.
+
+    #Args:
+        email (str): The email of the user.
+        item_id (str): ID of the item to sync.
+        on_page (callable): Optional, called after every page is stored, see syncItem.
+
+    #Returns:
+        bool or dict: The result of syncItem, or an error dictionary if the item does not exist.
+    """
+    for access_token in userAccounts(email) or []:
+        if access_token['item_id'] == item_id:
+            result = syncItem(email, access_token['access_token'], item_id, on_page=on_page)
+            if isinstance(result, dict) and 'error' in result and isItemError(result):
+                recordItemHealth(healthdb, item_id, result, source='sync')
+            return result
+    return {'error': 'Item does not exist'}
 
 def getTransactionsSync(access_token, cursorparam):
     """
-    #Retrieve transactions from Plaid using the transactions_sync endpoint.
+    #Retrieve transactions from Plaid using the transactions_sync endpoint, one page at a time.
 
-    This function takes an access token and a cursor as input and retrieves all transactions associated with the access token.
+    This function takes an access token and a cursor as input and yields the transactions associated with the access token.
     It uses the transactions_sync endpoint to fetch transactions in batches until there are no more transactions available.
-    The function returns a dictionary containing the list of transactions and the updated cursor.
+    Every batch is yielded before the next one is fetched, so only one batch is held in memory.
 
     #Args:
         access_token (str): Access token for the user's Plaid account.
         cursorparam (str): Cursor to paginate through transactions.
 
     #Returns:
-        dict: Dictionary containing the list of transactions and the updated cursor.
+        generator: Dictionaries containing the added transactions, the modified transactions, the removed
+                   transaction ids, the cursor the batch was fetched with and the updated cursor.
 
     #Raises:
         plaid.ApiException: If an error occurs during the API request.
     """
     cursor = cursorparam
     has_more = True
-    added = []
-    try:
-        while has_more:
-            request = TransactionsSyncRequest(
-                access_token=access_token,
-                cursor=cursor,
-            )
-            response = client.transactions_sync(request).to_dict()
-            has_more = response['has_more']
-            added.extend(response['added'])
-            cursor = response['next_cursor']
+    while has_more:
+        request = TransactionsSyncRequest(
+            access_token=access_token,
+            cursor=cursor,
+        )
+        response = client.transactions_sync(request).to_dict()
 
-        for transaction in added:
+        for transaction in response['added'] + response['modified']:
             transaction['date'] = str(transaction['date'])
             transaction['authorized_date'] = str(transaction['authorized_date'])
 
-        return {'transactions': added, 'cursor': cursor}
+        yield {
+            'transactions': response['added'],
+            'modified': response['modified'],
+            'removed': [transaction['transaction_id'] for transaction in response['removed']],
+            'previous_cursor': cursor,
+            'cursor': response['next_cursor']
+        }
+        has_more = response['has_more']
+        cursor = response['next_cursor']
 
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return error_response
+def storeTransactions(email, result, item_id, replayed=False):
+    """
+    #Store the result of a transactions sync using the configured TRANSACTIONS_STORAGE.
+
+    #Args:
+        email (str): The email of the user.
+        result (dict): Dictionary containing the added, modified and removed transactions, the cursor they were
+                       fetched with and the updated cursor.
+        item_id (str): ID of the item the transactions were synced from.
+        replayed (bool): True if the page is fetched again after a restarted pagination, its added transactions may already be stored.
+
+    #Returns:
+        bool: True if the transactions are stored successfully, False if the user does not exist.
+    """
+    upserted = result['transactions'] + result['modified']
+    changed = bool(upserted or result['removed'])
+    """# The flag is read for every page, the aggregates can be built by a request while a sync runs"""
+    spending_built = changed and isSpendingBuilt(collection, email)
+    if spending_built:
+        """# Stored versions of the changed transactions, subtracted from the spending aggregates"""
+        changed_ids = [t['transaction_id'] for t in upserted] + result['removed']
+        if TRANSACTIONS_STORAGE == 'collection':
+            stale = getTransactionDocumentsByIds(transactionsdb, email, changed_ids)
+        else:
+            stale = getTransactionsByIds(collection, email, changed_ids, item_id)
+
+    if TRANSACTIONS_STORAGE == 'collection':
+        addTransactionDocuments(transactionsdb, email, result['transactions'], item_id,
+                                modified=result['modified'], removed=result['removed'])
+        if result['transactions'] or result['modified'] or result['removed']:
+            bumpDataVersion(collection, email)
+        stored = True
+    else:
+        stored = addTransactions(collection, email, result['transactions'], result['cursor'], item_id,
+                                 modified=result['modified'], removed=result['removed'],
+                                 previous_cursor=result.get('previous_cursor'), replayed=replayed)
+
+    if spending_built:
+        if stored:
+            updateSpending(spendingdb, email, upserted, stale)
+    elif changed and isSpendingBuilt(collection, email):
+        """# The aggregates were built while the page was stored and may or may not include it, rebuild them on the next read"""
+        invalidateSpending(collection, email)
+    return stored
+
+def loadTransactions(email, start_date=None, fields=None):
+    """
+    #Load a user's transactions using the configured TRANSACTIONS_STORAGE.
+
+    In 'collection' mode the date range and field projection are applied by MongoDB using the
+    (email, date) index and the transactions are returned newest first.
+
+    #Args:
+        email (str): The email of the user.
+        start_date (str): Optional inclusive lower bound on the date (YYYY-MM-DD), only used in 'collection' mode.
+        fields (list): Optional list of fields to load, only used in 'collection' mode.
+
+    #Returns:
+        list: List of transactions, None if the user has no transactions stored.
+    """
+    if TRANSACTIONS_STORAGE == 'collection':
+        return getTransactionDocuments(transactionsdb, email, start_date=start_date, fields=fields)
+    return getAllTransactions(collection, email)
+
+def patternStartDate(email):
+    """
+    #Find the first day of the month before the user's latest spending month.
+
+    Only used in 'collection' mode so that /api/pattern reads two months of transactions instead of the whole history.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        str: Date in YYYY-MM-DD format, None if the user has no spending transactions or storage is 'embedded'.
+    """
+    if TRANSACTIONS_STORAGE != 'collection':
+        return None
+    latest_date = getLatestTransactionDate(transactionsdb, email)
+    if latest_date is None:
+        return None
+    latest = datetime.datetime.strptime(latest_date, '%Y-%m-%d')
+    previous = latest.replace(day=1) - datetime.timedelta(days=1)
+    return previous.replace(day=1).strftime('%Y-%m-%d')
+
+# output fields of /api/transactions and the transaction fields they are read from
+TRANSACTION_FIELDS = {
+    'amount': 'amount',
+    'name': 'merchant_name',
+    'date': 'date',
+    'category': 'category',
+    'transaction_id': 'transaction_id',
+    'account_id': 'account_id',
+    'pending': 'pending',
+}
+DEFAULT_TRANSACTION_FIELDS = ['amount', 'name', 'date', 'category']
 
 @app.route('/api/transactions', methods=['GET','POST'])
+@conditional
 def get_transactions_from_db():
     """
-    #Retrieve all transactions for a user from the database.
+    #Retrieve the transactions of a user from the database, newest first.
 
-    This route accepts a GET request and expects the user's email to be provided in the request form.
-    It retrieves all transactions associated with the user from the database and returns a list of transactions.
+    This route expects the user's email to be provided in the request form.
+    Without a limit it streams all the matching transactions as a chunked JSON list, so the list is never built in memory.
+    With a limit it returns one page and an opaque token to pass as next to get the following page.
 
     #Args:
-        None (retrieves email from request)
+        email (str): The email of the user.
+        limit (int): Optional page size, greater than 0, pages larger than TRANSACTIONS_MAX_LIMIT are reduced to it.
+        next (str): Optional continuation token returned with the previous page.
+        start_date (str): Optional inclusive lower bound on the date (YYYY-MM-DD).
+        end_date (str): Optional inclusive upper bound on the date (YYYY-MM-DD).
+        account_id (str): Optional Plaid account id to restrict the transactions to.
+        fields (str): Optional comma separated list of fields to return, defaults to amount,name,date,category.
 
     #Returns:
-        JSON response containing a list of transactions.
+        JSON response containing a list of transactions, or with a limit a dictionary with the
+        'transactions' of the page and the 'next' token, None on the last page.
 
     #Raises:
         Exception: If an error occurs during the database query.
     """
     email = request.form['email']
-    if checkIfUserExits(collection, email) is False:
+    if userExists(email) is False:
         return jsonify({'error': 'User does not exist'})
+
+    fields = request.values.get('fields')
+    fields = fields.split(',') if fields else DEFAULT_TRANSACTION_FIELDS
+    if any(field not in TRANSACTION_FIELDS for field in fields):
+        return jsonify({'error': 'fields must be in ' + ','.join(TRANSACTION_FIELDS)}), 400
     try:
-        result = getAllTransactions(collection, email)
-        modified_result = []
-        max_catorgey = {}
-
-        for transaction in result:
-            modified_transaction = {
-                'amount': transaction['amount'],
-                'name': transaction['merchant_name'],
-                'date': transaction['date'],
-                'category': transaction['category'],
-            }
-            modified_result.append(modified_transaction)
+        limit = int(request.values['limit']) if request.values.get('limit') else None
+        after = decodePageToken(request.values['next']) if request.values.get('next') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or next token'}), 400
+    if limit is not None:
+        if limit <= 0:
+            return jsonify({'error': 'limit must be greater than 0'}), 400
+        limit = min(limit, TRANSACTIONS_MAX_LIMIT)
 
-        return jsonify(modified_result)
+    try:
+        result = getTransactionsPage(
+            pipelineCollection(), email, limit=limit, after=after,
+            start_date=request.values.get('start_date'), end_date=request.values.get('end_date'),
+            account_id=request.values.get('account_id'),
+            fields=[TRANSACTION_FIELDS[field] for field in fields],
+            embedded=TRANSACTIONS_STORAGE != 'collection')
+
+        if limit is None:
+            def generate():
+                yield '['
+                separator = ''
+                for transaction in result:
+                    yield separator + json.dumps(formatTransaction(transaction, fields), default=str)
+                    separator = ','
+                yield ']'
+            return Response(stream_with_context(generate()), mimetype='application/json')
+
+        page = list(result)
+        next_token = None
+        if len(page) == limit and page:
+            next_token = encodePageToken(page[-1])
+        return jsonify({'transactions': [formatTransaction(transaction, fields) for transaction in page], 'next': next_token})
     except Exception as e:
         return jsonify({'error': str(e)})
 
+def formatTransaction(transaction, fields):
+    """
+    #Build the output of /api/transactions for a stored transaction.
+
+    #Args:
+        transaction (dict): The stored transaction.
+        fields (list): Output fields to include.
+
+    #Returns:
+        dict: The transaction with the requested output fields.
+    """
+    return {field: transaction.get(TRANSACTION_FIELDS[field]) for field in fields}
+
+def encodePageToken(transaction):
+    """
+    #Encode the position of a transaction as an opaque continuation token.
+
+    #Args:
+        transaction (dict): The last transaction of a page.
+
+    #Returns:
+        str: The continuation token.
+    """
+    position = json.dumps([transaction['date'], transaction['transaction_id']])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decodePageToken(token):
+    """
+    #Decode a continuation token returned by encodePageToken.
+
+    #Args:
+        token (str): The continuation token.
+
+    #Returns:
+        tuple: The (date, transaction_id) of the last transaction of the previous page.
+
+    #Raises:
+        ValueError: If the token is not valid.
+    """
+    try:
+        date, transaction_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid continuation token')
+    return date, transaction_id
+
 @app.route('/api/expense', methods=['GET','POST'])
+@conditional
 def get_Expense():
     """
     #Retrieve a list of categories and the amount spent in each category, limited to 5.
 
     This route accepts a GET request and expects the user's email to be provided in the request form.
-    It retrieves all transactions for the user, calculates the amount spent in each category,
+    It retrieves all transactions for the user, calculates the amount spent in each category with analytics.py,
     and returns a list of the top 5 categories with their corresponding amounts and percentages.
 
     #Args:
@@ -483,158 +1166,269 @@ def get_Expense():
     """
     category_Size=5
     email = request.form['email']
-    if checkIfUserExits(collection, email) is False:
+    if userExists(email) is False:
         return jsonify({'error': 'User does not exist'})
     try:
-        result = getAllTransactions(collection, email)
-        modified_result = []
-        category_spending = {}
-        total_spending = 0
-        for transaction in result:
-            if transaction['amount'] > 0:
-                category = tuple(transaction['category'])
-                amount = transaction['amount']
-                if category in category_spending:
-                    category_spending[category] += amount
-                else:
-                    category_spending[category] = amount
-                total_spending += amount
-
-        top_categories = sorted(category_spending.items(), key=lambda x: x[1], reverse=True)[:category_Size]
-        top_categories_data = []
-
-        for category, amount in top_categories:
-            percentage = round((amount / total_spending) * 100, 2)
-            top_categories_data.append({
-                'category': category,
-                'amount': amount,
-                'percentage': percentage
-            })
+        if ANALYTICS_BACKEND == 'aggregates':
+            category_spending = loadSpending(email)
+            return jsonify(topCategories(category_spending, sum(category_spending.values()), category_Size))
+        if ANALYTICS_BACKEND == 'pipeline':
+            category_spending, total_spending = aggregateTopCategories(
+                pipelineCollection(), email, category_Size, embedded=TRANSACTIONS_STORAGE != 'collection')
+            return jsonify(topCategories(category_spending, total_spending, category_Size))
+
+        result = loadTransactions(email, fields=['amount', 'category'])
+        top_categories_data = expenseReport(result, category_Size)
 
         return jsonify(top_categories_data)
     except Exception as e:
         return jsonify({'error': str(e)})
 
 @app.route('/api/pattern', methods=['GET','POST'])
+@conditional
 def get_pattern():
+    """
+    #Retrieve the top categories of the latest month with spending and their change from the month before, limited to 4.
+
+    #Args:
+        None (retrieves email from request)
+
+    #Returns:
+        JSON response containing the list of categories with the amount spent, the percentage change and the change type.
+
+    #Raises:
+       Exception : If an error occurs during the database query.
+    """
     category_size = 4
     email = request.form['email']
-    if checkIfUserExits(collection, email) is False:
+    if userExists(email) is False:
         return jsonify({'error': 'User does not exist'})
     try:
-        result = getAllTransactions(collection, email)
-        total_spending = 0
-        current_month_transactions = {}
-        previous_month_transactions = {}
-        current_month = datetime.datetime.now().month
-        current_year = datetime.datetime.now().year
-        flag = True
-
-        # Find the last month for which the user has transactions
-        last_month = current_month - 1
-        for transaction in result:
-            if transaction['amount'] > 0:
-                category = tuple(transaction['category'])
-                amount = transaction['amount']
-                transaction_month = datetime.datetime.strptime(transaction['date'], '%Y-%m-%d').month
-                transaction_year = datetime.datetime.strptime(transaction['date'], '%Y-%m-%d').year
-
-                if current_month != transaction_month and flag:
-                    current_month = transaction_month
-                    flag = False
-
-                if transaction_year == current_year:
-                    if transaction_month == current_month:
-                        if category in current_month_transactions:
-                            current_month_transactions[category] += amount
-                        else:
-                            current_month_transactions[category] = amount
-                    elif transaction_month == current_month-1:
-                        if category in previous_month_transactions:
-                            previous_month_transactions[category] += amount
-                        else:
-                            previous_month_transactions[category] = amount
-
-                total_spending += amount
-
-        top_categories = sorted(current_month_transactions.items(), key=lambda x: x[1], reverse=True)[:category_size]
-        top_categories_data = []
-
-        for category, amount in top_categories:
-            current_month_spending = current_month_transactions.get(category, 0)
-            previous_month_spending = previous_month_transactions.get(category, 0)
-            percentage_change = round(((current_month_spending - previous_month_spending) / previous_month_spending) * 100, 2) if previous_month_spending != 0 else 0
-
-            if percentage_change > 0:
-                change_type = 'increase'
-            elif percentage_change < 0:
-                change_type = 'decrease'
-            else:
-                change_type = 'no change'
-
-            top_categories_data.append({
-                'category': category,
-                'amount': current_month_spending,
-                'percentage_change': percentage_change,
-                'change_type': change_type
-            })
+        if ANALYTICS_BACKEND == 'aggregates':
+            loadSpending(email)
+            current_month = getLatestSpendingMonth(spendingdb, email)
+            if current_month is None:
+                return jsonify([])
+            current = datetime.datetime.strptime(current_month, '%Y-%m')
+            previous_month = (current - datetime.timedelta(days=1)).strftime('%Y-%m')
+            return jsonify(categoryChanges(getSpending(spendingdb, email, current_month),
+                                           getSpending(spendingdb, email, previous_month), category_size))
+        if ANALYTICS_BACKEND == 'pipeline':
+            embedded = TRANSACTIONS_STORAGE != 'collection'
+            latest_date = aggregateLatestSpendingDate(pipelineCollection(), email, embedded=embedded)
+            if latest_date is None:
+                return jsonify([])
+            current = datetime.datetime.strptime(latest_date, '%Y-%m-%d').replace(day=1)
+            current_month = current.strftime('%Y-%m')
+            previous_month = (current - datetime.timedelta(days=1)).strftime('%Y-%m')
+            current_month_transactions, previous_month_transactions = aggregateCategoryChanges(
+                pipelineCollection(), email, current_month, previous_month, category_size, embedded=embedded)
+            return jsonify(categoryChanges(current_month_transactions, previous_month_transactions, category_size))
+
+        result = loadTransactions(email, start_date=patternStartDate(email), fields=['amount', 'category', 'date'])
+        top_categories_data = patternReport(result, category_size)
         return jsonify(top_categories_data)
     except Exception as e:
         return jsonify({'error': str(e)})
    
+def loadSpending(email):
+    """
+    #Load a user's spending per category over the whole history from the spending aggregates.
+
+    The aggregates are built from the user's transactions the first time they are needed,
+    after that every sync updates them incrementally. The build records the user's data_version,
+    and is not marked as built if a sync stored a page while the transactions were read.
+    One request builds them at a time, concurrent requests wait for its build and read its aggregates.
+
+    #Args:
+        email (str): The email of the user.
+
+    #Returns:
+        dict: Dictionary mapping category tuples to the amount spent.
+    """
+    if not userSpendingBuilt(email):
+        if claimSpendingRebuild(collection, email, SPENDING_REBUILD_TIMEOUT):
+            try:
+                data_version = (currentUser(email) or {}).get('data_version', 0)
+                rebuildSpending(collection, spendingdb, email, loadTransactions(email, fields=['amount', 'category', 'date']),
+                                data_version=data_version)
+            finally:
+                releaseSpendingRebuild(collection, email)
+        else:
+            deadline = time.monotonic() + SPENDING_REBUILD_TIMEOUT
+            while isSpendingRebuilding(collection, email) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        forgetUser(email)
+    return getSpending(spendingdb, email)
+
+def pipelineCollection():
+    """
+    #Return the collection the aggregation pipelines of ANALYTICS_BACKEND 'pipeline' run on.
+
+    #Returns:
+        collection: The transactions collection in 'collection' storage, the users collection otherwise.
+    """
+    if TRANSACTIONS_STORAGE == 'collection':
+        return transactionsdb
+    return collection
+
 @app.route('/api/Reauthenticate', methods=['POST', 'GET'])
 def reauthenticate_User():
     """
-    #Call any plaid service to check it access token is still valid.
+    #Check that the access tokens of all the user's items are still valid.
+
+    The items are checked concurrently with item_get, and the result of every check is recorded in
+    the item_health collection. A healthy item is not checked again for ITEM_HEALTH_TTL seconds, an item
+    with an error is checked on every call, so an item repaired through Link in update mode is seen at once.
+    Verified ITEM webhooks and syncs failing with an ITEM_ERROR also record the health of an item, the
+    health recorded by a webhook is trusted for ITEM_HEALTH_TTL seconds whatever its status, as item_get
+    does not report every webhook, e.g. PENDING_EXPIRATION.
 
     #Args:
         email (str): The email of the user.
 
     #Returns:
-        string: A String message to indicate that the access token is valid.
+        string: A String message to indicate that the access tokens are valid.
 
     #Raises:
-        plaid.ApiException: If an error occurs during the API call return an Link Token To reauthenticate User.
+        plaid.ApiException: If items need to be reauthenticated return an update mode link token for each of them
+        with status 525, the 'link_token' key holds the token of the first item for compatibility.
     """
     email = request.form['email']
-    accounts = getUserAccounts(collection, email)
-    access_token_reauthinticate=''
+    accounts = userAccounts(email)
 
     if accounts is None:
         return jsonify({'error': 'User does not exist'}), 404
 
-    institution_ids = []
     try:
-        for access_token in accounts:
-            access_token_reauthinticate=access_token['access_token']
-            requests = AccountsGetRequest(access_token=access_token['access_token'])
-            response = client.accounts_get(requests)
-            institution_id = response.item.institution_id
-            institution_ids.append(institution_id)
+        health = checkItemsHealth(accounts)
+        reauthenticate = [account for account in accounts if health[account['item_id']]['status'] == 'login_required']
+        if reauthenticate:
+            outcomes = runConcurrently(lambda account: createUpdateLinkToken(account['access_token']), reauthenticate)
+            items = []
+            for account, (link_token, error) in zip(reauthenticate, outcomes):
+                if error is not None:
+                    raise error
+                items.append({
+                    'item_id': account['item_id'],
+                    'error_code': health[account['item_id']]['error']['error']['error_code'],
+                    'link_token': link_token,
+                })
+            return jsonify({"link_token": items[0]['link_token'], "items": items}), 525
+
+        for account in accounts:
+            if health[account['item_id']]['status'] == 'error':
+                return jsonify(health[account['item_id']]['error']), 500
 
         return jsonify({"message":"Access Token Up to date"}), 200
     except plaid.ApiException as e:
         error_response = format_error(e)
-        if error_response['error']['error_code']=='ITEM_LOGIN_REQUIRED':
-            requestToken = LinkTokenCreateRequest(
-            client_name="Plaid Quickstart",
-            country_codes=[CountryCode('US')],
-            language='en',
-            access_token = access_token_reauthinticate,
-            user=LinkTokenCreateRequestUser(
-                client_user_id=str(time.time())
-            ))
-            response = client.link_token_create(requestToken)
-            
-            return jsonify({"link_token":response['link_token']}),525
+        return jsonify(error_response), 500
+    except FanOutTimeout as e:
+        return jsonify(format_timeout(e)), 504
+
+def checkItemsHealth(accounts):
+    """
+    #Retrieve the health of the user's items, checking concurrently the ones without a recent healthy record.
+
+    Only the outcomes of item_get that describe the item are recorded, a healthy item or an ITEM_ERROR,
+    errors of the call itself, e.g. a rate limit, are returned for this request only. Recent healthy
+    records and recent records of verified webhooks are used without a check.
+
+    #Args:
+        accounts (list): The user's accounts, with their access token and item id.
+
+    #Returns:
+        dict: Dictionary mapping item ids to their status and error.
+
+    #Raises:
+        FanOutTimeout: If the checks do not finish before the deadline.
+    """
+    records = getItemHealth(healthdb, [account['item_id'] for account in accounts], ITEM_HEALTH_TTL)
+    health = {item_id: record for item_id, record in records.items() if record['status'] == 'ok' or record.get('source') == 'webhook'}
+    unchecked = [account for account in accounts if account['item_id'] not in health]
+    outcomes = runConcurrently(lambda account: checkItem(account['access_token']), unchecked)
+    for account, (error_response, error) in zip(unchecked, outcomes):
+        if error is not None:
+            raise error
+        if error_response is None or isItemError(error_response):
+            status = recordItemHealth(healthdb, account['item_id'], error_response)
         else:
-            return jsonify(error_response), 500
+            status = itemStatus(error_response)
+        health[account['item_id']] = {'item_id': account['item_id'], 'status': status, 'error': error_response}
+    return health
+
+def checkItem(access_token):
+    """
+    #Check an item with item_get, the cheapest call reporting the item's error.
+
+    An item whose consent expires within PENDING_EXPIRATION_DAYS is reported with PENDING_EXPIRATION,
+    like the webhook Plaid sends for it, until the user renews the consent through Link in update mode.
+
+    #Args:
+        access_token (str): Access token of the item.
+
+    #Returns:
+        dict: The item error in the format of format_error, None if the item is healthy.
+    """
+    try:
+        response = client.item_get(ItemGetRequest(access_token=access_token)).to_dict()
+    except plaid.ApiException as e:
+        return format_error(e)
+    error = response['item'].get('error')
+    if not error:
+        expires = response['item'].get('consent_expiration_time')
+        if isinstance(expires, datetime.datetime):
+            if expires.tzinfo is not None:
+                expires = expires.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            if expires - datetime.datetime.utcnow() < datetime.timedelta(days=PENDING_EXPIRATION_DAYS):
+                return {
+                    'error': {
+                        'status_code': None,
+                        'display_message': 'The access consent of the item is expiring',
+                        'error_code': 'PENDING_EXPIRATION',
+                        'error_type': 'ITEM_ERROR'
+                    }
+                }
+        return None
+    return {
+        'error': {
+            'status_code': 400,
+            'display_message': error.get('error_message'),
+            'error_code': error.get('error_code'),
+            'error_type': error.get('error_type')
+        }
+    }
+
+def createUpdateLinkToken(access_token):
+    """
+    #Create an update mode link token to reauthenticate an item.
+
+    #Args:
+        access_token (str): Access token of the item.
+
+    #Returns:
+        str: The link token.
+
+    #Raises:
+        plaid.ApiException: If an error occurs while generating the link token.
+    """
+    requestToken = LinkTokenCreateRequest(
+        client_name="Plaid Quickstart",
+        country_codes=[CountryCode('US')],
+        language='en',
+        access_token=access_token,
+        user=LinkTokenCreateRequestUser(
+            client_user_id=str(time.time())
+        ))
+    response = client.link_token_create(requestToken)
+    return response['link_token']
 
 def pretty_print_response(response):
     """
-    #Pretty print a JSON response.
+    #Log a JSON response at the DEBUG level.
 
-    This function takes a JSON response and prints it in a pretty and readable format.
+    The response is sampled, redacted and written by the log writer thread of logs.py.
 
     #Args:
         response (dict): JSON response to be printed.
@@ -645,7 +1439,7 @@ def pretty_print_response(response):
     #Raises:
         None
     """
-    print(json.dumps(response, indent=2, sort_keys=True, default=str))
+    logPayload('response', response)
 
 def format_error(e):
     """
@@ -672,6 +1466,28 @@ def format_error(e):
         }
     }
 
+def format_timeout(e):
+    """
+    #Format a fan-out deadline error in the same shape as a Plaid API error.
+
+    #Args:
+        e (FanOutTimeout): The deadline exception.
+
+    #Returns:
+        dict: A dictionary containing the formatted error details.
+
+    #Raises:
+        None
+    """
+    return {
+        'error': {
+            'status_code': 504,
+            'display_message': str(e),
+            'error_code': 'REQUEST_TIMEOUT',
+            'error_type': 'API_ERROR'
+        }
+    }
+
 if __name__ == '__main__':
     """
     #The main entry point for the Flask application.
@@ -687,5 +1503,5 @@ if __name__ == '__main__':
     #Raises:
         None
     """
-    app.run(port=os.getenv('PORT', 8000))
+    create_app().run(port=os.getenv('PORT', 8000))
 
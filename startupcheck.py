@@ -0,0 +1,86 @@
+"""
+# This file contains the check of the cold start time of the server.
+
+Imports server.py in a fresh interpreter with `python -X importtime`, reports the slowest imports
+and fails if a module that should only load on first use (the Plaid SDK, numpy) is imported at
+startup, or if the import takes longer than the budget. It also reports the time from the start of
+a fresh process to the first response of `/`.
+
+#To run the check, run the following command in the terminal:
+    python startupcheck.py --budget 500
+
+startupcheck.py
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# modules that must not be imported until a request needs them
+DEFERRED_MODULES = ('plaid', 'numpy', 'urllib3')
+
+
+def importTimes():
+    """
+    #Function to import server.py in a fresh interpreter and collect the import time of every module.
+
+    #Args:
+        None
+
+    #Returns:
+        list: (module, self microseconds, cumulative microseconds) for every imported module.
+    """
+    env = dict(os.environ, BOOTSTRAP_INDEXES='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import server'],
+                            capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, module = line[len('import time:'):].split('|')
+        times.append((module.strip(), int(own), int(cumulative)))
+    return times
+
+
+def firstResponseTime():
+    """
+    #Function to measure the time from the start of a fresh process to the first response of `/`.
+
+    #Args:
+        None
+
+    #Returns:
+        float: Seconds.
+    """
+    env = dict(os.environ, BOOTSTRAP_INDEXES='0')
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', "import server; assert server.app.test_client().get('/').status_code == 200"],
+                   check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the cold start time of server.py.')
+    parser.add_argument('--budget', type=float, default=None, help='maximum import time of server.py in milliseconds')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports to report')
+    args = parser.parse_args()
+
+    times = importTimes()
+    total = next(cumulative for module, own, cumulative in times if module == 'server')
+    print(f'import server: {total / 1000:.1f} ms')
+    for module, own, cumulative in sorted(times, key=lambda t: t[1], reverse=True)[:args.top]:
+        print(f'  {own / 1000:8.1f} ms  {module}')
+    print(f'first response of /: {firstResponseTime() * 1000:.1f} ms')
+
+    failures = [f'{module} is imported at startup' for module, own, cumulative in times
+                if module in DEFERRED_MODULES]
+    if args.budget is not None and total / 1000 > args.budget:
+        failures.append(f'import server takes {total / 1000:.1f} ms, the budget is {args.budget} ms')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
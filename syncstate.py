@@ -0,0 +1,209 @@
+"""
+# This file contains functions to store the transactions sync state of every item in MongoDB.
+
+The sync state of an item is keyed by its Plaid item_id and holds the cursor, the start time of
+the last successful sync, the status of the last sync ('running' until its last page is stored), the number of added, modified and removed
+transactions and the time of the last SYNC_UPDATES_AVAILABLE webhook. An item has pending changes
+if it was never synced, its last sync failed, a webhook arrived after its last sync started or its
+last sync is older than a maximum age. Without webhooks the maximum age is 0 and every item is pending.
+
+Until a sync completes, the state also holds the cursor its pagination started with. Plaid requires a
+pagination that fails with TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION to restart from that cursor,
+and the pages fetched again after the restart are marked as replayed.
+
+these Function have no dependencies on the Flask application object, like components.py.
+
+syncstate.py
+
+"""
+
+import datetime
+
+
+def createSyncStateIndexes(state_collection):
+    """
+    #Function to create the indexes used to look up sync states.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+
+    #Returns:
+        list: Names of the indexes.
+    """
+    return [
+        state_collection.create_index([("item_id", 1)], unique=True),
+        state_collection.create_index([("email", 1)]),
+    ]
+
+
+def getSyncStates(state_collection, email):
+    """
+    #Function to retrieve the sync state of every item of a user.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        email (str): User's email address.
+
+    #Returns:
+        dict: Dictionary mapping item ids to their sync state.
+    """
+    return {state["item_id"]: state for state in state_collection.find({"email": email}, {"_id": 0})}
+
+
+def getSyncState(state_collection, item_id):
+    """
+    #Function to retrieve the sync state of an item.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        item_id (str): ID of the item.
+
+    #Returns:
+        dict: The sync state, None if the item was never synced.
+    """
+    return state_collection.find_one({"item_id": item_id}, {"_id": 0})
+
+
+def hasPendingChanges(state, max_age=None):
+    """
+    #Function to check if an item has changes that are not synced yet.
+
+    #Args:
+        state (dict): The sync state of the item, None if the item was never synced.
+        max_age (float): Optional seconds after which a synced item is synced again even without a webhook,
+                         0 when no webhook is configured, None to rely on the webhooks only.
+
+    #Returns:
+        bool: True if the item should be synced.
+    """
+    if state is None or state.get("last_synced") is None or state.get("status") != "ok":
+        return True
+    if state.get("pending_at") is not None and state["pending_at"] > state["last_synced"]:
+        return True
+    if max_age is None:
+        return False
+    return state["last_synced"] <= datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+
+
+def markSyncPending(state_collection, email, item_id):
+    """
+    #Function to record that Plaid has new changes for an item.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        email (str): User's email address.
+        item_id (str): ID of the item.
+
+    #Returns:
+        None
+    """
+    state_collection.update_one(
+        {"item_id": item_id},
+        {"$set": {"pending_at": datetime.datetime.utcnow()}, "$setOnInsert": {"email": email}},
+        upsert=True)
+
+
+def startSync(state_collection, email, item_id, cursor):
+    """
+    #Function to record the cursor a sync starts its pagination with, kept until the sync completes.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        email (str): User's email address.
+        item_id (str): ID of the item.
+        cursor (str): Cursor of the first page.
+
+    #Returns:
+        None
+    """
+    state_collection.update_one(
+        {"item_id": item_id},
+        {"$set": {"email": email, "start_cursor": cursor}},
+        upsert=True)
+
+
+def restartSync(state_collection, item_id, cursor):
+    """
+    #Function to move the cursor of an item back to the cursor its pagination started with.
+
+    The pages fetched again may hold transactions that are already stored, the sync is marked as
+    replayed until it completes.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        item_id (str): ID of the item.
+        cursor (str): Cursor the pagination started with.
+
+    #Returns:
+        None
+    """
+    state_collection.update_one(
+        {"item_id": item_id},
+        {"$set": {"cursor": cursor, "replayed": True}})
+
+
+def checkpointSync(state_collection, email, item_id, cursor, added=0, modified=0, removed=0):
+    """
+    #Function to record the cursor of a page once the page is stored, an interrupted sync resumes from it.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        email (str): User's email address.
+        item_id (str): ID of the item.
+        cursor (str): Cursor returned with the page.
+        added (int): Number of transactions added by the page.
+        modified (int): Number of transactions modified by the page.
+        removed (int): Number of transactions removed by the page.
+
+    #Returns:
+        None
+    """
+    state_collection.update_one(
+        {"item_id": item_id},
+        {"$set": {"email": email, "cursor": cursor, "status": "running"},
+         "$inc": {"added": added, "modified": modified, "removed": removed}},
+        upsert=True)
+
+
+def recordSync(state_collection, email, item_id, cursor, started, added=0, modified=0, removed=0):
+    """
+    #Function to record a successful sync of an item.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        email (str): User's email address.
+        item_id (str): ID of the item.
+        cursor (str): Cursor returned by the sync.
+        started (datetime): Time the sync started, webhooks received after it keep the item pending.
+        added (int): Number of transactions added.
+        modified (int): Number of transactions modified.
+        removed (int): Number of transactions removed.
+
+    #Returns:
+        None
+    """
+    state_collection.update_one(
+        {"item_id": item_id},
+        {"$set": {"email": email, "cursor": cursor, "last_synced": started, "status": "ok", "error": None},
+         "$unset": {"start_cursor": "", "replayed": ""},
+         "$inc": {"added": added, "modified": modified, "removed": removed}},
+        upsert=True)
+
+
+def recordSyncError(state_collection, email, item_id, error):
+    """
+    #Function to record a failed sync of an item, the cursor is kept.
+
+    #Args:
+        state_collection (collection): MongoDB sync state collection object.
+        email (str): User's email address.
+        item_id (str): ID of the item.
+        error (dict): Error returned by the sync.
+
+    #Returns:
+        None
+    """
+    state_collection.update_one(
+        {"item_id": item_id},
+        {"$set": {"email": email, "status": "error", "error": error}},
+        upsert=True)
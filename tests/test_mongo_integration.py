@@ -0,0 +1,206 @@
+"""
+# This file contains the integration tests of the MongoDB queries that mongomock cannot run.
+
+The embedded storage relies on array filters and all-positional updates, the job queue and the sync state
+on atomic updates of a real server. The tests run against the MongoDB given with MONGODB_TEST_URI, in a
+database created for every test and dropped after it, and are skipped when MONGODB_TEST_URI is not set
+or the server cannot be reached.
+
+#To run the tests, run the following command in the terminal:
+    MONGODB_TEST_URI=mongodb://localhost:27017 python -m pytest tests
+
+test_mongo_integration.py
+
+"""
+
+import datetime
+import json
+import os
+import sys
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bootstrap import bootstrap
+from components import addTransactions, resetCursor, getTransactionsByIds
+from jobs import enqueueSyncJob, claimSyncJob, renewSyncJobLease, completeSyncJob, failSyncJob
+
+MONGODB_TEST_URI = os.getenv('MONGODB_TEST_URI')
+EMAIL = 'user@example.com'
+ITEM = 'item-1'
+
+
+def transaction(transaction_id, amount):
+    return {'transaction_id': transaction_id, 'amount': amount, 'category': ['Food'], 'date': '2026-09-01',
+            'authorized_date': None, 'merchant_name': 'Merchant', 'account_id': 'account-1'}
+
+
+def storedTransactions(users):
+    entry = [entry for entry in users.find_one({'email': EMAIL})['transactions'] if entry['account_id'] == ITEM][0]
+    return entry['cursor'], sorted((t['transaction_id'], t['amount']) for t in entry['transactions'])
+
+
+@pytest.fixture(scope='module')
+def mongo():
+    if not MONGODB_TEST_URI:
+        pytest.skip('MONGODB_TEST_URI is not set')
+    client = MongoClient(MONGODB_TEST_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError as e:
+        client.close()
+        pytest.skip(f'MongoDB at MONGODB_TEST_URI is not reachable: {e}')
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def db(mongo):
+    name = 'plaid_test_' + uuid.uuid4().hex[:12]
+    database = mongo[name]
+    bootstrap(database)
+    database['users'].insert_one({'email': EMAIL, 'account': [{'access_token': 'access-1', 'item_id': ITEM}]})
+    yield database
+    mongo.drop_database(name)
+
+
+def test_embedded_page_with_modified_removed_and_replayed(db):
+    users = db['users']
+    """# First sync of the item, the entry is pushed by the $ne update"""
+    assert addTransactions(users, EMAIL, [transaction('t1', 1), transaction('t2', 2)], 'c1', ITEM, previous_cursor='')
+    assert storedTransactions(users) == ('c1', [('t1', 1), ('t2', 2)])
+
+    """# Modified and removed transactions are pulled by the array filter before the page is pushed"""
+    assert addTransactions(users, EMAIL, [transaction('t3', 3)], 'c2', ITEM,
+                           modified=[transaction('t1', 5)], removed=['t2'], previous_cursor='c1')
+    assert storedTransactions(users) == ('c2', [('t1', 5), ('t3', 3)])
+    assert [t['amount'] for t in getTransactionsByIds(users, EMAIL, ['t1'], ITEM)] == [5]
+
+    """# A replayed page holds added transactions that are already stored, they are not stored twice"""
+    resetCursor(users, EMAIL, ITEM, 'c1')
+    assert addTransactions(users, EMAIL, [transaction('t3', 4), transaction('t4', 6)], 'c2', ITEM,
+                           previous_cursor='c1', replayed=True)
+    assert storedTransactions(users) == ('c2', [('t1', 5), ('t3', 4), ('t4', 6)])
+    assert users.find_one({'email': EMAIL})['data_version'] == 3
+
+
+def test_page_is_stored_once_per_cursor(db):
+    users = db['users']
+    assert addTransactions(users, EMAIL, [transaction('t1', 1)], 'c1', ITEM, previous_cursor='')
+    page = dict(transactions=[transaction('t2', 2)], cursor='c2', account_id=ITEM, previous_cursor='c1')
+    assert addTransactions(users, EMAIL, **page)
+    """# The same page stored again, e.g. by a resumed sync, no longer matches the stored cursor"""
+    assert not addTransactions(users, EMAIL, **page)
+    assert not addTransactions(users, EMAIL, [transaction('t3', 3)], 'c3', ITEM, previous_cursor='c1')
+    assert storedTransactions(users) == ('c2', [('t1', 1), ('t2', 2)])
+
+
+class FakePlaid:
+    """
+    #Fake of the transactions_sync endpoint, fails the second page once with TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION.
+    """
+
+    def __init__(self):
+        self.cursors = []
+        self.failures = 1
+
+    def transactions_sync(self, request):
+        import plaid
+        self.cursors.append(request.cursor)
+        if request.cursor == 'c1' and self.failures:
+            self.failures -= 1
+            error = plaid.ApiException(status=400)
+            error.body = json.dumps({'error_message': 'mutation', 'error_code': 'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION',
+                                     'error_type': 'TRANSACTIONS_ERROR'})
+            raise error
+        pages = {
+            '': dict(added=[transaction('a1', 1)], modified=[], removed=[], has_more=True, next_cursor='c1'),
+            'c1': dict(added=[transaction('a2', 2)], modified=[], removed=[], has_more=False, next_cursor='c2'),
+        }
+        return FakeResponse(pages[request.cursor])
+
+
+class FakeResponse(dict):
+    def to_dict(self):
+        return dict(self)
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    os.environ.setdefault('PLAID_CLIENT_ID', 'test')
+    os.environ.setdefault('PLAID_SECRET_ID', 'test')
+    import server
+    monkeypatch.setattr(server, 'TRANSACTIONS_STORAGE', 'embedded')
+    for name, collection_name in [('collection', 'users'), ('transactionsdb', 'transactions'), ('spendingdb', 'spending'),
+                                  ('healthdb', 'item_health'), ('statedb', 'sync_state'), ('jobsdb', 'sync_jobs')]:
+        monkeypatch.setattr(server, name, db[collection_name])
+    monkeypatch.setattr(server, 'client', FakePlaid())
+    return server
+
+
+def test_sync_restarts_from_start_cursor_and_replays(app, db):
+    with app.app.app_context():
+        result = app.syncItem(EMAIL, 'access-1', ITEM)
+    assert result['error']['error_code'] == 'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION'
+    state = db['sync_state'].find_one({'item_id': ITEM})
+    assert (state['cursor'], state['start_cursor'], state['replayed']) == ('', '', True)
+    assert storedTransactions(db['users']) == ('', [('a1', 1)])
+
+    with app.app.app_context():
+        assert app.syncItem(EMAIL, 'access-1', ITEM) is True
+    assert app.client.cursors == ['', 'c1', '', 'c1']
+    state = db['sync_state'].find_one({'item_id': ITEM})
+    assert state['cursor'] == 'c2' and 'start_cursor' not in state and 'replayed' not in state
+    assert storedTransactions(db['users']) == ('c2', [('a1', 1), ('a2', 2)])
+
+
+def test_job_claim_lease_renewal_and_expiry(db):
+    jobs = db['sync_jobs']
+    job_id = enqueueSyncJob(jobs, EMAIL, ITEM)
+    assert enqueueSyncJob(jobs, EMAIL, ITEM) == job_id
+    job = claimSyncJob(jobs, 'worker-1', lease_seconds=60)
+    assert (job['_id'], job['worker'], job['attempts']) == (job_id, 'worker-1', 1)
+    assert claimSyncJob(jobs, 'worker-2', lease_seconds=60) is None
+    assert renewSyncJobLease(jobs, job_id, 'worker-1', lease_seconds=60)
+
+    """# The worker died, once its lease expired the job is claimed by another worker"""
+    jobs.update_one({'_id': job_id}, {'$set': {'lease_expires': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)}})
+    job = claimSyncJob(jobs, 'worker-2', lease_seconds=60)
+    assert (job['_id'], job['worker'], job['attempts']) == (job_id, 'worker-2', 2)
+    assert not renewSyncJobLease(jobs, job_id, 'worker-1', lease_seconds=60)
+
+    """# A change reported while the job runs is a new job, claimed once the running job is done"""
+    next_job_id = enqueueSyncJob(jobs, EMAIL, ITEM)
+    assert next_job_id != job_id
+    assert claimSyncJob(jobs, 'worker-3', lease_seconds=60) is None
+    assert completeSyncJob(jobs, job_id)
+    assert jobs.find_one({'_id': job_id})['status'] == 'done'
+    assert claimSyncJob(jobs, 'worker-3', lease_seconds=60)['_id'] == next_job_id
+
+
+def test_failed_job_is_retried_after_backoff(db):
+    jobs = db['sync_jobs']
+    job_id = enqueueSyncJob(jobs, EMAIL, ITEM)
+    job = claimSyncJob(jobs, 'worker-1', lease_seconds=60)
+    assert failSyncJob(jobs, job_id, {'error_code': 'ERROR'}, max_attempts=2, attempts=job['attempts'], retry_delay=60)
+    assert claimSyncJob(jobs, 'worker-1', lease_seconds=60) is None
+
+    jobs.update_one({'_id': job_id}, {'$set': {'not_before': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)}})
+    job = claimSyncJob(jobs, 'worker-1', lease_seconds=60)
+    assert job['attempts'] == 2
+    assert not failSyncJob(jobs, job_id, {'error_code': 'ERROR'}, max_attempts=2, attempts=job['attempts'], retry_delay=60)
+    assert jobs.find_one({'_id': job_id})['status'] == 'failed'
+
+
+def test_embedded_transactions_moved_to_collection(db):
+    users = db['users']
+    addTransactions(users, EMAIL, [transaction('t1', 1), transaction('t2', 2)], 'c1', ITEM, previous_cursor='')
+    bootstrap(db, 'collection')
+    documents = list(db['transactions'].find({}, {'email': 1, 'item': 1, 'amount': 1}).sort('_id', 1))
+    assert documents == [{'_id': 't1', 'email': EMAIL, 'item': ITEM, 'amount': 1},
+                         {'_id': 't2', 'email': EMAIL, 'item': ITEM, 'amount': 2}]
+    assert users.find_one({'email': EMAIL})['transactions'] == [{'account_id': ITEM, 'cursor': 'c1'}]
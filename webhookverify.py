@@ -0,0 +1,132 @@
+"""
+# This file contains the verification of the webhooks Plaid sends to /api/webhook.
+
+Plaid signs every webhook with an ES256 JWT in the Plaid-Verification header. The header of the JWT
+names the key it is signed with, which is fetched from Plaid with /webhook_verification_key/get and
+cached, and its claims hold the time it was issued and the SHA-256 of the body. A webhook is verified
+if the signature is valid, the key has not expired, the JWT was issued less than max_age seconds ago
+and the body matches the hash. A key id Plaid does not know is remembered for a short time, so forged
+headers naming it do not each cost a call to Plaid.
+
+The signature is checked with PyJWT and cryptography (pip install "pyjwt[crypto]"), imported on the
+first verification. Without them no webhook is verified.
+
+webhookverify.py
+
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+
+def loadJwt():
+    """
+    #Function to import PyJWT with its cryptography backend.
+
+    #Args:
+        None
+
+    #Returns:
+        module: The jwt module, None if PyJWT or cryptography is not installed.
+    """
+    try:
+        import jwt
+        import jwt.algorithms
+    except ImportError:
+        return None
+    return jwt if jwt.algorithms.has_crypto else None
+
+
+class WebhookVerifier:
+    """
+    #Verifier of the Plaid-Verification header of webhooks, with a cache of the verification keys.
+
+    #Args:
+        fetch_key (callable): Called with a key id, returns the key as a JWK dictionary or None if it does not exist,
+                              raises if the key could not be fetched.
+        max_age (float): Seconds after it was issued that a webhook is still accepted.
+        key_ttl (float): Seconds a fetched key is cached, after that it is fetched again to see if it expired.
+        missing_ttl (float): Seconds a key id Plaid does not know is not fetched again.
+        max_missing (int): Maximum number of unknown key ids remembered.
+    """
+
+    def __init__(self, fetch_key, max_age=300, key_ttl=3600, missing_ttl=60, max_missing=1000):
+        self.fetch_key = fetch_key
+        self.max_age = max_age
+        self.key_ttl = key_ttl
+        self.missing_ttl = missing_ttl
+        self.max_missing = max_missing
+        self.keys = {}
+        self.missing = {}
+        self.lock = threading.Lock()
+
+    def getKey(self, key_id):
+        """
+        #Function to get a verification key from the cache, or from Plaid if it is not cached or too old.
+
+        A key id Plaid does not know is not fetched again for missing_ttl seconds. A failed fetch is not
+        remembered, the key is fetched again by the next webhook.
+
+        #Args:
+            key_id (str): ID of the key, the kid of the JWT header.
+
+        #Returns:
+            dict: The key as a JWK dictionary, None if Plaid does not know the key or it could not be fetched.
+        """
+        now = time.monotonic()
+        with self.lock:
+            cached = self.keys.get(key_id)
+            missing_since = self.missing.get(key_id)
+        if cached is not None and now - cached[1] < self.key_ttl:
+            return cached[0]
+        if missing_since is not None and now - missing_since < self.missing_ttl:
+            return None
+        try:
+            key = self.fetch_key(key_id)
+        except Exception:
+            return None
+        with self.lock:
+            if key is not None:
+                self.keys[key_id] = (key, now)
+                self.missing.pop(key_id, None)
+            else:
+                if len(self.missing) >= self.max_missing:
+                    self.missing = {kid: since for kid, since in self.missing.items() if now - since < self.missing_ttl}
+                if len(self.missing) < self.max_missing:
+                    self.missing[key_id] = now
+        return key
+
+    def verify(self, body, token):
+        """
+        #Function to verify a webhook.
+
+        #Args:
+            body (bytes): The raw body of the webhook request.
+            token (str): The Plaid-Verification header.
+
+        #Returns:
+            bool: True if the webhook was sent by Plaid, False otherwise.
+        """
+        jwt = loadJwt()
+        if jwt is None or not token:
+            return False
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError:
+            return False
+        if header.get('alg') != 'ES256' or not header.get('kid'):
+            return False
+        key = self.getKey(header['kid'])
+        if key is None or key.get('expired_at'):
+            return False
+        try:
+            public_key = jwt.algorithms.ECAlgorithm.from_jwk(json.dumps(key, default=str))
+            claims = jwt.decode(token, public_key, algorithms=['ES256'], options={'require': ['iat']})
+        except (jwt.InvalidTokenError, ValueError, TypeError):
+            return False
+        if time.time() - claims['iat'] > self.max_age:
+            return False
+        return hmac.compare_digest(hashlib.sha256(body).hexdigest(), str(claims.get('request_body_sha256', '')))
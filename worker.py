@@ -0,0 +1,153 @@
+"""
+    #This module contains the background worker that runs transactions sync jobs.
+
+    Jobs are enqueued by /api/transactions/update and by the SYNC_UPDATES_AVAILABLE webhook,
+    and stored in the sync_jobs collection. Every worker process claims one job at a time,
+    runs server.syncUserItem for it and records the outcome. The lease of the job is renewed after
+    every page, so a long initial sync is not claimed again while it runs.
+
+    #environment variables:
+        - same as server.py
+        - SYNC_WORKER_POLL_INTERVAL from .env (optional, seconds to wait when the queue is empty)
+        - SYNC_JOB_LEASE from .env (optional, seconds before a running job can be claimed again)
+        - SYNC_JOB_MAX_ATTEMPTS from .env (optional)
+        - SYNC_JOB_RETRY_DELAY from .env (optional, seconds before a failed job is retried, doubled for every attempt)
+
+    On SIGTERM or SIGINT a worker finishes the job it is running and exits, a job that is interrupted
+    anyway is claimed again by another worker once its lease expires.
+
+    #To run two worker processes, run the following command in the terminal:
+        python worker.py --processes 2
+
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+SYNC_WORKER_POLL_INTERVAL = float(os.getenv('SYNC_WORKER_POLL_INTERVAL', 2))
+SYNC_JOB_LEASE = int(os.getenv('SYNC_JOB_LEASE', 300))
+SYNC_JOB_MAX_ATTEMPTS = int(os.getenv('SYNC_JOB_MAX_ATTEMPTS', 3))
+SYNC_JOB_RETRY_DELAY = float(os.getenv('SYNC_JOB_RETRY_DELAY', 30))
+
+# set when the process is asked to stop, the running job is finished first
+stopping = threading.Event()
+
+
+def requestStop(signum, frame):
+    """
+    #Signal handler that stops the worker after the job it is running.
+
+    #Args:
+        signum (int): The signal number.
+        frame (frame): The current stack frame.
+
+    #Returns:
+        None
+    """
+    stopping.set()
+
+
+def runJob(server, job, worker_id):
+    """
+    #Run a claimed job and record whether it is done or failed.
+
+    If the lease of the job is lost, another worker has claimed it, and the job is left to that worker.
+
+    #Args:
+        server (module): The server module, imported by the worker process.
+        job (dict): The claimed job.
+        worker_id (str): ID of the worker that claimed the job.
+
+    #Returns:
+        bool: True if the sync succeeded, False otherwise.
+    """
+    from jobs import LeaseLost, completeSyncJob, failSyncJob, renewSyncJobLease
+    from logs import logEvent
+
+    def renewLease():
+        if not renewSyncJobLease(server.jobsdb, job['_id'], worker_id, lease_seconds=SYNC_JOB_LEASE):
+            raise LeaseLost(f"job {job['_id']} was claimed by another worker")
+
+    try:
+        outcome = server.syncUserItem(job['email'], job['item_id'], on_page=renewLease)
+    except LeaseLost as e:
+        logEvent(logging.WARNING, 'sync_job_lease_lost', job_id=str(job['_id']), item_id=job['item_id'], error=str(e))
+        return False
+    except Exception as e:
+        logEvent(logging.ERROR, 'sync_job_crashed', exc_info=e, job_id=str(job['_id']), item_id=job['item_id'])
+        outcome = {'error': str(e)}
+    if isinstance(outcome, dict) and 'error' in outcome:
+        failSyncJob(server.jobsdb, job['_id'], outcome['error'], max_attempts=SYNC_JOB_MAX_ATTEMPTS,
+                    attempts=job['attempts'], retry_delay=SYNC_JOB_RETRY_DELAY)
+        return False
+    completeSyncJob(server.jobsdb, job['_id'], {'stored': outcome})
+    return True
+
+
+def runWorker(worker_id, once=False):
+    """
+    #Claim and run jobs until the process is asked to stop.
+
+    The server module is imported here so that every worker process opens its own MongoDB connection.
+    Every job runs in its own app context so the users loaded by server.currentUser are not reused across jobs.
+
+    #Args:
+        worker_id (str): ID recorded on the claimed jobs.
+        once (bool): Stop when the queue is empty instead of polling.
+
+    #Returns:
+        None
+    """
+    signal.signal(signal.SIGTERM, requestStop)
+    signal.signal(signal.SIGINT, requestStop)
+    import server
+    from jobs import claimSyncJob
+    app = server.create_app()
+    try:
+        while not stopping.is_set():
+            job = claimSyncJob(server.jobsdb, worker_id, lease_seconds=SYNC_JOB_LEASE)
+            if job is None:
+                if once:
+                    return
+                stopping.wait(SYNC_WORKER_POLL_INTERVAL)
+                continue
+            with app.app_context():
+                runJob(server, job, worker_id)
+    finally:
+        server.closeClients()
+        from logs import stopLogging
+        stopLogging()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run transactions sync workers.')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    args = parser.parse_args()
+
+    prefix = f'{socket.gethostname()}-{os.getpid()}'
+    if args.processes == 1:
+        runWorker(prefix, once=args.once)
+    else:
+        processes = [multiprocessing.Process(target=runWorker, args=(f'{prefix}-{i}', args.once))
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+
+        def stopProcesses(signum, frame):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, stopProcesses)
+        signal.signal(signal.SIGINT, stopProcesses)
+        for process in processes:
+            process.join()
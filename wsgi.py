@@ -0,0 +1,17 @@
+"""
+# This file contains the WSGI entry point used by production servers.
+
+The app is created with server.create_app. The MongoDB and Plaid clients are created on first use
+in every worker process, so the app can be preloaded by the master of a pre-forking server, except
+with gevent workers, see gunicorn.conf.py.
+
+#To run the server with gunicorn, using the settings of gunicorn.conf.py, run the following command in the terminal:
+    gunicorn wsgi:app
+
+wsgi.py
+
+"""
+
+from server import create_app
+
+app = create_app()